@@ -18,6 +18,7 @@ from predict_testing import Predict
 from trains import Trains
 from category import category_extract, SIMPLE_CATEGORY_MODEL
 from utils.category_frequency_statistics import fetch_category_list
+from utils.tfrecord import dataset_exists
 from gui.utils import LayoutGUI
 from gui.data_augmentation import DataAugmentationDialog
 from gui.pretreatment import PretreatmentDialog
@@ -1387,13 +1388,13 @@ class Wizard:
             )
             return False
         for tp in trains_path:
-            if not os.path.exists(tp):
+            if not dataset_exists(tp):
                 messagebox.showerror(
                     "Error!", "Training set path does not exist, please make dataset first"
                 )
                 return False
         for vp in validation_path:
-            if not os.path.exists(vp):
+            if not dataset_exists(vp):
                 messagebox.showerror(
                     "Error!", "Validation set path does not exist, please make dataset first"
                 )
@@ -11,6 +11,7 @@ import threading
 from category import *
 from constants import *
 from exception import exception, ConfigException
+from pretreatment import ExecMap
 
 # Your CPU supports instructions that this TensorFlow binary was not compiled to use: AVX2
 # If you have a GPU, you shouldn't care about AVX support.
@@ -110,6 +111,22 @@ LABEL_FROM_MAP = {
     'TXT': LabelFrom.TXT
 }
 
+DATA_PIPELINE_MAP = {
+    'Feed': DataPipeline.Feed,
+    'Graph': DataPipeline.Graph,
+    'Process': DataPipeline.Process
+}
+
+INPUT_DTYPE_MAP = {
+    'Float32': InputDType.Float32,
+    'UInt8': InputDType.UInt8
+}
+
+DATASET_FORMAT_MAP = {
+    'Bytes': DatasetFormat.Bytes,
+    'Tensor': DatasetFormat.Tensor
+}
+
 EXCEPT_FORMAT_MAP = {
     ModelField.Image: 'png',
     ModelField.Text: 'csv'
@@ -158,7 +175,55 @@ class PretreatmentEntity:
     exec_map: dict = {}
 
 
+class DerivedProperty(object):
+    """
+    由配置参数派生的只读属性：首次访问时计算并缓存，
+    依赖的参数被重新赋值 (read_conf/new/手动修改) 时自动失效
+    """
+
+    def __init__(self, *sources):
+        """
+        :param sources: 依赖的配置参数名
+        """
+        self.sources = sources
+        self.func = None
+        self.name = None
+
+    def __call__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+        return self
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        if 'derived_dependents' not in owner.__dict__:
+            owner.derived_dependents = {}
+        for source in self.sources:
+            owner.derived_dependents.setdefault(source, []).append(name)
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        cache = instance.__dict__.setdefault('derived_cache', {})
+        if self.name not in cache:
+            cache[self.name] = self.func(instance)
+        return cache[self.name]
+
+
 class ModelConfig:
+    """PROJECT"""
+    project_path: str
+    output_path: str
+    compile_conf_path: str
+    model_root_path: str
+    model_conf_path: str
+    dataset_root_path: str
+    checkpoint_tag: str
+    evaluation_path: str
+    is_dev: bool
+    sync_checkpoint: bool
+    source_conf: dict
+
     """MODEL"""
     model_root: dict
     model_name: str
@@ -169,6 +234,7 @@ class ModelConfig:
     """SYSTEM"""
     system_root: dict
     memory_usage: float
+    model_version: object
     save_model: str
     save_checkpoint: str
 
@@ -183,6 +249,7 @@ class ModelConfig:
     max_label_num: int
     auto_padding: bool
     output_split: str
+    input_dtype_param: str
 
     """NEURAL NETWORK"""
     neu_network_root: dict
@@ -206,7 +273,7 @@ class ModelConfig:
     source_path_root: dict
     trains_path: dict = {DatasetType.TFRecords: [], DatasetType.Directory: []}
     validation_path: dict = {DatasetType.TFRecords: [], DatasetType.Directory: []}
-    dataset_map = {
+    dataset_map: dict = {
         RunMode.Trains: trains_path,
         RunMode.Validation: validation_path
     }
@@ -221,6 +288,18 @@ class ModelConfig:
     trains_learning_rate: float
     batch_size: int
     validation_batch_size: int
+    data_pipeline_param: str
+    dataset_format_param: str
+    data_workers: int
+    validation_cache: bool
+    dataset_shards: int
+    global_shuffle: bool
+    width_buckets: list
+    prefetch_batches: int
+    summary_steps: int
+    histogram_steps: int
+    image_summary_steps: int
+    external_evaluator: bool
 
     """DATA AUGMENTATION"""
     data_augmentation_root: dict
@@ -248,13 +327,24 @@ class ModelConfig:
     pre_horizontal_stitching: bool
     pre_concat_frames: object
     pre_blend_frames: object
-    pre_exec_map = dict = {}
+    pre_exec_map: dict = {}
 
     """COMPILE_MODEL"""
     compile_model_path: str
 
-    def __init__(self, project_name, project_path=None, is_dev=True, **argv):
+    def __init__(self, project_name, project_path=None, is_dev=True, source_conf: dict = None,
+                 sync_checkpoint=True, **argv):
+        """
+        :param project_name: 工程名
+        :param project_path: 工程路径
+        :param is_dev: 是否读取开发配置 (否则读取编译配置)
+        :param source_conf: 配置字典 (如 .pl 模型包中的配置)，传入时不读写工程目录
+        :param sync_checkpoint: checkpoint 文件失效时是否按模型目录中的存储重建 (只读的评估进程不应修改)
+        """
+        self.conf_cache = None
         self.is_dev = is_dev
+        self.sync_checkpoint = sync_checkpoint
+        self.source_conf = source_conf
         self.project_path = project_path if project_path else "./projects/{}".format(project_name)
         self.output_path = os.path.join(self.project_path, 'out')
         self.compile_conf_path = os.path.join(self.output_path, 'model')
@@ -263,6 +353,11 @@ class ModelConfig:
         self.model_conf_path = os.path.join(self.project_path, MODEL_CONFIG_NAME)
         self.dataset_root_path = os.path.join(self.project_path, 'dataset')
         self.checkpoint_tag = 'checkpoint'
+        self.evaluation_path = os.path.join(self.model_root_path, 'evaluation.json')
+
+        if self.source_conf is not None:
+            self.read_conf()
+            return
 
         if not os.path.exists(self.project_path):
             os.makedirs(self.project_path)
@@ -311,6 +406,7 @@ class ModelConfig:
         self.max_label_num = self.field_root.get('MaxLabelNum')
         self.auto_padding = self.field_root.get('AutoPadding')
         self.output_split = self.field_root.get('OutputSplit')
+        self.input_dtype_param = self.field_root.get('InputDType')
 
         """NEURAL NETWORK"""
         self.neu_network_root = self.conf['NeuralNet']
@@ -362,6 +458,24 @@ class ModelConfig:
         self.batch_size = self.batch_size if self.batch_size else 64
         self.validation_batch_size = self.trains_root.get('ValidationBatchSize')
         self.validation_batch_size = self.validation_batch_size if self.validation_batch_size else 300
+        self.data_pipeline_param = self.trains_root.get('DataPipeline')
+        self.dataset_format_param = self.trains_root.get('DatasetFormat')
+        self.data_workers = self.trains_root.get('DataWorkers')
+        self.data_workers = self.data_workers if self.data_workers else os.cpu_count()
+        self.validation_cache = bool(self.trains_root.get('ValidationCache'))
+        self.dataset_shards = self.trains_root.get('DatasetShards')
+        self.dataset_shards = self.dataset_shards if self.dataset_shards else 1
+        self.global_shuffle = bool(self.trains_root.get('GlobalShuffle'))
+        self.width_buckets = self.trains_root.get('WidthBuckets')
+        self.prefetch_batches = self.trains_root.get('PrefetchBatches')
+        self.prefetch_batches = self.prefetch_batches if self.prefetch_batches else 0
+        self.summary_steps = self.trains_root.get('SummarySteps')
+        self.summary_steps = self.summary_steps if self.summary_steps else 0
+        self.histogram_steps = self.trains_root.get('HistogramSteps')
+        self.histogram_steps = self.histogram_steps if self.histogram_steps else 0
+        self.image_summary_steps = self.trains_root.get('ImageSummarySteps')
+        self.image_summary_steps = self.image_summary_steps if self.image_summary_steps else 0
+        self.external_evaluator = bool(self.trains_root.get('ExternalEvaluator'))
 
         """DATA AUGMENTATION"""
         self.data_augmentation_root = self.conf['DataAugmentation']
@@ -397,9 +511,10 @@ class ModelConfig:
         """COMPILE_MODEL"""
         self.compile_model_path = os.path.join(self.output_path, 'graph')
         self.compile_model_path = self.compile_model_path.replace("\\", "/")
-        self.check_field()
+        if self.source_conf is None:
+            self.check_field()
 
-    @property
+    @DerivedProperty('model_field_param')
     def model_field(self) -> ModelField:
         return ModelConfig.param_convert(
             source=self.model_field_param,
@@ -408,7 +523,7 @@ class ModelConfig:
             code=ConfigException.MODEL_FIELD_NOT_SUPPORTED
         )
 
-    @property
+    @DerivedProperty('model_scene_param')
     def model_scene(self) -> ModelScene:
         return ModelConfig.param_convert(
             source=self.model_scene_param,
@@ -417,7 +532,7 @@ class ModelConfig:
             code=ConfigException.MODEL_SCENE_NOT_SUPPORTED
         )
 
-    @property
+    @DerivedProperty('neu_cnn_param')
     def neu_cnn(self) -> CNNNetwork:
         return ModelConfig.param_convert(
             source=self.neu_cnn_param,
@@ -426,7 +541,7 @@ class ModelConfig:
             code=ConfigException.NETWORK_NOT_SUPPORTED
         )
 
-    @property
+    @DerivedProperty('neu_recurrent_param')
     def neu_recurrent(self) -> RecurrentNetwork:
         return ModelConfig.param_convert(
             source=self.neu_recurrent_param,
@@ -435,7 +550,7 @@ class ModelConfig:
             code=ConfigException.NETWORK_NOT_SUPPORTED
         )
 
-    @property
+    @DerivedProperty('neu_optimizer_param')
     def neu_optimizer(self) -> Optimizer:
         return ModelConfig.param_convert(
             source=self.neu_optimizer_param,
@@ -444,7 +559,7 @@ class ModelConfig:
             code=ConfigException.NETWORK_NOT_SUPPORTED
         )
 
-    @property
+    @DerivedProperty('loss_func_param')
     def loss_func(self) -> LossFunction:
         return ModelConfig.param_convert(
             source=self.loss_func_param,
@@ -453,7 +568,7 @@ class ModelConfig:
             code=ConfigException.LOSS_FUNC_NOT_SUPPORTED,
         )
 
-    @property
+    @DerivedProperty('label_from_param')
     def label_from(self) -> LabelFrom:
         return ModelConfig.param_convert(
             source=self.label_from_param,
@@ -462,12 +577,60 @@ class ModelConfig:
             code=ConfigException.ERROR_LABEL_FROM,
         )
 
-    @property
+    @DerivedProperty('data_pipeline_param')
+    def data_pipeline(self) -> DataPipeline:
+        return ModelConfig.param_convert(
+            source=self.data_pipeline_param,
+            param_map=DATA_PIPELINE_MAP,
+            text="This data pipeline ({param}) is not supported at this time.".format(param=self.data_pipeline_param),
+            code=ConfigException.DATA_PIPELINE_NOT_SUPPORTED,
+            default=DataPipeline.Feed
+        )
+
+    @DerivedProperty('dataset_format_param')
+    def dataset_format(self) -> DatasetFormat:
+        return ModelConfig.param_convert(
+            source=self.dataset_format_param,
+            param_map=DATASET_FORMAT_MAP,
+            text="This dataset format ({param}) is not supported at this time.".format(param=self.dataset_format_param),
+            code=ConfigException.DATASET_FORMAT_NOT_SUPPORTED,
+            default=DatasetFormat.Bytes
+        )
+
+    @DerivedProperty('input_dtype_param')
+    def input_dtype(self) -> InputDType:
+        return ModelConfig.param_convert(
+            source=self.input_dtype_param,
+            param_map=INPUT_DTYPE_MAP,
+            text="This input dtype ({param}) is not supported at this time.".format(param=self.input_dtype_param),
+            code=ConfigException.INPUT_DTYPE_NOT_SUPPORTED,
+            default=InputDType.Float32
+        )
+
+    @DerivedProperty('input_dtype_param')
+    def input_width_axis(self) -> int:
+        """编码后图片宽度所在的维度：float32 输入为 [宽, 高, 通道]，uint8 输入为 [高, 宽, 通道]"""
+        return 1 if self.input_dtype == InputDType.UInt8 else 0
+
+    @DerivedProperty('pre_exec_map')
+    def pre_exec_ops(self) -> ExecMap:
+        """预编译的 ExecuteMap，每个工程配置只编译一次"""
+        return ExecMap(self.pre_exec_map)
+
+    def resized_width(self, width, height) -> int:
+        """原图尺寸缩放后的宽度，与 Encoder.image 的缩放规则一致，尺寸未知时返回0"""
+        if self.resize[0] != -1:
+            return self.resize[0]
+        if not height:
+            return 0
+        return int(self.resize[1] / height * width)
+
+    @DerivedProperty('category_param')
     def category(self) -> list:
         category_value = category_extract(self.category_param)
         return SPACE_TOKEN + category_value
 
-    @property
+    @DerivedProperty('category_param')
     def category_num(self) -> int:
         return len(self.category)
 
@@ -492,28 +655,72 @@ class ModelConfig:
         if not os.path.exists(self.model_root_path):
             os.makedirs(self.model_root_path)
 
-        model_file = ModelConfig.checkpoint(self.model_name, self.model_root_path)
-        checkpoint = 'model_checkpoint_path: {}\nall_model_checkpoint_paths: {}'.format(model_file, model_file)
+        if not self.sync_checkpoint:
+            return
+        checkpoints = ModelConfig.checkpoints(self.model_name, self.model_root_path)
+        if ModelConfig.checkpoint_available(self.save_checkpoint, self.model_root_path):
+            # 存储状态由训练任务维护，仍然有效时不再重写，避免中断的训练无法恢复
+            return
+        if not checkpoints:
+            if os.path.exists(self.save_checkpoint):
+                os.remove(self.save_checkpoint)
+            return
+        checkpoint = 'model_checkpoint_path: {}\n'.format(checkpoints[-1]) + ''.join(
+            'all_model_checkpoint_paths: {}\n'.format(model_file) for model_file in checkpoints
+        )
         with open(self.save_checkpoint, 'w') as f:
             f.write(checkpoint)
 
+    @staticmethod
+    def checkpoints(_name, _path):
+        """按步数升序返回模型目录中的存储，以 .index 文件为准 (异步存储不写入 .meta 文件)"""
+        pattern = re.compile(r'^{}\.model-(\d+)\.index$'.format(re.escape(_name)))
+        checkpoint_group = [(pattern.match(i), i) for i in os.listdir(_path)]
+        checkpoint_group = sorted((int(m.group(1)), i[:-len('.index')]) for m, i in checkpoint_group if m)
+        return ['"{}"'.format(i) for _, i in checkpoint_group]
+
     @staticmethod
     def checkpoint(_name, _path):
-        file_list = os.listdir(_path)
-        checkpoint_group = [
-            '"{}"'.format(i.split(".meta")[0]) for i in file_list if
-            _name + ".model" in i and i.endswith('.meta')
-        ]
-        if not checkpoint_group:
-            return None
-        checkpoint_step = [int(re.search('(?<=model-).*?(?=")', i).group()) for i in checkpoint_group]
-        return checkpoint_group[checkpoint_step.index(max(checkpoint_step))]
+        checkpoint_group = ModelConfig.checkpoints(_name, _path)
+        return checkpoint_group[-1] if checkpoint_group else None
+
+    @staticmethod
+    def checkpoint_available(checkpoint_path, _path):
+        """checkpoint 文件是否存在且其最新存储可读取"""
+        if not os.path.exists(checkpoint_path):
+            return False
+        with open(checkpoint_path, 'r', encoding='utf8') as f:
+            model_file = re.search(r'^model_checkpoint_path:\s*"(.+)"\s*$', f.read(), re.M)
+        if not model_file:
+            return False
+        model_file = model_file.group(1)
+        model_file = model_file if os.path.isabs(model_file) else os.path.join(_path, model_file)
+        return os.path.exists(model_file + '.index')
 
     @property
     def conf(self) -> dict:
-        with open(self.model_conf_path if self.is_dev else self.compile_conf_path, 'r', encoding="utf-8") as sys_fp:
-            sys_stream = sys_fp.read()
-            return yaml.load(sys_stream, Loader=yaml.SafeLoader)
+        """配置文件只在修改后重新解析"""
+        if self.source_conf is not None:
+            return self.source_conf
+        conf_path = self.model_conf_path if self.is_dev else self.compile_conf_path
+        conf_stat = os.stat(conf_path)
+        conf_key = (conf_path, conf_stat.st_mtime_ns, conf_stat.st_size)
+        if self.conf_cache is None or self.conf_cache[0] != conf_key:
+            with open(conf_path, 'r', encoding="utf-8") as sys_fp:
+                sys_stream = sys_fp.read()
+                self.conf_cache = (conf_key, yaml.load(sys_stream, Loader=yaml.SafeLoader))
+        return self.conf_cache[1]
+
+    def __setattr__(self, key, value):
+        object.__setattr__(self, key, value)
+        derived_cache = self.__dict__.get('derived_cache')
+        if derived_cache:
+            for name in self.derived_dependents.get(key, []):
+                derived_cache.pop(name, None)
+
+    def freeze(self) -> 'FrozenModelConfig':
+        """只读快照，用于传入工作进程"""
+        return FrozenModelConfig(self)
 
     @staticmethod
     def list_param(params, intent=6):
@@ -561,6 +768,7 @@ class ModelConfig:
                 MaxLabelNum=self.max_label_num,
                 AutoPadding=self.auto_padding,
                 OutputSplit=self.val_filter(self.output_split),
+                InputDType=self.input_dtype.value,
                 LabelFrom=self.label_from.value,
                 ExtractRegex=self.val_filter(self.extract_regex),
                 LabelSplit=self.val_filter(self.label_split),
@@ -577,6 +785,18 @@ class ModelConfig:
                 BatchSize=self.batch_size,
                 ValidationBatchSize=self.validation_batch_size,
                 LearningRate=self.trains_learning_rate,
+                DataPipeline=self.data_pipeline.value,
+                DatasetFormat=self.dataset_format.value,
+                DataWorkers=self.val_filter(self.data_workers),
+                ValidationCache=bool(self.validation_cache),
+                DatasetShards=self.val_filter(self.dataset_shards),
+                GlobalShuffle=bool(self.global_shuffle),
+                WidthBuckets=json.dumps(self.width_buckets) if self.width_buckets else 'null',
+                PrefetchBatches=self.val_filter(self.prefetch_batches),
+                SummarySteps=self.val_filter(self.summary_steps),
+                HistogramSteps=self.val_filter(self.histogram_steps),
+                ImageSummarySteps=self.val_filter(self.image_summary_steps),
+                ExternalEvaluator=bool(self.external_evaluator),
                 DA_Binaryzation=self.da_binaryzation,
                 DA_MedianBlur=self.da_median_blur,
                 DA_GaussianBlur=self.da_gaussian_blur,
@@ -611,22 +831,13 @@ class ModelConfig:
         self.update(model_conf_path=compiled_config_path, model_name=target_model_name)
 
     def dataset_increasing_name(self, mode: RunMode):
+        """下一个增量数据集文件名，分片数据集的分片文件与清单按所属数据集计算序号"""
         dataset_group = os.listdir(self.dataset_root_path)
-        if len([i for i in dataset_group if i.startswith(mode.value)]) < 1:
-            return "Trains.0.tfrecords" if mode == RunMode.Trains else "Validation.0.tfrecords"
-        name_split = [i.split(".") for i in dataset_group if mode.value in i]
-        if not name_split:
-            name_split = [mode.value, "0", ".tfrecords"]
-        try:
-            last_index = max([int(i[1]) for i in name_split])
-        except ValueError as e:
-            print(e)
-            last_index = -1
-
-        current_index = last_index + 1
-        name_prefix = name_split[0][0]
-        name_suffix = name_split[0][2]
-        return "{}.{}.{}".format(name_prefix, current_index, name_suffix)
+        indexes = [
+            int(i.group(1)) for i in [re.match(r"{}\.(\d+)\.tfrecords".format(mode.value), n) for n in dataset_group] if i
+        ]
+        current_index = max(indexes) + 1 if indexes else 0
+        return "{}.{}.tfrecords".format(mode.value, current_index)
 
     def new(self, **argv):
         self.memory_usage = argv.get('MemoryUsage')
@@ -657,6 +868,7 @@ class ModelConfig:
         self.max_label_num = argv.get('MaxLabelNum')
         self.auto_padding = argv.get('AutoPadding')
         self.output_split = argv.get('OutputSplit')
+        self.input_dtype_param = argv.get('InputDType')
         self.label_from_param = argv.get('LabelFrom')
         self.extract_regex = argv.get('ExtractRegex')
         self.label_split = argv.get('LabelSplit')
@@ -673,6 +885,18 @@ class ModelConfig:
         self.batch_size = argv.get('BatchSize')
         self.validation_batch_size = argv.get('ValidationBatchSize')
         self.trains_learning_rate = argv.get('LearningRate')
+        self.data_pipeline_param = argv.get('DataPipeline')
+        self.dataset_format_param = argv.get('DatasetFormat')
+        self.data_workers = argv.get('DataWorkers')
+        self.validation_cache = argv.get('ValidationCache')
+        self.dataset_shards = argv.get('DatasetShards')
+        self.global_shuffle = argv.get('GlobalShuffle')
+        self.width_buckets = argv.get('WidthBuckets')
+        self.prefetch_batches = argv.get('PrefetchBatches')
+        self.summary_steps = argv.get('SummarySteps')
+        self.histogram_steps = argv.get('HistogramSteps')
+        self.image_summary_steps = argv.get('ImageSummarySteps')
+        self.external_evaluator = argv.get('ExternalEvaluator')
         self.da_binaryzation = argv.get('DA_Binaryzation')
         self.da_median_blur = argv.get('DA_MedianBlur')
         self.da_gaussian_blur = argv.get('DA_GaussianBlur')
@@ -711,6 +935,35 @@ class ModelConfig:
         print('---------------------------------------------------------------------------------')
 
 
+class FrozenModelConfig(object):
+    """
+    ModelConfig 的只读快照：派生属性预先计算为普通字段，基于 __slots__ 没有实例字典，
+    序列化体积小且属性访问无需再次计算，用于传入数据生产、编码等工作进程
+    """
+    __slots__ = tuple(ModelConfig.__annotations__) + tuple(
+        name for name, attr in vars(ModelConfig).items() if isinstance(attr, DerivedProperty)
+    )
+
+    resized_width = ModelConfig.resized_width
+
+    def __init__(self, model_conf: ModelConfig):
+        for name in self.__slots__:
+            object.__setattr__(self, name, getattr(model_conf, name, None))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("FrozenModelConfig is read-only, attribute: {}".format(key))
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            object.__setattr__(self, name, value)
+
+    def freeze(self) -> 'FrozenModelConfig':
+        return self
+
+
 if __name__ == '__main__':
     name = "demo"
     c = ModelConfig(project_name=name)
@@ -56,6 +56,28 @@ class RunMode(Enum):
     Predict = 'Predict'
 
 
+@unique
+class DataPipeline(Enum):
+    """数据管道枚举"""
+    Feed = 'Feed'
+    Graph = 'Graph'
+    Process = 'Process'
+
+
+@unique
+class InputDType(Enum):
+    """输入数据类型枚举"""
+    Float32 = 'Float32'
+    UInt8 = 'UInt8'
+
+
+@unique
+class DatasetFormat(Enum):
+    """数据集存储格式枚举"""
+    Bytes = 'Bytes'
+    Tensor = 'Tensor'
+
+
 @unique
 class CNNNetwork(Enum):
     """卷积层枚举"""
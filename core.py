@@ -2,7 +2,7 @@
 # -*- coding:utf-8 -*-
 # Author: kerlomz <kerlomz@gmail.com>
 import sys
-from config import RecurrentNetwork, RESIZE_MAP, CNNNetwork, Optimizer
+from config import RecurrentNetwork, RESIZE_MAP, CNNNetwork, Optimizer, InputDType
 from network.CNN import *
 from network.MobileNet import MobileNetV2
 from network.DenseNet import DenseNet
@@ -25,23 +25,34 @@ class NeuralNetwork(object):
     """
     神经网络构建类
     """
-    def __init__(self, model_conf: ModelConfig, mode: RunMode, backbone: CNNNetwork, recurrent: RecurrentNetwork):
+    def __init__(self, model_conf: ModelConfig, mode: RunMode, backbone: CNNNetwork, recurrent: RecurrentNetwork,
+                 input_tensors=None):
         """
 
         :param model_conf: 模型配置
         :param mode: 运行模式 (Trains/Validation/Predict)
         :param backbone:
         :param recurrent:
+        :param input_tensors: 数据管道的批次张量 (input, label_padded, label_length, width)，
+                              [Trains]模式下传入时输入及标签直接绑定到数据管道，训练步无需 feed_dict
         """
         self.model_conf = model_conf
         self.decoder = Decoder(self.model_conf)
         self.mode = mode
         self.network = backbone
         self.recurrent = recurrent
-        self.inputs = tf.keras.Input(dtype=tf.float32, shape=self.input_shape, name='input')
-        self.labels = tf.keras.Input(dtype=tf.int32, shape=[None], sparse=True, name='labels')
+        self.input_widths = None
+        self.padded_width = None
+        if input_tensors is not None and mode == RunMode.Trains:
+            self.inputs, self.labels = self.bind_inputs(input_tensors)
+        else:
+            self.inputs = tf.keras.Input(dtype=self.input_dtype, shape=self.input_shape, name='input')
+            self.labels = tf.keras.Input(dtype=tf.int32, shape=[None], sparse=True, name='labels')
+        self.features = self.normalize(self.inputs)
         self.utils = NetworkUtils(mode)
         self.merged_summary = None
+        self.histogram_summary = None
+        self.image_summary = None
         self.optimizer = None
         self.dataset_size = None
 
@@ -50,7 +61,45 @@ class NeuralNetwork(object):
         """
         :return: tuple/list 类型，输入的 Shape
         """
-        return RESIZE_MAP[self.model_conf.loss_func](*self.model_conf.resize) + [self.model_conf.image_channel]
+        width, height = RESIZE_MAP[self.model_conf.loss_func](*self.model_conf.resize)
+        if self.model_conf.input_dtype == InputDType.UInt8:
+            return [height, width, self.model_conf.image_channel]
+        return [width, height, self.model_conf.image_channel]
+
+    @property
+    def input_dtype(self):
+        return tf.uint8 if self.model_conf.input_dtype == InputDType.UInt8 else tf.float32
+
+    def bind_inputs(self, input_tensors):
+        """
+        以数据管道的批次作为输入及稀疏标签各分量的默认值，验证时仍可通过 feed_dict 覆盖
+        :param input_tensors: (input, label_padded, label_length, width)
+        :return: (inputs, labels)
+        """
+        images, label_padded, label_length, widths = input_tensors
+        inputs = tf.compat.v1.placeholder_with_default(images, shape=[None] + self.input_shape, name='input')
+        with tf.keras.backend.name_scope('labels'):
+            label_indices = tf.where(tf.sequence_mask(label_length, tf.shape(label_padded)[1]))
+            dense_shape = tf.stack([
+                tf.shape(label_padded, out_type=tf.int64)[0], tf.cast(tf.reduce_max(label_length), tf.int64)
+            ])
+            labels = tf.SparseTensor(
+                indices=tf.compat.v1.placeholder_with_default(label_indices, shape=[None, 2], name='indices'),
+                values=tf.compat.v1.placeholder_with_default(
+                    tf.gather_nd(label_padded, label_indices), shape=[None], name='values'
+                ),
+                dense_shape=tf.compat.v1.placeholder_with_default(dense_shape, shape=[2], name='shape')
+            )
+        self.input_widths = widths
+        self.padded_width = tf.shape(inputs)[self.model_conf.input_width_axis + 1]
+        return inputs, labels
+
+    def normalize(self, inputs):
+        """uint8 输入在计算图中完成类型转换、归一化及 [高, 宽, 通道] -> [宽, 高, 通道] 转置"""
+        if self.model_conf.input_dtype != InputDType.UInt8:
+            return inputs
+        with tf.keras.backend.name_scope('normalize'):
+            return tf.transpose(tf.cast(inputs, tf.float32) / 255., perm=[0, 2, 1, 3])
 
     def build_graph(self):
         """
@@ -62,27 +111,42 @@ class NeuralNetwork(object):
         self.dataset_size = dataset_size
         self._build_train_op()
         self.merged_summary = tf.compat.v1.summary.merge_all()
+        if self.mode == RunMode.Trains:
+            self._build_sampled_summary()
+
+    def _build_sampled_summary(self):
+        """直方图及图片摘要开销较大，不加入默认集合，仅按采样间隔单独计算"""
+        if self.model_conf.histogram_steps:
+            self.histogram_summary = tf.compat.v1.summary.merge([
+                tf.compat.v1.summary.histogram(var.op.name, var, collections=[])
+                for var in tf.compat.v1.trainable_variables()
+            ])
+        if self.model_conf.image_summary_steps:
+            # 特征为 [批次, 宽, 高, 通道]，转置为图片摘要所需的 [批次, 高, 宽, 通道]
+            self.image_summary = tf.compat.v1.summary.image(
+                'input', tf.transpose(self.features, perm=[0, 2, 1, 3]), max_outputs=3, collections=[]
+            )
 
     def _build_model(self):
 
         """选择采用哪种卷积网络"""
         if self.network == CNNNetwork.CNN5:
-            x = CNN5(model_conf=self.model_conf, inputs=self.inputs, utils=self.utils).build()
+            x = CNN5(model_conf=self.model_conf, inputs=self.features, utils=self.utils).build()
 
         elif self.network == CNNNetwork.CNNX:
-            x = CNNX(model_conf=self.model_conf, inputs=self.inputs, utils=self.utils).build()
+            x = CNNX(model_conf=self.model_conf, inputs=self.features, utils=self.utils).build()
 
         elif self.network == CNNNetwork.ResNetTiny:
-            x = ResNetTiny(model_conf=self.model_conf, inputs=self.inputs, utils=self.utils).build()
+            x = ResNetTiny(model_conf=self.model_conf, inputs=self.features, utils=self.utils).build()
 
         elif self.network == CNNNetwork.ResNet50:
-            x = ResNet50(model_conf=self.model_conf, inputs=self.inputs, utils=self.utils).build()
+            x = ResNet50(model_conf=self.model_conf, inputs=self.features, utils=self.utils).build()
 
         elif self.network == CNNNetwork.DenseNet:
-            x = DenseNet(model_conf=self.model_conf, inputs=self.inputs, utils=self.utils).build()
+            x = DenseNet(model_conf=self.model_conf, inputs=self.features, utils=self.utils).build()
 
         elif self.network == CNNNetwork.MobileNetV2:
-            x = MobileNetV2(model_conf=self.model_conf, inputs=self.inputs, utils=self.utils).build()
+            x = MobileNetV2(model_conf=self.model_conf, inputs=self.features, utils=self.utils).build()
 
         else:
             raise ValueError('This cnn neural network is not supported at this time.')
@@ -9,12 +9,13 @@ import PIL.Image
 import numpy as np
 import tensorflow as tf
 from exception import *
-from constants import RunMode
+from constants import RunMode, InputDType
 from config import ModelConfig, LabelFrom, LossFunction
 from category import encode_maps, FULL_ANGLE_MAP
 from pretreatment import preprocessing
 from pretreatment import preprocessing_by_func
 from tools.gif_frames import concat_frames, blend_frame
+from utils.tfrecord import is_tensor, unpack_tensor
 from collections import Counter
 
 
@@ -26,6 +27,33 @@ class Encoder(object):
         self.model_conf = model_conf
         self.mode = mode
         self.category_param = self.model_conf.category_param
+        self.blank_char = self.model_conf.category_num
+        self.encode_map = self.label_encode_map()
+        self.translate_table = self.label_translate_table()
+
+    def label_encode_map(self):
+        """预先构建的类别编码映射，内置的大小写规范字符集同时收录另一种大小写形式，编码时无需再转换大小写"""
+        encode_map = encode_maps(self.model_conf.category)
+        if not isinstance(self.category_param, str):
+            return encode_map
+        if '_LOWER' in self.category_param:
+            fold = str.upper
+        elif '_UPPER' in self.category_param:
+            fold = str.lower
+        else:
+            return encode_map
+        for char, code in list(encode_map.items()):
+            encode_map.setdefault(fold(char), code)
+        return encode_map
+
+    def label_translate_table(self):
+        """单字符标签的 str.translate 转换表：全角转半角，算术符号规范化，去除空格"""
+        table = {ord(k): v for k, v in FULL_ANGLE_MAP.items()}
+        if self.category_param == 'ARITHMETIC':
+            table[ord('x')] = '×'
+            table[ord('？')] = '?'
+        table[ord(' ')] = None
+        return table
 
     @staticmethod
     def main_color_replace(im: np.ndarray, num=2, repl=(255, 255, 255)):
@@ -46,19 +74,83 @@ class Encoder(object):
         im[:, :, :][areas.T] = repl
         return im
 
-    def image(self, path_or_bytes):
-        """针对图片类型的输入的编码"""
+    def channel_error(self, channels):
+        return "The number of image channels {} is inconsistent with the number of configured channels {}.".format(
+            channels, self.model_conf.image_channel
+        )
+
+    def from_array(self, im: np.ndarray):
+        """
+        内存中的 [高, 宽, 通道] RGB(A) 或 [高, 宽] 灰度 uint8 数组，如 RandomCaptcha.create(mode="numpy") 的输出
+        :return: (im, 原图尺寸)，通道数不符时返回错误信息
+        """
+        if im.ndim == 3 and im.shape[2] == 1:
+            im = im[:, :, 0]
+        channels = 1 if im.ndim == 2 else im.shape[2]
+        if channels == 1 and self.model_conf.image_channel == 3:
+            return self.channel_error(channels)
+        if channels > 3:
+            # 与 PIL convert('RGB') 一致，直接丢弃透明通道
+            im = im[:, :, :3]
+        return im, (im.shape[1], im.shape[0])
+
+    def decode(self, path_or_bytes, deterministic=False):
+        """
+        图片解码及预处理 (不含数据增广与缩放)
+        :param path_or_bytes: 图片路径、bytes，或内存中的 numpy 数组/PIL图片
+        :param deterministic: 仅执行确定性操作，跳过训练模式的随机JPEG压缩与随机RGB/BGR灰度化
+        :return: (im, 原图尺寸)，无法解码时返回错误信息或 None
+        """
+        if isinstance(path_or_bytes, np.ndarray):
+            decoded = self.from_array(path_or_bytes)
+        else:
+            decoded = self.open_image(path_or_bytes, deterministic)
+        if not isinstance(decoded, tuple):
+            return decoded
+        im, size = decoded
+
+        im = preprocessing_by_func(
+            exec_map=self.model_conf.pre_exec_ops,
+            src_arr=im
+        )
+
+        if self.model_conf.image_channel == 1 and len(im.shape) == 3:
+            if self.mode == RunMode.Trains and not deterministic:
+                im = cv2.cvtColor(im, cv2.COLOR_RGB2GRAY if bool(random.getrandbits(1)) else cv2.COLOR_BGR2GRAY)
+            else:
+                im = cv2.cvtColor(im, cv2.COLOR_RGB2GRAY)
+
+        im = preprocessing(
+            image=im,
+            binaryzation=self.model_conf.pre_binaryzation,
+        )
+
+        if self.model_conf.pre_horizontal_stitching:
+            up_slice = im[0: int(size[1] / 2), 0: size[0]]
+            down_slice = im[int(size[1] / 2): size[1], 0: size[0]]
+            im = np.concatenate((up_slice, down_slice), axis=1)
+        return im, size
+
+    def open_image(self, path_or_bytes, deterministic=False):
+        """
+        PIL 解码，处理调色板、透明通道及GIF帧；内存中的PIL图片不再经过随机JPEG压缩
+        :return: (im, 原图尺寸)，无法解码时返回错误信息或 None
+        """
         # im = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
         # The OpenCV cannot handle gif format images, it will return None.
         # if im is None:
 
-        path_or_stream = io.BytesIO(path_or_bytes) if isinstance(path_or_bytes, bytes) else path_or_bytes
-        if not path_or_stream:
-            return "Picture is corrupted: {}".format(path_or_bytes)
-        try:
-            pil_image = PIL.Image.open(path_or_stream)
-        except OSError as e:
-            return "{} - {}".format(e, path_or_bytes)
+        in_memory = isinstance(path_or_bytes, PIL.Image.Image)
+        if in_memory:
+            pil_image = path_or_bytes
+        else:
+            path_or_stream = io.BytesIO(path_or_bytes) if isinstance(path_or_bytes, bytes) else path_or_bytes
+            if not path_or_stream:
+                return "Picture is corrupted: {}".format(path_or_bytes)
+            try:
+                pil_image = PIL.Image.open(path_or_stream)
+            except OSError as e:
+                return "{} - {}".format(e, path_or_bytes)
 
         use_compress = True
 
@@ -67,9 +159,10 @@ class Encoder(object):
         if pil_image.mode == 'P' and not gif_handle:
             pil_image = pil_image.convert('RGB')
 
-        rgb = pil_image.split()
+        # 仅读取通道名，无需像 split() 一样拷贝每个通道
+        bands = len(pil_image.getbands())
 
-        if self.mode == RunMode.Trains and use_compress:
+        if self.mode == RunMode.Trains and use_compress and not deterministic and not in_memory:
             img_compress = io.BytesIO()
 
             pil_image.convert('RGB').save(img_compress, format='JPEG', quality=random.randint(75, 100))
@@ -78,10 +171,8 @@ class Encoder(object):
             path_or_stream = io.BytesIO(img_compress_bytes)
             pil_image = PIL.Image.open(path_or_stream)
 
-        if len(rgb) == 1 and self.model_conf.image_channel == 3:
-            return "The number of image channels {} is inconsistent with the number of configured channels {}.".format(
-                len(rgb), self.model_conf.image_channel
-            )
+        if bands == 1 and self.model_conf.image_channel == 3:
+            return self.channel_error(bands)
 
         size = pil_image.size
 
@@ -105,7 +196,7 @@ class Encoder(object):
         #     background.convert('RGB')
         #     pil_image = background
 
-        if len(rgb) > 3 and self.model_conf.pre_replace_transparent and not gif_handle and not use_compress:
+        if bands > 3 and self.model_conf.pre_replace_transparent and not gif_handle and not use_compress:
             background = PIL.Image.new('RGBA', pil_image.size, (255, 255, 255))
             try:
                 background.paste(pil_image, (0, 0, size[0], size[1]), pil_image)
@@ -114,7 +205,7 @@ class Encoder(object):
             except:
                 pil_image = pil_image.convert('RGB')
 
-        if len(pil_image.split()) > 3 and self.model_conf.image_channel == 3:
+        if len(pil_image.getbands()) > 3 and self.model_conf.image_channel == 3:
             pil_image = pil_image.convert('RGB')
 
         if self.model_conf.pre_concat_frames != -1:
@@ -126,28 +217,10 @@ class Encoder(object):
 
         if isinstance(im, list):
             return None
+        return im, size
 
-        im = preprocessing_by_func(
-            exec_map=self.model_conf.pre_exec_map,
-            src_arr=im
-        )
-
-        if self.model_conf.image_channel == 1 and len(im.shape) == 3:
-            if self.mode == RunMode.Trains:
-                im = cv2.cvtColor(im, cv2.COLOR_RGB2GRAY if bool(random.getrandbits(1)) else cv2.COLOR_BGR2GRAY)
-            else:
-                im = cv2.cvtColor(im, cv2.COLOR_RGB2GRAY)
-
-        im = preprocessing(
-            image=im,
-            binaryzation=self.model_conf.pre_binaryzation,
-        )
-
-        if self.model_conf.pre_horizontal_stitching:
-            up_slice = im[0: int(size[1] / 2), 0: size[0]]
-            down_slice = im[int(size[1] / 2): size[1], 0: size[0]]
-            im = np.concatenate((up_slice, down_slice), axis=1)
-
+    def augment(self, im):
+        """训练模式下以1/2的概率执行数据增广"""
         if self.mode == RunMode.Trains and bool(random.getrandbits(1)):
             im = preprocessing(
                 image=im,
@@ -166,19 +239,31 @@ class Encoder(object):
                 random_channel_swap=self.model_conf.da_channel_swap,
                 random_blank=self.model_conf.da_random_blank,
                 random_transition=self.model_conf.da_random_transition,
-            ).astype(np.float32)
+            )
+        return im
 
-        else:
-            im = im.astype(np.float32)
+    def cast(self, im):
+        if self.model_conf.input_dtype == InputDType.UInt8:
+            return im if im.dtype == np.uint8 else np.clip(im, 0, 255).astype(np.uint8)
+        return im.astype(np.float32)
+
+    def resize(self, im, size):
+        """按 Resize 配置缩放，不定宽时按高度等比缩放"""
         if self.model_conf.resize[0] == -1:
             # random_ratio = random.choice([2.5, 3, 3.5, 3.2, 2.7, 2.75])
             ratio = self.model_conf.resize[1] / size[1]
             # random_width = int(random_ratio * RESIZE[1])
             resize_width = int(ratio * size[0])
             # resize_width = random_width if is_random else resize_width
-            im = cv2.resize(im, (resize_width, self.model_conf.resize[1]))
-        else:
-            im = cv2.resize(im, (self.model_conf.resize[0], self.model_conf.resize[1]))
+            return cv2.resize(im, (resize_width, self.model_conf.resize[1]))
+        return cv2.resize(im, (self.model_conf.resize[0], self.model_conf.resize[1]))
+
+    def to_input(self, im):
+        """缩放后的图片转为网络输入"""
+        if self.model_conf.input_dtype == InputDType.UInt8:
+            # 保持 [高, 宽, 通道] 的 uint8 张量，类型转换、归一化及转置在计算图中完成
+            return im[:, :, np.newaxis] if self.model_conf.image_channel == 1 else im
+
         im = im.swapaxes(0, 1)
 
         if self.model_conf.image_channel == 1:
@@ -186,43 +271,65 @@ class Encoder(object):
         else:
             return np.array(im[:, :]) / 255.
 
+    def pretreat(self, path_or_bytes):
+        """
+        打包张量格式数据集时使用：仅执行确定性的预处理及缩放
+        :return: [高, 宽, 通道] 的 uint8 数组，无法解码时返回错误信息或 None
+        """
+        decoded = self.decode(path_or_bytes, deterministic=True)
+        if not isinstance(decoded, tuple):
+            return decoded
+        im, size = decoded
+        im = im if im.dtype == np.uint8 else np.clip(im, 0, 255).astype(np.uint8)
+        im = self.resize(im, size)
+        return im[:, :, np.newaxis] if len(im.shape) == 2 else im
+
+    def image(self, path_or_bytes):
+        """针对图片类型的输入的编码，支持图片路径/bytes、张量格式bytes及内存中的 numpy 数组/PIL图片"""
+        if is_tensor(path_or_bytes):
+            # 张量格式：确定性预处理已在打包时完成，仅执行数据增广
+            im = unpack_tensor(path_or_bytes)
+            im = im[:, :, 0] if im.shape[2] == 1 else im
+            if self.mode == RunMode.Trains:
+                im = self.augment(im.copy())
+            return self.to_input(self.cast(im))
+
+        decoded = self.decode(path_or_bytes)
+        if not isinstance(decoded, tuple):
+            return decoded
+        im, size = decoded
+        im = self.augment(im)
+        im = self.resize(self.cast(im), size)
+        return self.to_input(im)
+
     def text(self, content):
         """针对文本类型的输入的编码"""
         if isinstance(content, bytes):
             content = content.decode("utf8")
 
-        found = content
-        # 如果匹配内置的大小写规范，触发自动转换
-        if isinstance(self.category_param, str) and '_LOWER' in self.category_param:
-            found = found.lower()
-        if isinstance(self.category_param, str) and '_UPPER' in self.category_param:
-            found = found.upper()
-
-        if self.model_conf.category_param == 'ARITHMETIC':
-            found = found.replace("x", "×").replace('？', "?")
-
         # 标签是否包含分隔符
-        if self.model_conf.label_split:
-            labels = found.split(self.model_conf.label_split)
-        elif '&' in found:
-            labels = found.split('&')
-        elif self.model_conf.max_label_num == 1:
-            labels = [found]
+        if self.model_conf.label_split or '&' in content or self.model_conf.max_label_num == 1:
+            found = content
+            if self.category_param == 'ARITHMETIC':
+                found = found.replace("x", "×").replace('？', "?")
+            if self.model_conf.label_split:
+                labels = found.split(self.model_conf.label_split)
+            elif '&' in found:
+                labels = found.split('&')
+            else:
+                labels = [found]
+            labels = self.filter_full_angle(labels)
         else:
-            labels = [_ for _ in found]
-        labels = self.filter_full_angle(labels)
+            # 单字符标签：全角转换、符号规范化与空格过滤一次完成
+            labels = content.translate(self.translate_table)
         try:
             if not labels:
                 return [0]
             # 根据类别集合找到对应映射编码为dense数组
             if self.model_conf.loss_func == LossFunction.CTC:
-                label = self.split_continuous_char(
-                    [encode_maps(self.model_conf.category)[i] for i in labels]
-                )
+                label = self.split_continuous_char(labels)
             else:
-                label = self.auto_padding_char(
-                    [encode_maps(self.model_conf.category)[i] for i in labels]
-                )
+                label = self.auto_padding_char([self.encode_map[i] for i in labels])
             return label
 
         except KeyError as e:
@@ -233,16 +340,16 @@ class Encoder(object):
             #     ), ConfigException.SAMPLE_LABEL_ERROR
             # )
 
-    def split_continuous_char(self, content):
-        # 为连续的分类插入空白符
+    def split_continuous_char(self, labels):
+        """编码标签，并为连续的相同分类插入空白符"""
         store_list = []
-        # blank_char = [self.model_conf.category_num] if bool(random.getrandbits(1)) else [0]
-        blank_char = [self.model_conf.category_num]
-        for i in range(len(content) - 1):
-            store_list.append(content[i])
-            if content[i] == content[i + 1]:
-                store_list += blank_char
-        store_list.append(content[-1])
+        previous = None
+        for char in labels:
+            code = self.encode_map[char]
+            if code == previous:
+                store_list.append(self.blank_char)
+            store_list.append(code)
+            previous = code
         return store_list
 
     def auto_padding_char(self, content):
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""独立评估进程：监视工程模型目录中的新存储，以[Predict]模式恢复后在完整验证集上计算准确率，结果写入 evaluation.json 供训练任务读取"""
+import os
+import sys
+import json
+import time
+import tensorflow as tf
+tf.compat.v1.disable_v2_behavior()
+tf.compat.v1.disable_eager_execution()
+import core
+import validation
+from config import ModelConfig
+from constants import RunMode, DatasetType
+from utils.data import DataIterator
+from utils.tfrecord import expand_shards, read_records, parse_example
+
+
+def read_evaluation(model_conf: ModelConfig):
+    """读取评估结果，不存在或正在写入时返回 None"""
+    try:
+        with open(model_conf.evaluation_path, "r", encoding="utf8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_evaluation(model_conf: ModelConfig, evaluation: dict):
+    """先写入临时文件再重命名，训练任务不会读取到不完整的结果"""
+    temp_path = model_conf.evaluation_path + ".tmp"
+    with open(temp_path, "w", encoding="utf8") as f:
+        json.dump(evaluation, f)
+    os.replace(temp_path, model_conf.evaluation_path)
+
+
+class Evaluator(object):
+
+    def __init__(self, model_conf: ModelConfig, poll_interval=10):
+        """
+        :param model_conf: 工程配置
+        :param poll_interval: 检查新存储的间隔 (秒)
+        """
+        self.model_conf = model_conf
+        self.poll_interval = poll_interval
+        self.validation = validation.Validation(self.model_conf)
+        self.feeder = DataIterator(model_conf=self.model_conf, mode=RunMode.Validation)
+        self.paths = expand_shards(self.model_conf.validation_path[DatasetType.TFRecords])
+        self.graph = tf.Graph()
+        self.sess = tf.compat.v1.Session(graph=self.graph)
+        tf.compat.v1.keras.backend.set_session(self.sess)
+        with self.graph.as_default():
+            self.model = core.NeuralNetwork(
+                model_conf=self.model_conf,
+                mode=RunMode.Predict,
+                backbone=self.model_conf.neu_cnn,
+                recurrent=self.model_conf.neu_recurrent
+            )
+            self.model.build_graph()
+            self.model.build_train_op()
+            self.saver = tf.compat.v1.train.Saver(var_list=tf.compat.v1.global_variables())
+        self.graph.finalize()
+
+    def batches(self):
+        """按验证批次大小顺序读取完整验证集"""
+        batch_size = self.model_conf.validation_batch_size
+        input_batch, label_batch = [], []
+        for path in self.paths:
+            for record in read_records(path):
+                sample = self.feeder.encode_sample(*parse_example(record))
+                if not sample:
+                    continue
+                input_batch.append(sample[0])
+                label_batch.append(sample[1])
+                if len(input_batch) == batch_size:
+                    yield self.feeder.pad_inputs(input_batch), label_batch
+                    input_batch, label_batch = [], []
+        if input_batch:
+            yield self.feeder.pad_inputs(input_batch), label_batch
+
+    def evaluate(self, checkpoint_path):
+        """
+        恢复存储并计算完整验证集的准确率
+        :param checkpoint_path: 存储路径
+        :return: 评估结果
+        """
+        start_time = time.time()
+        self.saver.restore(self.sess, checkpoint_path)
+        self.validation.reset()
+        for input_batch, label_batch in self.batches():
+            dense_decoded = self.sess.run(self.model.dense_decoded, feed_dict={self.model.inputs: input_batch})
+            self.validation.accuracy_calculation(label_batch, dense_decoded, verbose=False)
+        return {
+            'checkpoint': checkpoint_path,
+            'step': int(checkpoint_path.rsplit('-', 1)[-1]),
+            'accuracy': self.validation.accuracy,
+            'cer': self.validation.cer,
+            'samples': self.validation.total,
+            'confusions': self.validation.top_confusions(),
+            'time': time.time() - start_time,
+        }
+
+    def run(self, once=False):
+        """
+        持续监视新存储，每个存储只评估一次
+        :param once: 仅评估当前最新的存储
+        """
+        last_checkpoint = None
+        while True:
+            checkpoint_path = tf.train.latest_checkpoint(self.model_conf.model_root_path)
+            if checkpoint_path and checkpoint_path != last_checkpoint:
+                try:
+                    evaluation = self.evaluate(checkpoint_path)
+                    last_checkpoint = checkpoint_path
+                    write_evaluation(self.model_conf, evaluation)
+                    tf.compat.v1.logging.info(
+                        "Step: {step}, Accuracy = {accuracy:.4f}, CER = {cer:.4f}, Samples: {samples}, "
+                        "Time = {time:.3f} sec, Top Confusions: {confusions}".format(**evaluation)
+                    )
+                except (tf.errors.NotFoundError, tf.errors.DataLossError) as e:
+                    # 评估期间存储可能已被训练任务按 max_to_keep 删除，等待下一个存储
+                    tf.compat.v1.logging.warn("Checkpoint {} is unavailable: {}".format(checkpoint_path, e))
+            if once:
+                break
+            time.sleep(self.poll_interval)
+
+
+def main(argv):
+    # 训练任务负责维护 checkpoint 文件，评估进程只读取
+    model_conf = ModelConfig(project_name=argv[1], sync_checkpoint=False)
+    Evaluator(model_conf).run(once='--once' in argv)
+
+
+if __name__ == '__main__':
+    tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.INFO)
+    main(sys.argv)
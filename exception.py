@@ -42,6 +42,9 @@ class ConfigException:
     SAMPLE_LABEL_ERROR = -4044
     GET_LABEL_REGEX_ERROR = -4045
     ERROR_LABEL_FROM = -4046
+    DATA_PIPELINE_NOT_SUPPORTED = -4047
+    INPUT_DTYPE_NOT_SUPPORTED = -4048
+    DATASET_FORMAT_NOT_SUPPORTED = -4049
     INSUFFICIENT_SAMPLE = -5
     VALIDATION_SET_SIZE_ERROR = -6
 
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""批量推理引擎：加载 Trains.compile_graph 输出的 .pb/.onnx/.tflite 模型，并行编码、动态组批并统计吞吐与延迟"""
+import os
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+from concurrent.futures import ProcessPoolExecutor
+from config import ModelConfig, COMPILE_MODEL_MAP
+from constants import RunMode, ModelType, LossFunction
+from encoder import Encoder
+from exception import exception
+from utils.data import pad_batch
+
+_worker_encoder = None
+
+
+def init_worker(model_conf: ModelConfig):
+    """编码进程初始化，每个进程只创建一次 Encoder"""
+    global _worker_encoder
+    _worker_encoder = Encoder(model_conf=model_conf, mode=RunMode.Predict)
+
+
+def encode_image(image_bytes, encoder: Encoder = None):
+    """编码进程中执行 Encoder.image，无法识别的图片返回 None"""
+    im = (encoder if encoder else _worker_encoder).image(image_bytes)
+    if im is None or isinstance(im, str):
+        return None
+    return im if im.dtype == np.uint8 else im.astype(np.float32)
+
+
+def latest_model_path(model_conf: ModelConfig, model_type: ModelType):
+    """编译目录中指定类型的最新模型文件"""
+    suffix = COMPILE_MODEL_MAP[model_type]
+    if not os.path.exists(model_conf.compile_model_path):
+        return None
+    model_paths = [
+        os.path.join(model_conf.compile_model_path, name)
+        for name in os.listdir(model_conf.compile_model_path) if name.endswith(suffix)
+    ]
+    return max(model_paths, key=os.path.getmtime) if model_paths else None
+
+
+class GraphBackend(object):
+    """冻结的 .pb 计算图"""
+
+    def __init__(self, model_bytes):
+        graph_def = tf.compat.v1.GraphDef()
+        graph_def.ParseFromString(model_bytes)
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name="")
+        self.sess = tf.compat.v1.Session(graph=self.graph)
+        self.input_op = self.graph.get_tensor_by_name('input:0')
+        self.output_op = self.graph.get_tensor_by_name('dense_decoded:0')
+        self.graph.finalize()
+
+    def run(self, image_batch):
+        return self.sess.run(self.output_op, feed_dict={self.input_op: image_batch})
+
+
+class OnnxBackend(object):
+    """onnxruntime CPU 推理，CTC 模型输出为 logits，需自行解码"""
+
+    def __init__(self, model_bytes, loss_func: LossFunction):
+        import onnxruntime
+        self.sess = onnxruntime.InferenceSession(model_bytes, providers=['CPUExecutionProvider'])
+        self.input_name = self.sess.get_inputs()[0].name
+        self.output_name = self.sess.get_outputs()[0].name
+        self.loss_func = loss_func
+
+    @staticmethod
+    def ctc_greedy_decode(logits):
+        """
+        时间主序 logits [T, B, C] 贪心解码: 合并重复分类并去除空白符 (最后一类)
+        :return: [B, T] 编码，被去除的位置为 -1
+        """
+        best_path = np.argmax(logits, axis=2).T
+        blank = logits.shape[2] - 1
+        repeated = np.zeros_like(best_path, dtype=bool)
+        repeated[:, 1:] = best_path[:, 1:] == best_path[:, :-1]
+        return np.where(repeated | (best_path == blank), -1, best_path)
+
+    def run(self, image_batch):
+        outputs = self.sess.run([self.output_name], {self.input_name: image_batch})[0]
+        if self.loss_func == LossFunction.CTC:
+            return self.ctc_greedy_decode(outputs)
+        return outputs
+
+
+class TFLiteBackend(object):
+    """TFLite 解释器，批次形状变化时重新分配张量"""
+
+    def __init__(self, model_bytes):
+        self.interpreter = tf.lite.Interpreter(model_content=model_bytes)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.input_shape = None
+
+    def run(self, image_batch):
+        if self.input_shape != image_batch.shape:
+            self.interpreter.resize_tensor_input(self.input_index, image_batch.shape)
+            self.interpreter.allocate_tensors()
+            self.input_shape = image_batch.shape
+        self.interpreter.set_tensor(self.input_index, image_batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)
+
+
+class InferenceStats(object):
+    """推理统计：吞吐量及单张图片延迟分位数"""
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.latency = []
+
+    def add(self, latency):
+        self.latency.extend(latency)
+
+    @property
+    def images(self):
+        return len(self.latency)
+
+    @property
+    def images_per_sec(self):
+        return self.images / max(time.time() - self.start_time, 1e-9)
+
+    def percentile(self, q):
+        return float(np.percentile(self.latency, q)) * 1000 if self.latency else 0.
+
+    def __str__(self):
+        return "Images: {}, Throughput: {:.2f} images/sec, Latency p50: {:.2f} ms, p99: {:.2f} ms".format(
+            self.images, self.images_per_sec, self.percentile(50), self.percentile(99)
+        )
+
+
+class InferenceEngine(object):
+    """
+    批量推理引擎：
+    1. Encoder.image 在进程池中并行编码
+    2. 按批次动态组批，不定宽 (Resize[0] == -1) 模型按宽度排序分桶以减少补齐
+    3. 通过字符集查找表向量化解码
+    """
+
+    def __init__(self, model_conf: ModelConfig, model_path=None, model_type=ModelType.PB, model_bytes=None,
+                 batch_size=64, workers=None):
+        """
+        :param model_conf: 工程配置 (编译配置)
+        :param model_path: 模型路径，为空时使用编译目录中最新的模型
+        :param model_type: 模型类型 [PB, ONNX, TFLITE]
+        :param model_bytes: 模型内容，优先于 model_path
+        :param batch_size: 最大批次大小
+        :param workers: 编码进程数，0 表示在当前进程中编码
+        """
+        self.model_conf = model_conf
+        self.batch_size = batch_size
+        self.stats = InferenceStats()
+        if model_bytes is None:
+            model_path = model_path if model_path else latest_model_path(self.model_conf, model_type)
+            if not model_path:
+                exception("No compiled {} model found in {}.".format(model_type.value, model_conf.compile_model_path))
+            with open(model_path, "rb") as f:
+                model_bytes = f.read()
+
+        if model_type == ModelType.PB:
+            self.backend = GraphBackend(model_bytes)
+        elif model_type == ModelType.ONNX:
+            self.backend = OnnxBackend(model_bytes, self.model_conf.loss_func)
+        elif model_type == ModelType.TFLITE:
+            self.backend = TFLiteBackend(model_bytes)
+        else:
+            raise ValueError('This model type is not supported at this time.')
+
+        category_num = self.model_conf.category_num
+        self.category_num = category_num
+        self.charset = np.asarray(self.model_conf.category + [''], dtype=object)
+        self.output_split = self.model_conf.output_split if self.model_conf.output_split else ''
+
+        workers = os.cpu_count() if workers is None else workers
+        self.encoder = Encoder(model_conf=self.model_conf, mode=RunMode.Predict)
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker, initargs=(self.model_conf.freeze(),)
+        ) if workers > 0 else None
+
+    def encode(self, images):
+        if not self.executor:
+            return [encode_image(image, self.encoder) for image in images]
+        chunk_size = max(int(len(images) / self.executor._max_workers / 4), 1)
+        return list(self.executor.map(encode_image, images, chunksize=chunk_size))
+
+    def decode(self, dense_decoded):
+        """向量化解码：越界编码 (-1/空白符) 映射为空字符串后按行拼接"""
+        codes = np.asarray(dense_decoded)
+        if codes.ndim == 1:
+            codes = codes[:, np.newaxis]
+        codes = np.where((codes < 0) | (codes >= self.category_num), self.category_num, codes)
+        return [self.output_split.join(row) for row in self.charset[codes]]
+
+    def batches(self, image_arrays):
+        """动态组批，不定宽时按宽度排序使同一批次宽度相近"""
+        axis = self.model_conf.input_width_axis
+        indices = [i for i, im in enumerate(image_arrays) if im is not None]
+        if self.model_conf.resize[0] == -1:
+            indices.sort(key=lambda i: image_arrays[i].shape[axis])
+        for start in range(0, len(indices), self.batch_size):
+            batch_indices = indices[start: start + self.batch_size]
+            yield batch_indices, pad_batch([image_arrays[i] for i in batch_indices], axis=axis)
+
+    def predict(self, images):
+        """
+        批量预测
+        :param images: 图片bytes列表
+        :return: 与输入顺序一致的预测文本列表，无法识别的图片结果为 None
+        """
+        start_time = time.time()
+        return self.predict_arrays(self.encode(list(images)), start_time=start_time)
+
+    def predict_arrays(self, image_arrays, start_time=None):
+        """
+        对已编码的图片批量预测
+        :param image_arrays: Encoder.image 编码结果列表，None 表示无法识别
+        :param start_time: 开始时间，传入时按批次完成时间统计延迟
+        :return: 与输入顺序一致的预测文本列表
+        """
+        results = [None] * len(image_arrays)
+        for batch_indices, image_batch in self.batches(image_arrays):
+            texts = self.decode(self.backend.run(image_batch))
+            for i, text in zip(batch_indices, texts):
+                results[i] = text
+            if start_time:
+                self.stats.add([time.time() - start_time] * len(batch_indices))
+        return results
+
+    def predict_iter(self, images, window=None):
+        """
+        流式批量预测，每次取 window 张图片编码后组批
+        :param images: 图片bytes迭代器
+        :param window: 窗口大小，默认为4倍批次大小
+        """
+        window = window if window else self.batch_size * 4
+        buffer = []
+        for image in images:
+            buffer.append(image)
+            if len(buffer) >= window:
+                for result in self.predict(buffer):
+                    yield result
+                buffer = []
+        if buffer:
+            for result in self.predict(buffer):
+                yield result
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown()
+
+
+if __name__ == '__main__':
+    project_name = sys.argv[1]
+    image_dir = sys.argv[2]
+    model_type = ModelType(sys.argv[3]) if len(sys.argv) > 3 else ModelType.PB
+    engine = InferenceEngine(ModelConfig(project_name=project_name, is_dev=False), model_type=model_type)
+
+    def read_images():
+        for name in os.listdir(image_dir):
+            with open(os.path.join(image_dir, name), "rb") as f:
+                yield f.read()
+
+    for predict_text in engine.predict_iter(read_images()):
+        print(predict_text)
+    print(engine.stats)
+    engine.close()
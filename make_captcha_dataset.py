@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""
+离线生成随机验证码数据集：多进程驱动 RandomCaptcha，按分片直接写入与 make_dataset 相同格式的TFRecords及索引
+用法: python make_captcha_dataset.py <工程名> --num 10000000 [--shards 100] [--seed 0] [--output path]
+生成后将输出路径加入 DatasetPath - Training 即可参与训练，中断后以相同参数重新执行只生成未完成的分片
+"""
+import json
+import random
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+import tensorflow as tf
+from config import *
+from constants import DatasetFormat
+from make_dataset import DataSets
+from utils.tfrecord import shard_path, write_manifest
+from utils.captcha_pool import random_captcha
+
+# 未指定分片数时单个分片的最大样本数
+SHARD_SIZE = 100000
+
+
+class CaptchaDataSets(DataSets):
+
+    """此类用于将 RandomCaptcha 生成的样本打包为分片TFRecords数据集"""
+    def __init__(self, model: ModelConfig, seed=0, dataset_format: DatasetFormat = None, **params):
+        """
+        :param model: 工程配置
+        :param seed: 随机种子，第i个分片使用种子 "{seed}:{i}"，相同参数的生成结果可复现
+        :param dataset_format: 数据集格式，默认为配置中的 DatasetFormat
+        :param params: 覆盖 DA_RandomCaptcha 中的同名参数
+        """
+        super().__init__(model, dataset_format)
+        self.seed = seed
+        self.params = params
+        # 打包工具只排除缺少字形的字体，不删除用户的字体文件
+        self.ran_captcha = random_captcha(model, remove_font=False, **params)
+        if not self.ran_captcha.fonts_list:
+            exception("No available font for the random captcha.", code=-6754)
+
+    @property
+    def source_hash(self):
+        """生成参数的摘要，参数改变时不再续接已完成的分片"""
+        source = dict(
+            seed=self.seed,
+            format=self.dataset_format.value,
+            params=dict(self.model.da_random_captcha, **self.params),
+            sample=self.ran_captcha.sample,
+            fonts=sorted(os.path.basename(font) for font in self.ran_captcha.fonts_list),
+        )
+        return hashlib.md5(json.dumps(source, ensure_ascii=False, default=str).encode("utf8")).hexdigest()
+
+    def records(self, count):
+        """生成 count 条有效的序列化记录"""
+        generated = 0
+        while generated < count:
+            try:
+                image, labels, font_type = self.ran_captcha.create(mode="numpy")
+            except Exception as e:
+                tf.compat.v1.logging.warn("Random captcha generation failed: {}".format(e))
+                continue
+            record = self.serialize_image(image, ''.join(labels).encode('utf-8'), font_type)
+            if record:
+                generated += 1
+                yield record
+
+    def pack_captcha_shard(self, output_filename, shard_index, shard_num, count):
+        """
+        生成并打包单个分片，分片内容只取决于种子与分片序号，与进程调度无关
+        :return: (分片序号, 记录数)
+        """
+        random.seed("{}:{}".format(self.seed, shard_index))
+        path = shard_path(output_filename, shard_index, shard_num)
+        return shard_index, self.write_shard(path, self.records(count))
+
+    def make_captcha_dataset(self, output_filename, num, shard_num, workers):
+        """
+        :param output_filename: 数据集路径
+        :param num: 样本总数
+        :param shard_num: 分片数
+        :param workers: 进程数
+        """
+        counts = [num // shard_num + (1 if i < num % shard_num else 0) for i in range(shard_num)]
+        manifest = self.open_manifest(output_filename, shard_num, self.source_hash)
+        pending = [i for i in range(shard_num) if str(i) not in manifest['completed']]
+        pbar = tqdm(total=sum(counts[i] for i in pending))
+        pbar.set_description('[Generating dataset RandomCaptcha]')
+        with ProcessPoolExecutor(max_workers=min(workers, max(len(pending), 1))) as executor:
+            tasks = {
+                executor.submit(self.pack_captcha_shard, output_filename, i, shard_num, counts[i]): i for i in pending
+            }
+            for task in as_completed(tasks):
+                shard_index, count = task.result()
+                manifest['completed'][str(shard_index)] = count
+                write_manifest(output_filename, manifest)
+                pbar.update(count)
+        pbar.close()
+
+
+def list_param(value):
+    """解析 "4,8" 或 JSON 形式的列表参数"""
+    return json.loads(value) if value.startswith('[') else [int(i) for i in value.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a RandomCaptcha dataset in the make_dataset format.")
+    parser.add_argument('project_name')
+    parser.add_argument('--num', type=int, required=True, help="Total number of samples.")
+    parser.add_argument('--output', help="Dataset path, default is {DatasetRoot}/RandomCaptcha.tfrecords.")
+    parser.add_argument('--shards', type=int, help="Number of shards, default is one shard per 100000 samples.")
+    parser.add_argument('--workers', type=int, help="Number of processes, default is DataWorkers.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--format', choices=[i.value for i in DatasetFormat], help="Default is DatasetFormat.")
+    parser.add_argument('--font-path', help="Overrides RandomCaptcha - FontPath.")
+    parser.add_argument('--charset', help="Category name or JSON list, overrides RandomCaptcha - Charset.")
+    parser.add_argument('--font-num', type=list_param, help="e.g. 4,8, overrides RandomCaptcha - FontNum.")
+    parser.add_argument('--font-size', type=list_param, help="e.g. 26,36, overrides RandomCaptcha - FontSize.")
+    parser.add_argument('--width', type=list_param, help="e.g. 130,160, overrides RandomCaptcha - Width.")
+    parser.add_argument('--height', type=list_param, help="e.g. 50,60, overrides RandomCaptcha - Height.")
+    args = parser.parse_args(argv)
+
+    model_conf = ModelConfig(project_name=args.project_name)
+    params = dict(
+        FontPath=args.font_path,
+        Charset=json.loads(args.charset) if args.charset and args.charset.startswith('[') else args.charset,
+        FontNum=args.font_num,
+        FontSize=args.font_size,
+        Width=args.width,
+        Height=args.height,
+    )
+    dataset = CaptchaDataSets(
+        model_conf,
+        seed=args.seed,
+        dataset_format=DATASET_FORMAT_MAP[args.format] if args.format else None,
+        **{k: v for k, v in params.items() if v is not None}
+    )
+    output_filename = args.output if args.output else os.path.join(
+        model_conf.dataset_root_path, "RandomCaptcha.tfrecords"
+    )
+    shard_num = args.shards if args.shards else max(-(-args.num // SHARD_SIZE), 1)
+    dataset.make_captcha_dataset(
+        output_filename, args.num, shard_num, args.workers if args.workers else model_conf.data_workers
+    )
+    tf.compat.v1.logging.info("Add {} to DatasetPath - Training to use the generated samples.".format(output_filename))
+
+
+if __name__ == '__main__':
+    tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.INFO)
+    main()
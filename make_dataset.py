@@ -1,12 +1,21 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
 # Author: kerlomz <kerlomz@gmail.com>
+import io
 import sys
 import random
+import hashlib
+import PIL.Image
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 import tensorflow as tf
 from config import *
-from constants import RunMode
+from constants import RunMode, DatasetFormat
+from encoder import Encoder
+from utils.data import DataIterator
+from utils.tfrecord import shard_path, read_manifest, write_manifest, dataset_exists, write_index, record_size
+from utils.tfrecord import pack_tensor
 
 _RANDOM_SEED = 0
 
@@ -14,9 +23,16 @@ _RANDOM_SEED = 0
 class DataSets:
 
     """此类用于打包数据集为TFRecords格式"""
-    def __init__(self, model: ModelConfig):
+    def __init__(self, model: ModelConfig, dataset_format: DatasetFormat = None):
+        """
+        :param model: 工程配置
+        :param dataset_format: 数据集格式，默认为配置中的 DatasetFormat
+        """
         self.ignore_list = ["Thumbs.db", ".DS_Store"]
         self.model: ModelConfig = model
+        self.dataset_format = dataset_format if dataset_format else self.model.dataset_format
+        # 张量格式打包时仅执行确定性的预处理
+        self.encoder = Encoder(self.model, RunMode.Validation)
         if not os.path.exists(self.model.dataset_root_path):
             os.makedirs(self.model.dataset_root_path)
 
@@ -33,7 +49,7 @@ class DataSets:
     def dataset_exists(self):
         """数据集是否存在判断函数"""
         for file in (self.model.trains_path[DatasetType.TFRecords] + self.model.validation_path[DatasetType.TFRecords]):
-            if not os.path.exists(file):
+            if not dataset_exists(file):
                 return False
         return True
 
@@ -41,78 +57,187 @@ class DataSets:
     def bytes_feature(values):
         return tf.train.Feature(bytes_list=tf.train.BytesList(value=[values]))
 
-    def input_to_tfrecords(self, input_data, label):
-        return tf.train.Example(features=tf.train.Features(feature={
+    @staticmethod
+    def int64_feature(values):
+        return tf.train.Feature(int64_list=tf.train.Int64List(value=[values]))
+
+    @staticmethod
+    def image_size(image_data):
+        """仅读取图片头部获取原图尺寸，无法识别时返回 (0, 0)"""
+        try:
+            return PIL.Image.open(io.BytesIO(image_data)).size
+        except Exception:
+            return 0, 0
+
+    def input_to_tfrecords(self, input_data, label, size=None):
+        """
+        :param input_data: 图片bytes或张量格式的bytes
+        :param label: 标签bytes
+        :param size: 原图尺寸 (宽, 高)，用于训练时按宽度分桶，张量格式为缩放后的尺寸
+        """
+        feature = {
             'input': self.bytes_feature(input_data),
             'label': self.bytes_feature(label),
-        }))
+        }
+        if size:
+            feature['width'] = self.int64_feature(size[0])
+            feature['height'] = self.int64_feature(size[1])
+        return tf.train.Example(features=tf.train.Features(feature=feature))
 
-    def convert_dataset_from_filename(self, output_filename, file_list, mode: RunMode, is_add=False):
+    def serialize_sample(self, file_name, label=None):
+        """
+        读取图片并序列化为 tf.train.Example
+        :param file_name: 图片路径
+        :param label: 标签，为空时从文件名中提取
+        :return: 序列化后的bytes，无效样本返回 None
+        """
+        if file_name.split("/")[-1] in self.ignore_list:
+            return None
+        try:
+            image_data = self.read_image(file_name)
+        except IOError as e:
+            print('could not read:', file_name)
+            print('error:', e)
+            print('skip it \n')
+            return None
+        if label is None:
+            label = re.search(self.model.extract_regex, file_name.split(PATH_SPLIT)[-1])
+            if not label:
+                tf.compat.v1.logging.warning('invalid filename {}, ignored.'.format(file_name))
+                return None
+            label = label.group().encode('utf-8')
+        return self.serialize_image(image_data, label, file_name)
+
+    def serialize_image(self, image, label, name=None):
+        """
+        按数据集格式序列化单张图片
+        :param image: 图片bytes或内存中的 [高, 宽, 通道] uint8 数组
+        :param label: 标签bytes
+        :param name: 样本名，用于无效样本的日志
+        :return: 序列化后的bytes，无效样本返回 None
+        """
+        if self.dataset_format == DatasetFormat.Tensor:
+            im = self.encoder.pretreat(image)
+            if not isinstance(im, np.ndarray):
+                tf.compat.v1.logging.warning('{}, {} ignored.'.format(im, name if name else label))
+                return None
+            return self.input_to_tfrecords(pack_tensor(im), label, (im.shape[1], im.shape[0])).SerializeToString()
+        if isinstance(image, np.ndarray):
+            size = (image.shape[1], image.shape[0])
+            img_byte_arr = io.BytesIO()
+            PIL.Image.fromarray(image).save(img_byte_arr, format='png')
+            return self.input_to_tfrecords(img_byte_arr.getvalue(), label, size).SerializeToString()
+        return self.input_to_tfrecords(image, label, self.image_size(image)).SerializeToString()
+
+    @staticmethod
+    def write_shard(path, records):
+        """
+        先写入临时文件，完成后重命名并生成记录偏移索引，中断时不会留下不完整的分片
+        :param path: 分片路径
+        :param records: 序列化记录的迭代器，None 表示无效样本
+        :return: 记录数
+        """
+        offsets = [0]
+        with tf.io.TFRecordWriter(path + ".tmp") as writer:
+            for record in records:
+                if record:
+                    writer.write(record)
+                    offsets.append(offsets[-1] + record_size(len(record)))
+        os.replace(path + ".tmp", path)
+        write_index(path, offsets)
+        return len(offsets) - 1
+
+    @staticmethod
+    def open_manifest(output_filename, shard_num, source_hash):
+        """读取分片清单，分片数或数据来源改变时重新开始"""
+        manifest = read_manifest(output_filename)
+        if not manifest or manifest['shards'] != shard_num or manifest['source'] != source_hash:
+            manifest = {'shards': shard_num, 'source': source_hash, 'completed': {}}
+        elif manifest['completed']:
+            tf.compat.v1.logging.info('Resume packing {}, {}/{} shards completed.'.format(
+                output_filename, len(manifest['completed']), shard_num
+            ))
+        write_manifest(output_filename, manifest)
+        return manifest
+
+    def pack_shard(self, output_filename, shard_index, shard_num, samples):
+        """
+        打包单个分片
+        :return: (分片序号, 记录数)
+        """
+        path = shard_path(output_filename, shard_index, shard_num)
+        records = (self.serialize_sample(file_name, label) for file_name, label in samples)
+        return shard_index, self.write_shard(path, records)
+
+    def write_dataset(self, output_filename, samples, mode: RunMode):
+        """
+        多进程打包数据集，DatasetShards > 1 时每个分片由一个进程写入，
+        已完成的分片记录在清单中，中断后重新打包只处理未完成的分片；
+        每个文件同时生成记录偏移索引，训练时无需扫描即可得到样本数
+        :param output_filename: 数据集路径
+        :param samples: [(图片路径, 标签/None)]
+        :param mode: 运行模式（区分：训练/验证）
+        """
+        shard_num = self.model.dataset_shards
+        workers = min(self.model.data_workers, shard_num) if shard_num > 1 else self.model.data_workers
+        if shard_num <= 1:
+            # 经临时文件写入，中断时不会留下被误认为已完成的数据集，但不支持续接
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                records = executor.map(self.serialize_sample, *zip(*samples), chunksize=256) if samples else []
+                pbar = tqdm(records, total=len(samples))
+                pbar.set_description('[Processing dataset %s]' % mode)
+                self.write_shard(output_filename, pbar)
+            return
+
+        source_hash = hashlib.md5(json.dumps(samples, ensure_ascii=False, default=str).encode("utf8")).hexdigest()
+        manifest = self.open_manifest(output_filename, shard_num, source_hash)
+        pending = [i for i in range(shard_num) if str(i) not in manifest['completed']]
+        pbar = tqdm(total=sum(len(samples[i::shard_num]) for i in pending))
+        pbar.set_description('[Processing dataset %s]' % mode)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            tasks = {
+                executor.submit(
+                    self.pack_shard, output_filename, i, shard_num, samples[i::shard_num]
+                ): len(samples[i::shard_num]) for i in pending
+            }
+            for task in as_completed(tasks):
+                shard_index, count = task.result()
+                manifest['completed'][str(shard_index)] = count
+                write_manifest(output_filename, manifest)
+                pbar.update(tasks[task])
+        pbar.close()
+
+    def output_filename(self, output_filename, mode: RunMode, is_add=False):
         if is_add:
             output_filename = self.model.dataset_increasing_name(mode)
             if not output_filename:
                 raise FileNotFoundError('Basic data set missing, please check.')
             output_filename = os.path.join(self.model.dataset_root_path, output_filename)
-        with tf.io.TFRecordWriter(output_filename) as writer:
-            pbar = tqdm(file_list)
-            for i, file_name in enumerate(pbar):
-                try:
-                    if file_name.split("/")[-1] in self.ignore_list:
-                        continue
-                    image_data = self.read_image(file_name)
-                    try:
-                        labels = re.search(self.model.extract_regex, file_name.split(PATH_SPLIT)[-1])
-                    except re.error as e:
-                        print('error:', e)
-                        return
-                    if labels:
-                        labels = labels.group()
-                    else:
-                        tf.compat.v1.logging.warning('invalid filename {}, ignored.'.format(file_name))
-                        continue
-                        # raise NameError('invalid filename {}'.format(file_name))
-                    labels = labels.encode('utf-8')
-
-                    example = self.input_to_tfrecords(image_data, labels)
-                    writer.write(example.SerializeToString())
-                    pbar.set_description('[Processing dataset %s] [filename: %s]' % (mode, file_name))
-
-                except IOError as e:
-                    print('could not read:', file_list[1])
-                    print('error:', e)
-                    print('skip it \n')
+        return output_filename
+
+    def convert_dataset_from_filename(self, output_filename, file_list, mode: RunMode, is_add=False):
+        output_filename = self.output_filename(output_filename, mode, is_add)
+        try:
+            re.compile(self.model.extract_regex)
+        except re.error as e:
+            print('error:', e)
+            return
+        self.write_dataset(output_filename, [(file_name, None) for file_name in file_list], mode)
 
     def convert_dataset_from_txt(self, output_filename, file_path, label_lines, mode: RunMode, is_add=False):
-        if is_add:
-            output_filename = self.model.dataset_increasing_name(mode)
-            if not output_filename:
-                raise FileNotFoundError('Basic data set missing, please check.')
-            output_filename = os.path.join(self.model.dataset_root_path, output_filename)
-        file_list, label_list = [], []
+        output_filename = self.output_filename(output_filename, mode, is_add)
+        samples = []
         for line in label_lines:
             filename, label = line.split(" ", 1)
             label = label.replace("\n", "")
-            label_list.append(label.encode('utf-8'))
-            path = os.path.join(file_path, filename)
-            file_list.append(path)
-
-        if os.path.exists(output_filename):
-            print('已存在, 跳过')
-            return
+            samples.append((os.path.join(file_path, filename), label.encode('utf-8')))
+        # 已完成的分片由 write_dataset 按清单续接，验证集与训练集始终来自同一次划分
+        self.write_dataset(output_filename, samples, mode)
 
-        with tf.io.TFRecordWriter(output_filename) as writer:
-            pbar = tqdm(file_list)
-            for i, file_name in enumerate(pbar):
-                try:
-                    image_data = self.read_image(file_name)
-                    labels = label_list[i]
-                    example = self.input_to_tfrecords(image_data, labels)
-                    writer.write(example.SerializeToString())
-                    pbar.set_description('[Processing dataset %s] [filename: %s]' % (mode, file_name))
-                except IOError as e:
-                    print('could not read:', file_list[1])
-                    print('error:', e)
-                    print('skip it \n')
+    def make_validation_cache(self):
+        """生成验证集张量缓存，训练时验证批次直接从内存映射中切片"""
+        feeder = DataIterator(model_conf=self.model, mode=RunMode.Validation)
+        feeder.tensor_cache(self.model.validation_path[DatasetType.TFRecords])
 
     @staticmethod
     def merge_source(source):
@@ -239,7 +364,8 @@ class DataSets:
                 with open(train_label_file, "r", encoding="utf8") as f:
                     sample_label_line = f.readlines()
 
-                random.shuffle(sample_label_line)
+                # 固定种子，重新执行时划分结果不变，已完成的分片才能续接
+                random.Random(0).shuffle(sample_label_line)
 
                 train_label_line = sample_label_line[self.model.validation_set_num:]
                 val_label_line = sample_label_line[:self.model.validation_set_num]
@@ -259,6 +385,9 @@ class DataSets:
                     is_add=is_add,
                 )
 
+        if self.model.validation_cache:
+            self.make_validation_cache()
+
         state = "DONE"
         if callback:
             callback()
@@ -9,6 +9,7 @@ import hashlib
 import time
 import random
 import logging
+import functools
 
 
 class BackgroundType(Enum):
@@ -17,6 +18,64 @@ class BackgroundType(Enum):
     RGB = 'rgb'
 
 
+@functools.lru_cache(maxsize=256)
+def load_font(font_type, font_size) -> ImageFont.FreeTypeFont:
+    """按 (字体路径, 字号) 缓存已加载的字体，避免每次生成都重新解析字体文件"""
+    return ImageFont.truetype(font_type, font_size)
+
+
+@functools.lru_cache(maxsize=None)
+def font_codepoints(font_type) -> frozenset:
+    """字体 cmap 中包含的字符编码，每个字体文件只读取一次"""
+    font = TTFont(font_type, lazy=True)
+    try:
+        return frozenset(font.getBestCmap())
+    finally:
+        font.close()
+
+
+class GlyphAtlas(object):
+    """
+    单个字体/字号的字形图集：字符首次使用时渲染灰度遮罩并缓存，
+    绘制时以 NumPy 按遮罩透明度混合到图片数组中，取代逐字符的 ImageDraw.text
+    """
+
+    def __init__(self, font: ImageFont.FreeTypeFont):
+        self.font = font
+        self.glyphs = {}
+
+    def glyph(self, char):
+        """:return: (遮罩透明度, 左偏移, 上偏移)"""
+        glyph = self.glyphs.get(char)
+        if glyph is None:
+            left, top, right, bottom = self.font.getbbox(char)
+            mask = Image.new('L', (max(right - left, 1), max(bottom - top, 1)), 0)
+            ImageDraw.Draw(mask).text((-left, -top), char, font=self.font, fill=255)
+            glyph = self.glyphs[char] = (np.asarray(mask, dtype=np.float32)[:, :, np.newaxis] / 255., left, top)
+        return glyph
+
+    def draw(self, image: np.ndarray, xy, char, fill):
+        """
+        与 ImageDraw.text(xy, char, fill=fill) 等效的绘制，超出图片的部分被裁剪
+        :param image: [高, 宽, 3] 的 uint8 数组，原地修改
+        """
+        alpha, left, top = self.glyph(char)
+        x, y = xy[0] + left, xy[1] + top
+        height, width = image.shape[:2]
+        x0, y0, x1, y1 = max(x, 0), max(y, 0), min(x + alpha.shape[1], width), min(y + alpha.shape[0], height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        alpha = alpha[y0 - y: y1 - y, x0 - x: x1 - x]
+        region = image[y0: y1, x0: x1]
+        region[:] = region + (np.asarray(fill, dtype=np.float32) - region) * alpha + 0.5
+
+
+@functools.lru_cache(maxsize=256)
+def load_glyph_atlas(font_type, font_size) -> GlyphAtlas:
+    """按 (字体路径, 字号) 缓存字形图集，字形按需渲染，淘汰后重建只需重新渲染用到的字符"""
+    return GlyphAtlas(load_font(font_type, font_size))
+
+
 class RandomCaptcha(object):
     def __init__(self):
         self.__width = [130, 160]
@@ -35,6 +94,15 @@ class RandomCaptcha(object):
         self.__font_mode = 0
         self.__max_line_count = 2
         self.__max_point_count = 20
+        self.__glyph_atlas = False
+
+    @property
+    def glyph_atlas(self) -> bool:
+        return self.__glyph_atlas
+
+    @glyph_atlas.setter
+    def glyph_atlas(self, value: bool):
+        self.__glyph_atlas = value
 
     @property
     def max_point_count(self):
@@ -164,28 +232,29 @@ class RandomCaptcha(object):
     def width(self, value):
         self.__width = value
 
-    def check_font(self):
+    def check_font(self, remove=True):
+        """
+        筛选包含全部样本字符的字体
+        :param remove: 是否删除缺少字形的字体文件，为 False 时只从字体列表中排除
+        """
+        codepoints = {ord(str(item)) for item in self.sample}
+        available = []
         for font_type in self.fonts_list:
             try:
-                font = TTFont(font_type)
-                uni_map = font['cmap'].tables[0].ttFont.getBestCmap()
-                for item in self.sample:
-                    codepoint = ord(str(item))
-                    if codepoint in uni_map.keys():
-                        continue
-                    else:
-                        font.close()
-                        raise Exception("{} not found!".format(item))
+                missing = codepoints - font_codepoints(font_type)
+                if missing:
+                    raise Exception("{} not found!".format("".join(chr(i) for i in missing)))
+                available.append(font_type)
             except Exception as e:
+                if not remove:
+                    continue
                 try:
                     os.remove(font_type)
                 except:
                     pass
-                del self.fonts_list[self.fonts_list.index(font_type)]
+        self.fonts_list = available
 
-        pass
-
-    def set_text(self, __image: ImageDraw, img_width, img_height):
+    def set_text(self, __image, img_width, img_height):
 
         if img_width >= 150:
             font_size = random.choice(range(self.font_size[0], self.font_size[1]))
@@ -197,10 +266,12 @@ class RandomCaptcha(object):
         max_height = int(img_height)
         font_type = random.choice(self.fonts_list)
         try:
-            font = ImageFont.truetype(font_type, font_size)
+            font = load_font(font_type, font_size)
         except OSError:
             del self.fonts_list[self.fonts_list.index(font_type)]
             raise Exception("{} opened fail")
+        # 传入图片数组时使用字形图集绘制
+        atlas = load_glyph_atlas(font_type, font_size) if isinstance(__image, np.ndarray) else None
         labels = []
         for idx in range(font_num):
             fw = range(int(max_width - font_size))
@@ -211,8 +282,11 @@ class RandomCaptcha(object):
             y = random.choice(range(int(max_height - font_size)))
             f = random.choice(self.sample)
             labels.append(f)
-            __image.text((x, y), f, font=font,
-                         fill=(random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)))
+            fill = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
+            if atlas:
+                atlas.draw(__image, (x, y), f, fill)
+            else:
+                __image.text((x, y), f, font=font, fill=fill)
         return labels, font_type
 
     def set_noise(self, __image: ImageDraw, img_width, img_height):
@@ -256,9 +330,15 @@ class RandomCaptcha(object):
                 b_range = rgb_range['b']
                 rgb = (random.randint(r_range[0], r_range[1]), random.randint(g_range[0], g_range[1]),
                        random.randint(b_range[0], b_range[1]))
-                __image = Image.new('RGB', (img_width, img_height), rgb)
-                img = ImageDraw.Draw(__image)
-                labels, font_type = self.set_content(img, img_width, img_height)
+                if self.glyph_atlas:
+                    canvas = np.full([img_height, img_width, 3], rgb, dtype=np.uint8)
+                    labels, font_type = self.set_text(canvas, img_width, img_height)
+                    __image = Image.fromarray(canvas)
+                    self.set_noise(ImageDraw.Draw(__image), img_width, img_height)
+                else:
+                    __image = Image.new('RGB', (img_width, img_height), rgb)
+                    img = ImageDraw.Draw(__image)
+                    labels, font_type = self.set_content(img, img_width, img_height)
                 if mode == "bytes":
                     img_byte_arr = io.BytesIO()
                     __image.save(img_byte_arr, format=img_format)
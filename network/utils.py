@@ -36,8 +36,10 @@ class NetworkUtils(object):
         self.is_training = self._is_training()
 
     def _is_training(self):
-        """ 取消 is_training 占位符作为[Predict]模式的输入依赖 """
-        return False if self.mode == RunMode.Predict else tf.keras.backend.placeholder(dtype=tf.bool)
+        """ 取消 is_training 占位符作为[Predict]模式的输入依赖，训练图默认为 True，验证时显式传入 False """
+        if self.mode == RunMode.Predict:
+            return False
+        return tf.compat.v1.placeholder_with_default(True, shape=[], name='is_training')
 
     @staticmethod
     def hard_swish(x, name='hard_swish'):
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""此脚本为本地HTTP推理服务：加载 fuse_model.output_model 输出的 .pl 模型包，将并发请求合并为微批次统一预测"""
+import sys
+import json
+import time
+import base64
+import asyncio
+import binascii
+import urllib.parse
+import tensorflow as tf
+from concurrent.futures import ThreadPoolExecutor
+from config import ModelConfig
+from constants import ModelType
+from fuse_model import parse_model
+from inference import InferenceEngine, InferenceStats
+
+HTTP_STATUS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+}
+
+# 单个请求体的最大长度
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+
+def guess_model_type(graph_bytes: bytes) -> ModelType:
+    """
+    .pl 模型包中未记录模型类型，按文件头识别：TFLite 带有文件标识；
+    ONNX ModelProto 以字段1 (ir_version, varint) 开头，首字节为 0x08，
+    GraphDef 以字段1 (node, 长度前缀) 开头，首字节为 0x0a，其余默认按 PB 加载
+    """
+    if graph_bytes[4:8] == b'TFL3':
+        return ModelType.TFLITE
+    if graph_bytes[:1] == b'\x08':
+        return ModelType.ONNX
+    return ModelType.PB
+
+
+def load_bundle(path, model_type: ModelType = None, batch_size=64):
+    """
+    加载 .pl 模型包
+    :param path: 模型包路径
+    :param model_type: 模型类型，为空时自动识别
+    :param batch_size: 最大批次大小
+    :return: 推理引擎
+    """
+    with open(path, "rb") as f:
+        source_conf, graph_bytes = parse_model(f.read())
+    model_conf = ModelConfig(
+        project_name=source_conf['Model']['ModelName'], is_dev=False, source_conf=source_conf
+    )
+    return InferenceEngine(
+        model_conf,
+        model_type=model_type if model_type else guess_model_type(graph_bytes),
+        model_bytes=graph_bytes,
+        batch_size=batch_size,
+        workers=0
+    )
+
+
+class MicroBatcher(object):
+    """
+    微批次调度：请求入队后等待，批次满或时间窗口结束时合并为一次会话调用，
+    结果按请求顺序分发回各自的 Future
+    """
+
+    def __init__(self, engine: InferenceEngine, batch_size, window):
+        """
+        :param engine: 推理引擎
+        :param batch_size: 单个微批次的最大请求数
+        :param window: 等待凑批的时间窗口 (秒)
+        """
+        self.engine = engine
+        self.batch_size = batch_size
+        self.window = window
+        self.queue = asyncio.Queue()
+        self.stats = InferenceStats()
+        # 会话调用只在单个线程中串行执行，不阻塞事件循环
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    async def predict(self, image_bytes):
+        loop = asyncio.get_running_loop()
+        start_time = time.time()
+        image_array = await loop.run_in_executor(None, self.engine.encode, [image_bytes])
+        if image_array[0] is None:
+            return None
+        future = loop.create_future()
+        await self.queue.put((image_array[0], future))
+        result = await future
+        self.stats.add([time.time() - start_time])
+        return result
+
+    async def collect(self):
+        """取出一个微批次：至少一个请求，之后在时间窗口内尽量凑满批次"""
+        loop = asyncio.get_running_loop()
+        items = [await self.queue.get()]
+        deadline = loop.time() + self.window
+        while len(items) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self.collect()
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.engine.predict_arrays, [item[0] for item in items]
+                )
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(items, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def close(self):
+        if self.task:
+            self.task.cancel()
+        self.executor.shutdown(wait=False)
+
+
+class PredictServer(object):
+    """
+    基于 asyncio 的HTTP推理服务 (仅标准库)：
+    POST /predict               JSON {"image": base64, "model_name": 模型名} 或 请求体为图片bytes/base64文本
+    POST /predict/{model_name}  同上，模型名由路径指定
+    GET  /stats                 各模型的吞吐量及延迟统计
+    """
+
+    def __init__(self, engines: dict, batch_size=32, window=0.005):
+        """
+        :param engines: {模型名: 推理引擎}
+        :param batch_size: 单个微批次的最大请求数
+        :param window: 等待凑批的时间窗口 (秒)
+        """
+        self.batchers = {name: MicroBatcher(engine, batch_size, window) for name, engine in engines.items()}
+        self.server = None
+
+    @property
+    def port(self):
+        return self.server.sockets[0].getsockname()[1] if self.server else None
+
+    async def start(self, host='127.0.0.1', port=19952):
+        for batcher in self.batchers.values():
+            batcher.start()
+        self.server = await asyncio.start_server(self.handle, host, port)
+        tf.compat.v1.logging.info("Predict server listening on {}:{}, models: {}".format(
+            host, self.port, list(self.batchers.keys())
+        ))
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        for batcher in self.batchers.values():
+            batcher.close()
+
+    @staticmethod
+    def decode_image(body: bytes, content_type: str):
+        """
+        解析请求中的图片
+        :return: (image_bytes, model_name)
+        """
+        if content_type.startswith('application/json'):
+            data = json.loads(body.decode("utf8"))
+            return base64.b64decode(data['image']), data.get('model_name')
+        try:
+            return base64.b64decode(body, validate=True), None
+        except (binascii.Error, ValueError):
+            return body, None
+
+    async def route(self, method, path, headers, body):
+        url = urllib.parse.urlsplit(path)
+        parts = [part for part in url.path.split('/') if part]
+        if parts == ['stats'] and method == 'GET':
+            return 200, {name: str(batcher.stats) for name, batcher in self.batchers.items()}
+        if not parts or parts[0] != 'predict':
+            return 404, {'success': False, 'message': 'Not Found'}
+        if method != 'POST':
+            return 405, {'success': False, 'message': 'Method Not Allowed'}
+        try:
+            image_bytes, model_name = self.decode_image(body, headers.get('content-type', ''))
+        except (ValueError, KeyError, binascii.Error):
+            return 400, {'success': False, 'message': 'Invalid image data'}
+        query = urllib.parse.parse_qs(url.query)
+        if len(parts) > 1:
+            model_name = urllib.parse.unquote(parts[1])
+        elif not model_name and 'model_name' in query:
+            model_name = query['model_name'][0]
+        elif not model_name and len(self.batchers) == 1:
+            model_name = list(self.batchers.keys())[0]
+        if model_name not in self.batchers:
+            return 404, {'success': False, 'message': 'Model {} Not Found'.format(model_name)}
+        result = await self.batchers[model_name].predict(image_bytes)
+        if result is None:
+            return 400, {'success': False, 'message': 'Image decode failed', 'model_name': model_name}
+        return 200, {'success': True, 'message': result, 'model_name': model_name}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """HTTP/1.1 连接处理，支持 keep-alive"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode("latin1").strip().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, value = line.decode("latin1").split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                content_length = int(headers.get('content-length', 0))
+                if content_length > MAX_BODY_SIZE:
+                    status, response = 413, {'success': False, 'message': 'Payload Too Large'}
+                    headers['connection'] = 'close'
+                else:
+                    body = await reader.readexactly(content_length) if content_length else b''
+                    try:
+                        status, response = await self.route(method, path, headers, body)
+                    except Exception as e:
+                        tf.compat.v1.logging.error(e)
+                        status, response = 500, {'success': False, 'message': str(e)}
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                payload = json.dumps(response, ensure_ascii=False).encode("utf8")
+                writer.write(
+                    "HTTP/1.1 {} {}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                    "Content-Length: {}\r\nConnection: {}\r\n\r\n".format(
+                        status, HTTP_STATUS[status], len(payload), 'keep-alive' if keep_alive else 'close'
+                    ).encode("latin1") + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def main(bundle_paths, host='127.0.0.1', port=19952):
+    engines = {}
+    for path in bundle_paths:
+        engine = load_bundle(path)
+        engines[engine.model_conf.model_name] = engine
+    server = PredictServer(engines)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(server.start(host, port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.close())
+
+
+if __name__ == '__main__':
+    tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.INFO)
+    main(bundle_paths=sys.argv[1:])
@@ -389,18 +389,67 @@ def preprocessing(
     return pretreatment.get()
 
 
-def preprocessing_by_func(exec_map: dict, src_arr, key=None):
+class ExecMap(object):
+    """
+    预编译的 ExecuteMap：每个键的语句只解析一次为代码对象，"@@" 为表达式 (结果赋值给 target_arr)，"$$" 为语句；
+    序列化时只保存源语句，在工作进程中重新编译
+    """
+
+    def __init__(self, exec_map: dict):
+        self.exec_map = exec_map if exec_map else {}
+        self.keys = tuple(self.exec_map.keys())
+        self.ops = {
+            key: tuple(self.compile(sentence) for sentence in sentences if sentence[:2] in ("@@", "$$"))
+            for key, sentences in self.exec_map.items()
+        }
+
+    @staticmethod
+    def compile(sentence):
+        is_eval = sentence.startswith("@@")
+        return is_eval, compile(sentence[2:], "<ExecuteMap>", "eval" if is_eval else "exec")
+
+    def __bool__(self):
+        return bool(self.keys)
+
+    def __getstate__(self):
+        return self.exec_map
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+    def __call__(self, src_arr, key=None):
+        """
+        :param src_arr: RGB(A) 图片数组
+        :param key: 使用的键，为空时随机选择
+        :return: RGB 图片数组，空操作列表直接返回输入
+        """
+        key = key if key else random.choice(self.keys)
+        ops = self.ops[key]
+        if not ops:
+            return src_arr
+        # 表达式与语句都可能原地绘制，始终交给操作一个可写、连续的 BGR 拷贝
+        target_arr = cv2.cvtColor(src_arr, cv2.COLOR_RGB2BGR)
+        scope = {'src_arr': src_arr, 'target_arr': target_arr, 'key': key}
+        for is_eval, code in ops:
+            if is_eval:
+                scope['target_arr'] = eval(code, globals(), scope)
+            else:
+                exec(code, globals(), scope)
+        target_arr = scope['target_arr']
+        if target_arr.flags.c_contiguous:
+            return cv2.cvtColor(target_arr, cv2.COLOR_BGR2RGB)
+        return np.ascontiguousarray(target_arr[:, :, 2::-1])
+
+
+def preprocessing_by_func(exec_map, src_arr, key=None):
+    """
+    :param exec_map: ExecMap 或 ExecuteMap 配置字典 (字典每次调用都需重新编译，应优先使用 ModelConfig.pre_exec_ops)
+    """
     if not exec_map:
         return src_arr
-    target_arr = cv2.cvtColor(src_arr, cv2.COLOR_RGB2BGR)
-    if not key:
-        key = random.choice(list(exec_map.keys()))
-    for sentence in exec_map.get(key):
-        if sentence.startswith("@@"):
-            target_arr = eval(sentence[2:])
-        elif sentence.startswith("$$"):
-            exec(sentence[2:])
-    return cv2.cvtColor(target_arr, cv2.COLOR_BGR2RGB)
+    if not isinstance(exec_map, ExecMap):
+        exec_map = ExecMap(exec_map)
+    return exec_map(src_arr, key)
 
 
 if __name__ == '__main__':
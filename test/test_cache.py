@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import io
+import types
+import numpy as np
+import PIL.Image
+import pytest
+import tensorflow as tf
+from constants import InputDType, LossFunction
+from exception import SystemException
+from utils.cache import TensorCache
+from utils.tfrecord import pack_tensor, unpack_tensor
+
+
+def make_model_conf(root):
+    return types.SimpleNamespace(
+        dataset_root_path=str(root),
+        pre_binaryzation=-1,
+        pre_replace_transparent=False,
+        pre_horizontal_stitching=False,
+        pre_concat_frames=-1,
+        pre_blend_frames=-1,
+        pre_exec_map={},
+        resize=[-1, 8],
+        image_channel=1,
+        input_dtype=InputDType.UInt8,
+        input_width_axis=1,
+        category=['', 'a', 'b'],
+        loss_func=LossFunction.CTC,
+        max_label_num=4,
+        auto_padding=False,
+        label_split=None,
+    )
+
+
+def write_records(path, inputs):
+    with tf.io.TFRecordWriter(path) as writer:
+        for input_data, label in inputs:
+            feature = {
+                'input': tf.train.Feature(bytes_list=tf.train.BytesList(value=[input_data])),
+                'label': tf.train.Feature(bytes_list=tf.train.BytesList(value=[label])),
+            }
+            writer.write(tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString())
+
+
+def to_png(width):
+    img_byte_arr = io.BytesIO()
+    PIL.Image.new('L', (width, 8), width).save(img_byte_arr, format='png')
+    return img_byte_arr.getvalue()
+
+
+def stitch_encode(input_data, label):
+    """模拟改变宽度的预处理：编码后的宽度为原图的两倍"""
+    im = np.asarray(PIL.Image.open(io.BytesIO(input_data)))
+    return np.concatenate([im, im], axis=1)[:, :, None], [1] * len(label)
+
+
+def test_cache_width_follows_encoded_inputs(tmp_path):
+    path = str(tmp_path / "Validation.tfrecords")
+    write_records(path, [(to_png(width), b'ab') for width in [5, 12, 7]])
+    cache = TensorCache(make_model_conf(tmp_path), path)
+    cache.build(stitch_encode)
+    cache.load()
+    assert cache.widths.tolist() == [10, 24, 14]
+    input_batch, (label_values, label_lengths) = cache.next_batch(3)
+    assert input_batch.shape == (3, 8, 24, 1)
+    assert (input_batch[0, :, :10] == 5).all() and (input_batch[0, :, 10:] == 0).all()
+    assert (input_batch[1] == 12).all()
+    assert label_lengths.tolist() == [2, 2, 2]
+
+
+def test_cache_of_tensor_records(tmp_path):
+    path = str(tmp_path / "Validation.tfrecords")
+    arrays = [np.full([8, width, 1], width, dtype=np.uint8) for width in [6, 9]]
+    write_records(path, [(pack_tensor(array), b'a') for array in arrays])
+    cache = TensorCache(make_model_conf(tmp_path), path)
+    cache.build(lambda input_data, label: (unpack_tensor(input_data), [1]))
+    cache.load()
+    assert cache.widths.tolist() == [6, 9]
+    input_batch, _ = cache.next_batch(2)
+    assert input_batch.shape == (2, 8, 9, 1)
+    assert (input_batch[1] == 9).all() and (input_batch[0, :, :6] == 6).all()
+
+
+def test_empty_cache(tmp_path):
+    path = str(tmp_path / "Validation.tfrecords")
+    write_records(path, [(b'invalid', b'ab')])
+    cache = TensorCache(make_model_conf(tmp_path), path)
+    cache.build(lambda input_data, label: None)
+    cache.load()
+    assert cache.count == 0
+    with pytest.raises(SystemException):
+        cache.next_batch(2)
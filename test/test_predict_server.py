@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import io
+import json
+import pickle
+import base64
+import asyncio
+import yaml
+import PIL.Image
+import tensorflow as tf
+from fuse_model import concat_model
+from constants import ModelType
+from predict_server import PredictServer, load_bundle, guess_model_type
+
+SOURCE_CONF = """
+System: {MemoryUsage: 0.5, Version: 1}
+Model: {ModelName: server-test, ModelField: Image, ModelScene: Classification}
+NeuralNet:
+  CNNNetwork: CNNX
+  RecurrentNetwork: NoRecurrent
+  UnitsNum: 64
+  Optimizer: Adam
+  OutputLayer: {LossFunction: CrossEntropy, Decoder: CrossEntropy}
+Label: {LabelFrom: FileName, ExtractRegex: '.*?(?=_)', LabelSplit: null}
+FieldParam:
+  Category: NUMERIC
+  Resize: [64, 32]
+  ImageChannel: 1
+  ImageWidth: 64
+  ImageHeight: 32
+  MaxLabelNum: 2
+  AutoPadding: false
+  OutputSplit: null
+Trains:
+  DatasetPath: {Training: [], Validation: []}
+  SourcePath: {Training: [], Validation: []}
+  LearningRate: 0.001
+DataAugmentation: {}
+Pretreatment: {}
+"""
+
+
+def build_bundle(path):
+    """明亮图片输出 '11'，暗图片输出 '00' 的测试计算图"""
+    graph = tf.Graph()
+    with graph.as_default():
+        x = tf.compat.v1.placeholder(tf.float32, [None, 64, 32, 1], name='input')
+        code = tf.cast(tf.reduce_mean(x, axis=[1, 2, 3]) > 0.5, tf.int64) + 1
+        tf.identity(tf.stack([code, code], axis=1), name='dense_decoded')
+    source_conf = yaml.load(SOURCE_CONF, Loader=yaml.SafeLoader)
+    concat_model(path, pickle.dumps(source_conf), graph.as_graph_def().SerializeToString())
+
+
+def image_bytes(color):
+    buffer = io.BytesIO()
+    PIL.Image.new('L', (80, 30), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+async def request(port, body, path='/predict', content_type='application/octet-stream'):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(
+        "POST {} HTTP/1.1\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(
+            path, content_type, len(body)
+        ).encode("latin1") + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return json.loads(response.split(b'\r\n\r\n', 1)[1].decode("utf8"))
+
+
+def test_micro_batch_demultiplex(tmp_path):
+    bundle_path = str(tmp_path / "server-test.pl")
+    build_bundle(bundle_path)
+    engine = load_bundle(bundle_path)
+
+    async def run():
+        server = PredictServer({engine.model_conf.model_name: engine}, batch_size=8, window=0.05)
+        await server.start(port=0)
+        colors = [255 if i % 2 else 0 for i in range(12)]
+        bodies = [
+            json.dumps({'image': base64.b64encode(image_bytes(color)).decode()}).encode() if i % 3 == 0 else
+            image_bytes(color) if i % 3 == 1 else base64.b64encode(image_bytes(color))
+            for i, color in enumerate(colors)
+        ]
+        responses = await asyncio.gather(*[
+            request(
+                server.port, body, path='/predict/server-test' if i % 2 else '/predict',
+                content_type='application/json' if i % 3 == 0 else 'application/octet-stream'
+            ) for i, body in enumerate(bodies)
+        ])
+        missing = await request(server.port, image_bytes(0), path='/predict/missing')
+        await server.close()
+        return colors, responses, missing
+
+    colors, responses, missing = asyncio.run(run())
+    assert [r['message'] for r in responses] == ['11' if color else '00' for color in colors]
+    assert all(r['success'] for r in responses)
+    assert not missing['success']
+
+
+def test_guess_model_type():
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.constant(1, name='input')
+    assert guess_model_type(graph.as_graph_def().SerializeToString()) == ModelType.PB
+    # ONNX ModelProto: ir_version = 7
+    assert guess_model_type(b'\x08\x07\x12\x07pytorch') == ModelType.ONNX
+    assert guess_model_type(b'\x1c\x00\x00\x00TFL3') == ModelType.TFLITE
@@ -1,6 +1,45 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
 # Author: kerlomz <kerlomz@gmail.com>
+import pickle
+import random
+import cv2
+import numpy as np
+from pretreatment import ExecMap, preprocessing_by_func
+
+EXEC_MAP = {
+    "swap": ["@@target_arr[:, :, (0, 2, 1)]"],
+    "draw": ["@@cv2.rectangle(target_arr, (0, 0), (5, 5), (0, 0, 255), -1)"],
+    "invert": ["$$target_arr[:, :, 2] = 255 - target_arr[:, :, 2]", "@@target_arr[:, :, (1, 2, 0)]"],
+    "empty": [],
+}
+
+
+def reference_preprocessing_by_func(exec_map, src_arr, key=None):
+    """逐次 eval/exec 的原始实现"""
+    target_arr = cv2.cvtColor(src_arr, cv2.COLOR_RGB2BGR)
+    if not key:
+        key = random.choice(list(exec_map.keys()))
+    for sentence in exec_map.get(key):
+        if sentence.startswith("@@"):
+            target_arr = eval(sentence[2:])
+        elif sentence.startswith("$$"):
+            exec(sentence[2:])
+    return cv2.cvtColor(target_arr, cv2.COLOR_BGR2RGB)
+
+
+def test_exec_map_matches_reference():
+    src_arr = np.random.RandomState(0).randint(0, 256, [12, 20, 3], dtype=np.uint8)
+    source = src_arr.copy()
+    exec_map = pickle.loads(pickle.dumps(ExecMap(EXEC_MAP)))
+    for key in EXEC_MAP:
+        expected = reference_preprocessing_by_func(EXEC_MAP, src_arr, key)
+        assert np.array_equal(exec_map(src_arr, key), expected)
+        assert np.array_equal(preprocessing_by_func(EXEC_MAP, src_arr, key), expected)
+    # 操作不能修改输入数组
+    assert np.array_equal(src_arr, source)
+    assert (exec_map(src_arr, "draw")[:6, :6] == [255, 0, 0]).all()
+
 
 if __name__ == '__main__':
     import io
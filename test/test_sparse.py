@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import numpy as np
+from utils.sparse import sparse_tuple_from_sequences, sparse_tuple_from_packed, pack_padded
+
+
+def reference_sparse_tuple(sequences):
+    indices, values = [], []
+    for n, seq in enumerate(sequences):
+        indices.extend(zip([n] * len(seq), range(len(seq))))
+        values.extend(seq)
+    indices = np.asarray(indices, dtype=np.int64)
+    shape = np.asarray([len(sequences), indices.max(0)[1] + 1], dtype=np.int64)
+    return indices, np.asarray(values, dtype=np.int32), shape
+
+
+def test_sparse_tuple_matches_reference():
+    sequences = [[3, 1, 4], [1], [5, 9, 2, 6], [5, 3]]
+    for actual, expected in zip(sparse_tuple_from_sequences(sequences), reference_sparse_tuple(sequences)):
+        np.testing.assert_array_equal(actual, expected)
+        assert actual.dtype == expected.dtype
+
+
+def test_sparse_tuple_from_padded():
+    sequences = [[3, 1, 4], [1], [5, 9, 2, 6]]
+    padded = np.full([3, 4], -1, dtype=np.int32)
+    for i, seq in enumerate(sequences):
+        padded[i, :len(seq)] = seq
+    values, lengths = pack_padded(padded, [3, 1, 4])
+    for actual, expected in zip(sparse_tuple_from_packed(values, lengths), reference_sparse_tuple(sequences)):
+        np.testing.assert_array_equal(actual, expected)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import types
+import numpy as np
+from validation import Validation
+
+
+def reference_levenshtein(source, target):
+    distance = list(range(len(target) + 1))
+    for i, s in enumerate(source, 1):
+        previous, distance[0] = distance[0], i
+        for j, t in enumerate(target, 1):
+            previous, distance[j] = distance[j], min(distance[j] + 1, distance[j - 1] + 1, previous + (s != t))
+    return distance[-1]
+
+
+def test_accuracy_cer_and_confusion():
+    model_conf = types.SimpleNamespace(category=['', 'a', 'b', 'c', 'd'], category_num=5)
+    validation = Validation(model_conf)
+    labels = [[1, 2, 3], [4], [1, 1, 2, 2], [3, 4]]
+    # 解码结果以 category_num 补齐，0 为空白字符
+    decoded = np.asarray([
+        [1, 2, 3, 5],
+        [4, 0, 5, 5],
+        [1, 2, 2, 5],
+        [3, 3, 5, 5],
+    ])
+    assert validation.accuracy_calculation(labels, decoded, verbose=False) == 0.5
+    expected_distance = sum(
+        reference_levenshtein(label, [c for c in row if c not in (0, 5)]) for label, row in zip(labels, decoded)
+    )
+    assert validation.cer == expected_distance / 10
+    assert validation.top_confusions(1) == [('d', 'c', 1)]
+
+    validation.accuracy_calculation([[2]], np.asarray([[2]]), verbose=False)
+    assert validation.accuracy == 3 / 5
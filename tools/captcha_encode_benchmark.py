@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""
+随机验证码编码基准：对比 PNG bytes 往返 (create(mode="bytes") + Encoder.image) 与内存数组直接编码的单样本耗时
+用法: python tools/captcha_encode_benchmark.py <工程名> [样本数]
+"""
+import io
+import os
+import sys
+import time
+import PIL.Image
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import ModelConfig
+from constants import RunMode
+from encoder import Encoder
+from utils.captcha_pool import random_captcha
+
+
+def to_png(image):
+    img_byte_arr = io.BytesIO()
+    PIL.Image.fromarray(image).save(img_byte_arr, format="png")
+    return img_byte_arr.getvalue()
+
+
+def benchmark(func, images):
+    start_time = time.time()
+    for image in images:
+        func(image)
+    return (time.time() - start_time) / len(images) * 1000
+
+
+def main(project_name, num=1000):
+    model_conf = ModelConfig(project_name=project_name)
+    ran_captcha = random_captcha(model_conf)
+    images = [ran_captcha.create(mode="numpy")[0] for _ in range(num)]
+    for mode in [RunMode.Validation, RunMode.Trains]:
+        encoder = Encoder(model_conf, mode)
+        bytes_time = benchmark(lambda image: encoder.image(to_png(image)), images)
+        numpy_time = benchmark(encoder.image, images)
+        print("{:<10} Bytes: {:.3f} ms/sample, NumPy: {:.3f} ms/sample, Speedup: {:.2f}x".format(
+            mode.value, bytes_time, numpy_time, bytes_time / numpy_time
+        ))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
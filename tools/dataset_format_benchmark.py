@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""
+数据集格式基准：将训练集源图片分别打包为 Bytes 与 Tensor 格式，对比数据集大小及单样本解码耗时
+用法: python tools/dataset_format_benchmark.py <工程名> [样本数]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import tensorflow as tf
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import ModelConfig, DatasetType
+from constants import RunMode, DatasetFormat
+from encoder import Encoder
+from make_dataset import DataSets
+from utils.tfrecord import read_records, parse_example
+
+
+def pack(model_conf: ModelConfig, dataset_format: DatasetFormat, file_list, path):
+    """单进程打包，返回 (记录列表, 数据集大小)"""
+    dataset = DataSets(model_conf, dataset_format)
+    with tf.io.TFRecordWriter(path) as writer:
+        for file_name in file_list:
+            record = dataset.serialize_sample(file_name)
+            if record:
+                writer.write(record)
+    return [parse_example(record)[0] for record in read_records(path)], os.path.getsize(path)
+
+
+def benchmark(encoder: Encoder, inputs):
+    start_time = time.time()
+    for _input in inputs:
+        encoder.image(_input)
+    return (time.time() - start_time) / len(inputs) * 1000
+
+
+def main(project_name, num=1000):
+    model_conf = ModelConfig(project_name=project_name)
+    file_list = DataSets.merge_source(model_conf.trains_path[DatasetType.Directory])[:num]
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for dataset_format in DatasetFormat:
+            inputs, size = pack(
+                model_conf, dataset_format, file_list, os.path.join(temp_dir, dataset_format.value + ".tfrecords")
+            )
+            print("{:<7} Samples: {}, Size: {:.2f} MB, {:.0f} bytes/sample".format(
+                dataset_format.value, len(inputs), size / 1024 ** 2, size / max(len(inputs), 1)
+            ))
+            for mode in [RunMode.Validation, RunMode.Trains]:
+                print("{:<7} {:<10} Decode: {:.3f} ms/sample".format(
+                    dataset_format.value, mode.value, benchmark(Encoder(model_conf, mode), inputs)
+                ))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""
+训练步耗时基准：对比每步计算并同步写入摘要与按 SummarySteps/HistogramSteps/ImageSummarySteps 调度摘要的单步耗时
+用法: python tools/summary_benchmark.py <工程名> [步数]
+"""
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+import tensorflow as tf
+tf.compat.v1.disable_v2_behavior()
+tf.compat.v1.disable_eager_execution()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import core
+import utils.sparse
+from config import ModelConfig, RunMode
+from utils.summary import SummaryScheduler
+
+
+def random_batch(model_conf: ModelConfig, model: core.NeuralNetwork):
+    """按模型输入尺寸生成随机批次"""
+    width = model_conf.resize[0] if model_conf.resize[0] > 0 else model_conf.image_width
+    input_shape = [width if dim is None else dim for dim in model.input_shape]
+    inputs = np.random.randint(0, 256, size=[model_conf.batch_size] + input_shape)
+    inputs = inputs.astype(np.uint8) if model.input_dtype == tf.uint8 else (inputs / 255.).astype(np.float32)
+    labels = np.random.randint(1, model_conf.category_num, size=[model_conf.batch_size, model_conf.max_label_num])
+    return inputs, utils.sparse.sparse_tuple_from_sequences(labels.tolist())
+
+
+def benchmark(feed, steps, step_func):
+    step_func(feed)
+    step_times = []
+    for _ in range(steps):
+        start_time = time.time()
+        step_func(feed)
+        step_times.append(time.time() - start_time)
+    step_times = np.asarray(step_times) * 1000
+    return "Mean: {:.2f} ms/step, Median: {:.2f} ms/step, P95: {:.2f} ms/step".format(
+        step_times.mean(), np.median(step_times), np.percentile(step_times, 95)
+    )
+
+
+def main(project_name, steps=200):
+    model_conf = ModelConfig(project_name=project_name)
+    model = core.NeuralNetwork(
+        mode=RunMode.Trains,
+        model_conf=model_conf,
+        backbone=model_conf.neu_cnn,
+        recurrent=model_conf.neu_recurrent
+    )
+    model.build_graph()
+    model.build_train_op(model_conf.batch_size * 1000)
+    sess = tf.compat.v1.Session()
+    sess.run(tf.compat.v1.global_variables_initializer())
+    inputs, labels = random_batch(model_conf, model)
+    feed = {model.inputs: inputs, model.labels: labels, model.utils.is_training: True}
+    log_dir = tempfile.mkdtemp()
+
+    writer = tf.compat.v1.summary.FileWriter(os.path.join(log_dir, 'every_step'))
+
+    def every_step(feed_dict):
+        summary_str, _, step, _ = sess.run(
+            [model.merged_summary, model.cost, model.global_step, model.train_op], feed_dict=feed_dict
+        )
+        writer.add_summary(summary_str, step)
+
+    print("Every Step:", benchmark(feed, steps, every_step))
+    writer.close()
+
+    scheduler = SummaryScheduler(
+        tf.compat.v1.summary.FileWriter(os.path.join(log_dir, 'scheduled')),
+        global_step=sess.run(model.global_step),
+        scalar=model.merged_summary,
+        scalar_steps=model_conf.summary_steps if model_conf.summary_steps else 100,
+        histogram=model.histogram_summary,
+        histogram_steps=model_conf.histogram_steps,
+        image=model.image_summary,
+        image_steps=model_conf.image_summary_steps
+    )
+
+    def scheduled(feed_dict):
+        summary_fetches = scheduler.fetches()
+        _, step, _, *summaries = sess.run(
+            [model.cost, model.global_step, model.train_op] + summary_fetches, feed_dict=feed_dict
+        )
+        scheduler.add(summaries, step)
+
+    print("Scheduled: ", benchmark(feed, steps, scheduled))
+    scheduler.close()
+    sess.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 200)
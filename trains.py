@@ -13,12 +13,16 @@ except Exception as e:
 import core
 import utils
 import utils.data
+from utils.prefetch import BatchPrefetcher
+from utils.checkpoint import AsyncCheckpointSaver
+from utils.summary import SummaryScheduler
+from evaluator import read_evaluation
 import validation
 from config import *
 from tf_graph_util import convert_variables_to_constants
 from PIL import ImageFile
 from tf_onnx_util import convert_onnx
-from middleware.random_captcha import RandomCaptcha
+from utils.captcha_pool import CaptchaPool, random_captcha
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.INFO)
@@ -125,20 +129,39 @@ class Trains:
             return True
         return False
 
-    def init_captcha_gennerator(self, ran_captcha):
-
-        path = self.model_conf.da_random_captcha['FontPath']
-        if not os.path.exists(path):
-            exception("Font path does not exist.", code=-6754)
-        items = os.listdir(path)
-        fonts = [os.path.join(path, item) for item in items]
-        ran_captcha.sample = NUMBER + ALPHA_UPPER + ALPHA_LOWER
-        ran_captcha.fonts_list = fonts
-        ran_captcha.check_font()
-        ran_captcha.rgb_r = [0, 255]
-        ran_captcha.rgb_g = [0, 255]
-        ran_captcha.rgb_b = [0, 255]
-        ran_captcha.fonts_num = [4, 8]
+    def read_external_accuracy(self, accuracy, epoch, step, cost):
+        """
+        读取独立评估进程在完整验证集上的准确率，尚无评估结果时沿用上一次的准确率
+        :return: 准确率
+        """
+        evaluation = read_evaluation(self.model_conf)
+        if not evaluation:
+            tf.compat.v1.logging.info("Epoch: {}, Step: {}, Waiting for the evaluator...".format(epoch, step))
+            return accuracy
+        tf.compat.v1.logging.info(
+            "Epoch: {}, Step: {}, Accuracy = {:.4f} (Evaluator Step: {}, Samples: {}), Cost = {:.5f}".format(
+                epoch, step, evaluation['accuracy'], evaluation['step'], evaluation['samples'], cost
+            )
+        )
+        return evaluation['accuracy']
+
+    def init_captcha_gennerator(self):
+        """
+        初始化随机验证码生成器，RandomCaptcha 中 Workers 不为0时启动生成进程池
+        :return: CaptchaPool 或 RandomCaptcha
+        """
+        ran_captcha = random_captcha(self.model_conf)
+        workers = self.model_conf.da_random_captcha.get('Workers', 2)
+        if not workers:
+            return ran_captcha
+        return CaptchaPool(
+            ran_captcha,
+            model_conf=self.model_conf,
+            mode=RunMode.Trains,
+            workers=workers,
+            capacity=self.model_conf.da_random_captcha.get('QueueSize', self.model_conf.batch_size * 4),
+            encode=self.model_conf.da_random_captcha.get('Encode', True)
+        )
 
     def train_process(self):
         """
@@ -147,19 +170,11 @@ class Trains:
         """
         # 输出重要的配置参数
         self.model_conf.println()
-        # 定义网络结构
-        model = core.NeuralNetwork(
-            mode=RunMode.Trains,
-            model_conf=self.model_conf,
-            backbone=self.model_conf.neu_cnn,
-            recurrent=self.model_conf.neu_recurrent
-        )
-        model.build_graph()
 
-        ran_captcha = RandomCaptcha()
+        ran_captcha = None
 
         if self.model_conf.da_random_captcha['Enable']:
-            self.init_captcha_gennerator(ran_captcha=ran_captcha)
+            ran_captcha = self.init_captcha_gennerator()
 
         tf.compat.v1.logging.info('Loading Trains DataSet...')
         train_feeder = utils.data.DataIterator(
@@ -169,7 +184,7 @@ class Trains:
 
         tf.compat.v1.logging.info('Loading Validation DataSet...')
         validation_feeder = utils.data.DataIterator(
-            model_conf=self.model_conf, mode=RunMode.Validation, ran_captcha=ran_captcha
+            model_conf=self.model_conf, mode=RunMode.Validation
         )
         validation_feeder.read_sample_from_tfrecords(self.model_conf.validation_path[DatasetType.TFRecords])
 
@@ -191,6 +206,20 @@ class Trains:
 
         num_batches_per_epoch = int(num_train_samples / self.model_conf.batch_size)
 
+        # 计算图管道且未启用随机验证码时，训练输入直接绑定到数据管道迭代器，训练步无需 feed_dict
+        feed_free = train_feeder.pipeline == DataPipeline.Graph and not self.model_conf.da_random_captcha['Enable']
+        if feed_free:
+            tf.compat.v1.logging.info('Training graph is wired directly to the input pipeline.')
+
+        # 定义网络结构
+        model = core.NeuralNetwork(
+            mode=RunMode.Trains,
+            model_conf=self.model_conf,
+            backbone=self.model_conf.neu_cnn,
+            recurrent=self.model_conf.neu_recurrent,
+            input_tensors=train_feeder.next_element if feed_free else None
+        )
+        model.build_graph()
         model.build_train_op(num_train_samples)
 
         # 会话配置
@@ -225,6 +254,40 @@ class Trains:
         if checkpoint_state and checkpoint_state.model_checkpoint_path:
             # 加载被中断的训练任务
             saver.restore(sess, checkpoint_state.model_checkpoint_path)
+        elif os.path.exists(self.model_conf.evaluation_path):
+            # 重新开始训练时，上一次训练的评估结果已失效
+            os.remove(self.model_conf.evaluation_path)
+        checkpoint_saver = AsyncCheckpointSaver(sess, self.model_conf.save_model, max_to_keep=2)
+        summary_scheduler = SummaryScheduler(
+            train_writer,
+            global_step=sess.run(model.global_step),
+            scalar=model.merged_summary,
+            scalar_steps=self.model_conf.summary_steps if self.model_conf.summary_steps else save_step,
+            histogram=model.histogram_summary,
+            histogram_steps=self.model_conf.histogram_steps,
+            image=model.image_summary,
+            image_steps=self.model_conf.image_summary_steps
+        )
+
+        train_prefetcher, validation_prefetcher = None, None
+        if self.model_conf.prefetch_batches > 0:
+            # 训练输入已绑定数据管道时由 tf.data 自身预取，不再另起线程消费同一迭代器
+            if not feed_free:
+                train_prefetcher = BatchPrefetcher(
+                    train_feeder, sess, self.model_conf.prefetch_batches, name="TrainsPrefetcher"
+                )
+            if not self.model_conf.external_evaluator:
+                validation_prefetcher = BatchPrefetcher(validation_feeder, sess, 1, name="ValidationPrefetcher")
+
+        def close_workers():
+            for prefetcher in [train_prefetcher, validation_prefetcher]:
+                if prefetcher:
+                    prefetcher.close()
+            # 等待后台写入完成，确保编译模型时能读取到最新的存储
+            checkpoint_saver.close()
+            summary_scheduler.close()
+            if isinstance(ran_captcha, CaptchaPool):
+                ran_captcha.close()
 
         tf.compat.v1.logging.info('Start training...')
 
@@ -240,69 +303,103 @@ class Trains:
                     break
 
                 batch_time = time.time()
+                # 多数训练步无需计算摘要
+                summary_fetches = summary_scheduler.fetches()
+                fetches = [model.cost, model.global_step, model.train_op, model.seq_len] + summary_fetches
+
+                if feed_free:
+                    if self.model_conf.resize[0] == -1:
+                        fetches += [model.input_widths, model.padded_width]
+                    batch_cost, step, _, seq_len, *extra = sess.run(fetches)
+                    if self.model_conf.resize[0] == -1:
+                        train_feeder.padding.update(*extra[-2:])
+                else:
+                    if train_prefetcher:
+                        trains_batch, _ = train_prefetcher.get()
+                    else:
+                        trains_batch = train_feeder.generate_batch_by_tfrecords(sess)
+
+                    batch_inputs, batch_labels = trains_batch
+
+                    feed = {
+                        model.inputs: batch_inputs,
+                        model.labels: batch_labels,
+                        model.utils.is_training: True
+                    }
 
-                trains_batch = train_feeder.generate_batch_by_tfrecords(sess)
-
-                batch_inputs, batch_labels = trains_batch
-
-                feed = {
-                    model.inputs: batch_inputs,
-                    model.labels: batch_labels,
-                    model.utils.is_training: True
-                }
-
-                summary_str, batch_cost, step, _, seq_len = sess.run(
-                    [model.merged_summary, model.cost, model.global_step, model.train_op, model.seq_len],
-                    feed_dict=feed
-                )
-                train_writer.add_summary(summary_str, step)
+                    batch_cost, step, _, seq_len, *extra = sess.run(fetches, feed_dict=feed)
+                summary_scheduler.add(extra[:len(summary_fetches)], step)
 
                 if step % save_step == 0 and step != 0:
                     tf.compat.v1.logging.info(
-                        'Step: {} Time: {:.3f} sec/batch, Cost = {:.8f}, BatchSize: {}, Shape[1]: {}'.format(
+                        'Step: {} Time: {:.3f} sec/batch, Cost = {:.8f}, BatchSize: {}, Shape[1]: {}{}{}{}'.format(
                             step,
                             time.time() - batch_time,
                             batch_cost,
-                            len(batch_inputs),
-                            seq_len[0]
+                            len(seq_len),
+                            seq_len[0],
+                            ", {}".format(train_feeder.padding) if self.model_conf.resize[0] == -1 else "",
+                            ", {}".format(train_prefetcher) if train_prefetcher else "",
+                            ", {}".format(ran_captcha) if isinstance(ran_captcha, CaptchaPool) else ""
                         )
                     )
+                    if train_prefetcher:
+                        train_prefetcher.reset_stats()
+                    if isinstance(ran_captcha, CaptchaPool):
+                        summary_scheduler.add([tf.compat.v1.Summary(value=[
+                            tf.compat.v1.Summary.Value(tag='captcha_throughput', simple_value=ran_captcha.throughput)
+                        ])], step)
+                        ran_captcha.reset_stats()
+                    if self.model_conf.resize[0] == -1:
+                        summary_scheduler.add([tf.compat.v1.Summary(value=[
+                            tf.compat.v1.Summary.Value(tag='padding_waste', simple_value=train_feeder.padding.waste)
+                        ])], step)
+                        train_feeder.padding.reset()
 
                 # 达到保存步数对模型过程进行存储
                 if step % save_step == 0 and step != 0:
-                    saver.save(sess, self.model_conf.save_model, global_step=step)
+                    checkpoint_saver.save(global_step=step)
 
                 # 进入验证集验证环节
                 if step % trains_validation_steps == 0 and step != 0:
 
-                    batch_time = time.time()
-                    validation_batch = validation_feeder.generate_batch_by_tfrecords(sess)
-
-                    test_inputs, test_labels = validation_batch
-                    val_feed = {
-                        model.inputs: test_inputs,
-                        model.labels: test_labels,
-                        model.utils.is_training: False
-                    }
-                    dense_decoded, lr = sess.run(
-                        [model.dense_decoded, model.lrn_rate],
-                        feed_dict=val_feed
-                    )
-                    # 计算准确率
-                    accuracy = self.validation.accuracy_calculation(
-                        validation_feeder.labels,
-                        dense_decoded,
-                    )
-                    log = "Epoch: {}, Step: {}, Accuracy = {:.4f}, Cost = {:.5f}, " \
-                          "Time = {:.3f} sec/batch, LearningRate: {}"
-                    tf.compat.v1.logging.info(log.format(
-                        epoch_count,
-                        step,
-                        accuracy,
-                        batch_cost,
-                        time.time() - batch_time,
-                        lr / len(validation_batch),
-                    ))
+                    if self.model_conf.external_evaluator:
+                        accuracy = self.read_external_accuracy(accuracy, epoch_count, step, batch_cost)
+                    else:
+                        batch_time = time.time()
+                        if validation_prefetcher:
+                            validation_batch, validation_labels = validation_prefetcher.get()
+                        else:
+                            validation_batch = validation_feeder.generate_batch_by_tfrecords(sess)
+                            validation_labels = validation_feeder.labels
+
+                        test_inputs, test_labels = validation_batch
+                        val_feed = {
+                            model.inputs: test_inputs,
+                            model.labels: test_labels,
+                            model.utils.is_training: False
+                        }
+                        dense_decoded, lr = sess.run(
+                            [model.dense_decoded, model.lrn_rate],
+                            feed_dict=val_feed
+                        )
+                        # 计算准确率
+                        self.validation.reset()
+                        accuracy = self.validation.accuracy_calculation(
+                            validation_labels,
+                            dense_decoded,
+                        )
+                        log = "Epoch: {}, Step: {}, Accuracy = {:.4f}, CER = {:.4f}, Cost = {:.5f}, " \
+                              "Time = {:.3f} sec/batch, LearningRate: {}"
+                        tf.compat.v1.logging.info(log.format(
+                            epoch_count,
+                            step,
+                            accuracy,
+                            self.validation.cer,
+                            batch_cost,
+                            time.time() - batch_time,
+                            lr / len(validation_batch),
+                        ))
 
                     # 满足终止条件但尚未完成当前epoch时跳出epoch循环
                     if self.achieve_cond(acc=accuracy, cost=batch_cost, epoch=epoch_count):
@@ -310,8 +407,10 @@ class Trains:
 
             # 满足终止条件时，跳出任务循环
             if self.stop_flag:
+                close_workers()
                 break
             if self.achieve_cond(acc=accuracy, cost=batch_cost, epoch=epoch_count):
+                close_workers()
                 # sess.close()
                 tf.compat.v1.keras.backend.clear_session()
                 sess.close()
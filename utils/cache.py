@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import os
+import json
+import hashlib
+import numpy as np
+import tensorflow as tf
+from config import ModelConfig
+from constants import InputDType
+from exception import exception
+from utils.sparse import pack_padded
+from utils.tfrecord import read_records, parse_example
+
+
+def pretreatment_hash(model_conf: ModelConfig, paths):
+    """
+    预处理配置哈希，任一影响编码结果的配置或源文件变化都会产生新的缓存
+    :param model_conf: 工程配置
+    :param paths: 源TFRecords文件路径列表
+    :return:
+    """
+    source = {
+        'Pretreatment': [
+            model_conf.pre_binaryzation,
+            model_conf.pre_replace_transparent,
+            model_conf.pre_horizontal_stitching,
+            model_conf.pre_concat_frames,
+            model_conf.pre_blend_frames,
+            model_conf.pre_exec_map,
+        ],
+        'Resize': model_conf.resize,
+        'ImageChannel': model_conf.image_channel,
+        'InputDType': model_conf.input_dtype.value,
+        'Category': model_conf.category,
+        'LossFunction': model_conf.loss_func.value,
+        'MaxLabelNum': model_conf.max_label_num,
+        'AutoPadding': model_conf.auto_padding,
+        'LabelSplit': model_conf.label_split,
+        'Source': [[p, os.path.getsize(p), os.path.getmtime(p)] for p in paths],
+    }
+    return hashlib.md5(json.dumps(source, sort_keys=True, ensure_ascii=False).encode("utf8")).hexdigest()
+
+
+class TensorCache(object):
+    """
+    验证集张量缓存：预先保存完整预处理后的输入及编码后的标签，
+    读取时通过内存映射零拷贝切片，不再重复解码与预处理
+    """
+
+    def __init__(self, model_conf: ModelConfig, path):
+        """
+        :param model_conf: 工程配置
+        :param path: 验证集TFRecords文件路径
+        """
+        self.model_conf = model_conf
+        self.paths = path if isinstance(path, list) else [path]
+        self.cache_dir = os.path.join(self.model_conf.dataset_root_path, 'cache')
+        self.key = pretreatment_hash(self.model_conf, self.paths)
+        self.prefix = os.path.join(self.cache_dir, "Validation.{}".format(self.key))
+        self.meta_path = "{}.json".format(self.prefix)
+        self.inputs = None
+        self.labels = None
+        self.lengths = None
+        self.widths = None
+        self.count = 0
+        self.position = 0
+
+    def file_path(self, name):
+        return "{}.{}.npy".format(self.prefix, name)
+
+    def exists(self):
+        return os.path.exists(self.meta_path)
+
+    def build(self, encode_func):
+        """
+        生成缓存：编码结果先顺序写入临时文件，得到实际的最大宽度后再补齐写入缓存，
+        宽度以编码结果为准 (拼接、ExecuteMap 等预处理都可能改变宽度)
+        :param encode_func: 样本编码函数 (input, label) -> (input_array, label_array) / None
+        :return:
+        """
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        tf.compat.v1.logging.info('Building validation tensor cache {}...'.format(self.key))
+        axis = self.model_conf.input_width_axis
+        dtype = np.uint8 if self.model_conf.input_dtype == InputDType.UInt8 else np.float32
+        temp_path = self.file_path('inputs') + '.tmp'
+        label_batch, widths = [], []
+        with open(temp_path, 'wb') as f:
+            for p in self.paths:
+                for record in read_records(p):
+                    sample = encode_func(*parse_example(record))
+                    if not sample:
+                        continue
+                    input_array, label_array = sample
+                    f.write(np.ascontiguousarray(input_array, dtype=dtype).tobytes())
+                    widths.append(input_array.shape[axis])
+                    label_batch.append(label_array)
+
+        shape = [self.model_conf.resize[1], self.model_conf.image_channel]
+        shape.insert(axis, max(widths, default=0))
+        inputs = np.lib.format.open_memmap(
+            self.file_path('inputs'), mode='w+', dtype=dtype, shape=tuple([len(widths)] + shape)
+        )
+        if widths:
+            encoded = np.memmap(temp_path, dtype=dtype, mode='r')
+            offset = 0
+            for i, width in enumerate(widths):
+                sample_shape = list(shape)
+                sample_shape[axis] = width
+                size = int(np.prod(sample_shape))
+                input_array = encoded[offset: offset + size].reshape(sample_shape)
+                if axis:
+                    inputs[i, :, :width] = input_array
+                else:
+                    inputs[i, :width] = input_array
+                offset += size
+            del encoded
+        os.remove(temp_path)
+        inputs.flush()
+        del inputs
+
+        lengths = np.asarray([len(label) for label in label_batch], dtype=np.int32)
+        labels = np.full([len(label_batch), max(lengths, default=0)], -1, dtype=np.int32)
+        for i, label in enumerate(label_batch):
+            labels[i, :len(label)] = label
+        np.save(self.file_path('labels'), labels)
+        np.save(self.file_path('lengths'), lengths)
+        np.save(self.file_path('widths'), np.asarray(widths, dtype=np.int32))
+        with open(self.meta_path, "w", encoding="utf8") as f:
+            json.dump({'count': len(label_batch), 'key': self.key}, f)
+        tf.compat.v1.logging.info('Validation tensor cache saved: {} samples.'.format(len(label_batch)))
+
+    def load(self):
+        with open(self.meta_path, "r", encoding="utf8") as f:
+            self.count = json.load(f)['count']
+        self.inputs = np.load(self.file_path('inputs'), mmap_mode='r')
+        self.labels = np.load(self.file_path('labels'))
+        self.lengths = np.load(self.file_path('lengths'))
+        self.widths = np.load(self.file_path('widths'))
+        self.position = 0
+
+    def next_batch(self, batch):
+        """
+        顺序取出下一批次，不足一个批次时从头开始
+        :return: (input_batch 内存映射切片, (label_values, label_lengths))
+        """
+        if not self.count:
+            exception("The validation tensor cache is empty, please check the validation set.")
+        if self.position + batch > self.count:
+            self.position = 0
+        start, end = self.position, min(self.position + batch, self.count)
+        self.position = end
+        width = int(self.widths[start: end].max())
+        if self.model_conf.input_width_axis:
+            input_batch = self.inputs[start: end, :, :width]
+        else:
+            input_batch = self.inputs[start: end, :width]
+        label_batch = pack_padded(self.labels[start: end], self.lengths[start: end])
+        return input_batch, label_batch
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import os
+import time
+import queue
+import atexit
+import random
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+from constants import RunMode
+from config import ModelConfig
+from category import NUMBER, ALPHA_UPPER, ALPHA_LOWER, category_extract
+from exception import exception
+from middleware.random_captcha import RandomCaptcha
+
+
+def random_captcha(model_conf: ModelConfig, remove_font=True, **params) -> RandomCaptcha:
+    """
+    按工程配置 (DA_RandomCaptcha) 初始化随机验证码生成器
+    :param remove_font: 是否删除缺少样本字符的字体文件，为 False 时只从字体列表中排除
+    :param params: 覆盖配置中的同名参数 (FontPath, Charset, FontNum, FontSize, Width, Height, Background)
+    """
+    params = dict(model_conf.da_random_captcha, **params)
+    ran_captcha = RandomCaptcha()
+    path = params['FontPath']
+    if not path or not os.path.exists(path):
+        exception("Font path does not exist.", code=-6754)
+    # 字体顺序固定，相同随机种子的生成结果才可复现
+    items = sorted(os.listdir(path))
+    fonts = [os.path.join(path, item) for item in items]
+    charset = params.get('Charset')
+    ran_captcha.sample = category_extract(charset) if charset else NUMBER + ALPHA_UPPER + ALPHA_LOWER
+    ran_captcha.fonts_list = fonts
+    ran_captcha.check_font(remove=remove_font)
+    ran_captcha.rgb_r, ran_captcha.rgb_g, ran_captcha.rgb_b = params.get('Background', [[0, 255]] * 3)
+    ran_captcha.fonts_num = params.get('FontNum', [4, 8])
+    ran_captcha.font_size = params.get('FontSize', ran_captcha.font_size)
+    ran_captcha.width = params.get('Width', ran_captcha.width)
+    ran_captcha.height = params.get('Height', ran_captcha.height)
+    ran_captcha.glyph_atlas = params.get('GlyphAtlas', False)
+    return ran_captcha
+
+
+def generate(ran_captcha: RandomCaptcha, model_conf: ModelConfig, mode: RunMode, encode, sample_queue, counter):
+    """
+    生成进程：持续生成随机验证码并放入有界队列，队列已满时阻塞；
+    encode 为 True 时在本进程内完成 Encoder 编码，放入 (input_array, label_array)，否则放入 (图片数组, 标签bytes)
+    """
+    from utils.data import DataIterator
+    random.seed(os.getpid() ^ int(time.time() * 1000))
+    np.random.seed(random.randint(0, 2 ** 31 - 1))
+
+    feeder = DataIterator(model_conf=model_conf, mode=mode) if encode else None
+    try:
+        while True:
+            try:
+                image, labels, font_type = ran_captcha.create(mode="numpy")
+            except Exception as e:
+                tf.compat.v1.logging.warn("Random captcha generation failed: {}".format(e))
+                continue
+            label = ''.join(labels).encode()
+            if encode:
+                sample = feeder.encode_sample(image, label)
+                if not sample:
+                    continue
+            else:
+                sample = (image, label)
+            sample_queue.put(sample)
+            with counter.get_lock():
+                counter.value += 1
+    except KeyboardInterrupt:
+        pass
+
+
+class CaptchaPool(object):
+    """
+    随机验证码生成进程池：N个进程持续生成样本并维持一个有界的就绪队列，
+    训练循环只需按需取出样本，绘制与编码不再占用批次准备的时间
+    """
+
+    def __init__(self, ran_captcha: RandomCaptcha, model_conf: ModelConfig, mode: RunMode, workers, capacity,
+                 encode=True):
+        """
+        :param ran_captcha: 已完成配置的随机验证码生成器
+        :param model_conf: 工程配置
+        :param mode: 运行模式（区分：训练/验证）
+        :param workers: 生成进程数
+        :param capacity: 就绪队列容量
+        :param encode: 是否在生成进程中完成编码
+        """
+        if not ran_captcha.fonts_list:
+            exception("No available font for the random captcha.", code=-6754)
+        self.encode = encode
+        self.capacity = capacity
+        context = multiprocessing.get_context()
+        self.queue = context.Queue(maxsize=capacity)
+        self.counter = context.Value('q', 0)
+        self.processes = [
+            context.Process(
+                target=generate,
+                args=(ran_captcha, model_conf.freeze(), mode, encode, self.queue, self.counter),
+                daemon=True
+            ) for _ in range(workers)
+        ]
+        for process in self.processes:
+            process.start()
+        atexit.register(self.close)
+        self.wait_time = 0.
+        self.count = 0
+        self.stats_time = time.time()
+        self.stats_generated = 0
+        tf.compat.v1.logging.info("Started {} random captcha generator processes.".format(workers))
+
+    def get(self, num):
+        """
+        取出 num 个样本
+        :return: [(input_array, label_array)] 或 [(图片数组, 标签bytes)]
+        """
+        start_time = time.time()
+        samples = []
+        while len(samples) < num:
+            try:
+                samples.append(self.queue.get(timeout=1))
+            except queue.Empty:
+                if not any(process.is_alive() for process in self.processes):
+                    exception("All random captcha generator processes have exited.")
+        self.wait_time += time.time() - start_time
+        self.count += 1
+        return samples
+
+    @property
+    def generated(self):
+        return self.counter.value
+
+    @property
+    def throughput(self):
+        """上次重置统计以来的生成速度 (样本/秒)"""
+        return (self.generated - self.stats_generated) / max(time.time() - self.stats_time, 1e-6)
+
+    def reset_stats(self):
+        self.wait_time, self.count = 0., 0
+        self.stats_time, self.stats_generated = time.time(), self.generated
+
+    def __str__(self):
+        try:
+            depth = str(self.queue.qsize())
+        except NotImplementedError:
+            depth = "-"
+        return "Captcha: {:.1f} samples/sec, Queue: {}/{}, Wait: {:.1f} ms/batch".format(
+            self.throughput, depth, self.capacity, self.wait_time / self.count * 1000 if self.count else 0.
+        )
+
+    def close(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            process.join()
+        self.processes = []
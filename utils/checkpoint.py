@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import os
+import time
+import threading
+import tensorflow as tf
+
+
+class AsyncCheckpointSaver(object):
+    """
+    异步模型存储：训练线程仅将变量快照复制到CPU影子变量，
+    由后台线程写入临时文件后原子重命名，只有上一次存储尚未完成时才阻塞训练
+    """
+
+    def __init__(self, session, save_path, var_list=None, max_to_keep=2):
+        """
+        :param session: 当前 TensorFlow 会话
+        :param save_path: 模型存储路径前缀
+        :param var_list: 需存储的变量，默认为全部全局变量
+        :param max_to_keep: 最多保留的模型数
+        """
+        self.session = session
+        # 与 get_checkpoint_state 返回的绝对路径一致，保证去重及清理时路径可比较
+        self.save_path = os.path.abspath(save_path)
+        self.save_dir = os.path.dirname(self.save_path)
+        self.max_to_keep = max_to_keep
+        var_list = var_list if var_list is not None else tf.compat.v1.global_variables()
+        shadows = {}
+        with tf.compat.v1.name_scope('checkpoint_shadow'), tf.device('/cpu:0'):
+            for var in var_list:
+                shadows[var.op.name] = tf.compat.v1.Variable(
+                    tf.zeros(var.shape, dtype=var.dtype.base_dtype),
+                    trainable=False,
+                    collections=[tf.compat.v1.GraphKeys.LOCAL_VARIABLES],
+                    name=var.op.name.replace('/', '_')
+                )
+            self.snapshot_op = tf.group(*[shadows[var.op.name].assign(var) for var in var_list])
+        # 影子变量以原变量名存储，与同步 Saver 存储的模型互相兼容
+        self.saver = tf.compat.v1.train.Saver(var_list=shadows, max_to_keep=0)
+        self.session.run(tf.compat.v1.variables_initializer(list(shadows.values())))
+
+        checkpoint_state = tf.train.get_checkpoint_state(self.save_dir)
+        self.checkpoints = [
+            os.path.abspath(path) for path in checkpoint_state.all_model_checkpoint_paths
+        ] if checkpoint_state else []
+        self.thread = None
+        self.error = None
+        self.snapshot_time = 0.
+        self.wait_time = 0.
+        self.write_time = 0.
+
+    def save(self, global_step):
+        """
+        存储当前变量：等待上一次写入完成，快照变量后交由后台线程写入
+        :param global_step: 当前步数，作为模型名的后缀
+        """
+        start_time = time.time()
+        self.wait()
+        self.wait_time = time.time() - start_time
+        start_time = time.time()
+        self.session.run(self.snapshot_op)
+        self.snapshot_time = time.time() - start_time
+        checkpoint_path = "{}-{}".format(self.save_path, global_step)
+        self.thread = threading.Thread(
+            target=self.write, args=(checkpoint_path,), name="CheckpointWriter", daemon=True
+        )
+        self.thread.start()
+
+    def write(self, checkpoint_path):
+        start_time = time.time()
+        tmp_path = checkpoint_path + ".tmp"
+        try:
+            self.saver.save(self.session, tmp_path, write_meta_graph=False, write_state=False)
+            # 数据文件先于索引文件重命名，索引文件存在即表示模型完整
+            tmp_files = sorted(tf.io.gfile.glob(tmp_path + ".*"), key=lambda p: p.endswith(".index"))
+            for tmp_file in tmp_files:
+                tf.io.gfile.rename(tmp_file, checkpoint_path + tmp_file[len(tmp_path):], overwrite=True)
+            if checkpoint_path in self.checkpoints:
+                self.checkpoints.remove(checkpoint_path)
+            self.checkpoints.append(checkpoint_path)
+            while len(self.checkpoints) > self.max_to_keep:
+                for stale_file in tf.io.gfile.glob(self.checkpoints.pop(0) + ".*"):
+                    tf.io.gfile.remove(stale_file)
+            # 以相对于模型目录的文件名记录，传入副本以免列表被原地改写
+            tf.compat.v1.train.update_checkpoint_state(
+                self.save_dir,
+                os.path.basename(checkpoint_path),
+                all_model_checkpoint_paths=[os.path.basename(path) for path in self.checkpoints]
+            )
+        except Exception as e:
+            self.error = e
+            return
+        self.write_time = time.time() - start_time
+        tf.compat.v1.logging.info(str(self))
+
+    def wait(self):
+        """等待进行中的写入完成，写入失败时抛出异常"""
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        if self.error:
+            error, self.error = self.error, None
+            raise error
+
+    @property
+    def latest_checkpoint(self):
+        return self.checkpoints[-1] if self.checkpoints else None
+
+    def __str__(self):
+        return "Checkpoint: {}, Snapshot: {:.1f} ms, Wait: {:.1f} ms, Write: {:.1f} ms".format(
+            os.path.basename(self.latest_checkpoint) if self.latest_checkpoint else "-",
+            self.snapshot_time * 1000, self.wait_time * 1000, self.write_time * 1000
+        )
+
+    def close(self):
+        self.wait()
@@ -8,12 +8,78 @@ import random
 import utils.sparse
 import tensorflow as tf
 import numpy as np
-from constants import RunMode, ModelField, DatasetType, LossFunction
+from constants import RunMode, ModelField, DatasetType, LossFunction, DataPipeline, InputDType, DatasetFormat
 from config import ModelConfig, EXCEPT_FORMAT_MAP
 from encoder import Encoder
+from utils.producer import BatchProducer
+from utils.captcha_pool import CaptchaPool
+from utils.cache import TensorCache
+from utils.tfrecord import expand_shards, record_count, RandomAccessReader, TENSOR_MAGIC, TENSOR_HEADER_SIZE
 from exception import exception
 
 
+def pad_batch(arrays, axis=0, dtype=None):
+    """
+    以最大宽度在尾部补0拼接批次
+    :param arrays: 单个样本的数组列表
+    :param axis: 样本中宽度所在的维度
+    :param dtype: 批次数据类型，默认与样本一致
+    :return:
+    """
+    if not len(arrays):
+        return np.asarray(arrays, dtype=dtype)
+    shape = list(arrays[0].shape)
+    shape[axis] = max(array.shape[axis] for array in arrays)
+    batch = np.zeros([len(arrays)] + shape, dtype=dtype if dtype else arrays[0].dtype)
+    for i, array in enumerate(arrays):
+        index = [i] + [slice(None)] * len(shape)
+        index[axis + 1] = slice(0, array.shape[axis])
+        batch[tuple(index)] = array
+    return batch
+
+
+class PaddingMetrics(object):
+    """不定宽输入的补齐统计：补齐浪费比例及批次内宽度分布"""
+
+    def __init__(self):
+        self.real = 0
+        self.padded = 0
+        self.batch_widths = []
+
+    def update(self, widths, padded_width):
+        """
+        :param widths: 批次内各样本补齐前的宽度
+        :param padded_width: 补齐后的宽度
+        """
+        widths = np.asarray(widths)
+        if not len(widths):
+            return
+        self.real += int(widths.sum())
+        self.padded += int(padded_width) * len(widths)
+        self.batch_widths = widths
+
+    @property
+    def waste(self):
+        """累计补齐浪费比例"""
+        return 1 - self.real / self.padded if self.padded else 0.
+
+    @property
+    def batch_waste(self):
+        if not len(self.batch_widths):
+            return 0.
+        return 1 - self.batch_widths.mean() / self.batch_widths.max()
+
+    def reset(self):
+        self.real, self.padded = 0, 0
+
+    def __str__(self):
+        if not len(self.batch_widths):
+            return "PaddingWaste: -"
+        return "PaddingWaste: {:.2%} (Total {:.2%}), Width: [{}, {}]".format(
+            self.batch_waste, self.waste, self.batch_widths.min(), self.batch_widths.max()
+        )
+
+
 class DataIterator:
     """数据集迭代类"""
 
@@ -21,6 +87,7 @@ class DataIterator:
         """
         :param model_conf: 工程配置
         :param mode: 运行模式（区分：训练/验证）
+        :param ran_captcha: 随机验证码来源 (CaptchaPool 或 RandomCaptcha)，为空时不混入随机验证码
         """
         self.model_conf = model_conf
         self.mode = mode
@@ -40,6 +107,19 @@ class DataIterator:
         self._size = 0
         self.encoder = Encoder(self.model_conf, self.mode)
         self.ran_captcha = ran_captcha
+        self.pipeline = self.model_conf.data_pipeline
+        if self.pipeline == DataPipeline.Graph and self.model_conf.model_field != ModelField.Image:
+            tf.compat.v1.logging.warn("The graph data pipeline only supports image field, fallback to feed.")
+            self.pipeline = DataPipeline.Feed
+        if self.pipeline == DataPipeline.Process and self.model_conf.resize[0] == -1:
+            tf.compat.v1.logging.warn("The process data pipeline only supports fixed width input, fallback to feed.")
+            self.pipeline = DataPipeline.Feed
+        self.producer = None
+        self.cache = None
+        self.buckets = None
+        self.padding = PaddingMetrics()
+        if self.model_conf.resize[0] == -1 and self.model_conf.model_field == ModelField.Image:
+            self.buckets = sorted(self.model_conf.width_buckets) if self.model_conf.width_buckets else None
 
     @staticmethod
     def parse_example(serial_example):
@@ -56,19 +136,45 @@ class DataIterator:
 
         return _input, _label
 
+    def parse_bucket_example(self, serial_example):
+        """解析样本及打包时记录的原图尺寸，返回 (input, label, 缩放后的宽度)，未记录尺寸的样本宽度为0"""
+        features = tf.io.parse_single_example(
+            serial_example,
+            features={
+                'label': tf.io.FixedLenFeature([], tf.string),
+                'input': tf.io.FixedLenFeature([], tf.string),
+                'width': tf.io.FixedLenFeature([], tf.int64, default_value=0),
+                'height': tf.io.FixedLenFeature([], tf.int64, default_value=0),
+            }
+        )
+        height = tf.cast(tf.maximum(features['height'], 1), tf.float32)
+        width = tf.cast(self.model_conf.resize[1] / height * tf.cast(features['width'], tf.float32), tf.int32)
+        return features['input'], features['label'], width
+
+    def bucket_batch(self, dataset, batch, element_length_func, padded_shapes=None, padding_values=None):
+        """按宽度分桶组批，每个批次只取自一个桶"""
+        return dataset.apply(tf.data.experimental.bucket_by_sequence_length(
+            element_length_func=element_length_func,
+            bucket_boundaries=self.buckets,
+            bucket_batch_sizes=[batch] * (len(self.buckets) + 1),
+            padded_shapes=padded_shapes,
+            padding_values=padding_values,
+            no_padding=padded_shapes is None,
+            drop_remainder=True
+        ))
+
     @staticmethod
     def total_sample(file_name):
-        sample_nums = 0
-        for _ in tf.compat.v1.python_io.tf_record_iterator(file_name):
-            sample_nums += 1
-        return sample_nums
+        """样本数量，优先读取打包时生成的索引文件"""
+        return record_count(file_name)
 
     def read_sample_from_tfrecords(self, path):
         """
         从TFRecords中读取样本
-        :param path: TFRecords文件路径
+        :param path: TFRecords文件路径，分片数据集展开为各分片文件并行读取
         :return:
         """
+        path = expand_shards(path)
         if isinstance(path, list):
             for p in path:
                 self._size += self.total_sample(p)
@@ -77,20 +183,214 @@ class DataIterator:
 
         min_after_dequeue = 1000
         batch = self.batch_map[self.mode]
-        if self.model_conf.da_random_captcha['Enable']:
-            batch = random.randint(int(batch / 3 * 2), batch)
-
-        dataset_train = tf.data.TFRecordDataset(
-            filenames=path,
-            num_parallel_reads=20
-        ).map(self.parse_example)
-        dataset_train = dataset_train.shuffle(
-            min_after_dequeue,
-            reshuffle_each_iteration=True
-        ).batch(batch, drop_remainder=True).repeat()
+        if self.ran_captcha:
+            # 批次中随机验证码的占比，未配置 Ratio 时为 0 ~ 1/3 的随机值
+            ratio = self.model_conf.da_random_captcha.get('Ratio')
+            batch = batch - int(round(batch * ratio)) if ratio is not None else random.randint(int(batch / 3 * 2), batch)
+
+        if self.mode == RunMode.Validation and self.model_conf.validation_cache:
+            self.cache = self.tensor_cache(path)
+            return
+
+        if self.pipeline == DataPipeline.Process:
+            self.producer = BatchProducer(
+                model_conf=self.model_conf,
+                mode=self.mode,
+                path=path,
+                batch=batch,
+                workers=max(min(self.model_conf.data_workers if self.mode == RunMode.Trains else 1, self._size), 1),
+                input_shape=self.input_shape,
+                input_dtype=self.input_dtype
+            )
+            return
+
+        feed_buckets = self.buckets and self.pipeline == DataPipeline.Feed
+        parse_func = self.parse_bucket_example if feed_buckets else self.parse_example
+        if self.mode == RunMode.Trains and self.model_conf.global_shuffle:
+            reader = RandomAccessReader(path)
+            dataset_train = tf.data.Dataset.from_generator(
+                reader.epoch,
+                output_types=tf.string,
+                output_shapes=[]
+            ).map(parse_func)
+        else:
+            dataset_train = tf.data.TFRecordDataset(
+                filenames=path,
+                num_parallel_reads=20
+            ).map(parse_func)
+            dataset_train = dataset_train.shuffle(
+                min_after_dequeue,
+                reshuffle_each_iteration=True
+            )
+        if self.pipeline == DataPipeline.Graph:
+            dataset_train = self.graph_pipeline(dataset_train, batch)
+        elif feed_buckets:
+            dataset_train = self.bucket_batch(
+                dataset_train.repeat(), batch, element_length_func=lambda _input, _label, width: width
+            ).map(lambda _input, _label, width: (_input, _label))
+        else:
+            dataset_train = dataset_train.batch(batch, drop_remainder=True).repeat()
         iterator = tf.compat.v1.data.make_one_shot_iterator(dataset_train)
         self.next_element = iterator.get_next()
 
+    def tensor_cache(self, path):
+        """加载验证集张量缓存，缓存不存在或已过期时重新生成"""
+        cache = TensorCache(self.model_conf, expand_shards(path))
+        if not cache.exists():
+            cache.build(self.encode_sample)
+        cache.load()
+        return cache
+
+    @property
+    def input_shape(self):
+        """编码后单个样本的输入形状 [宽, 高, 通道] (uint8 输入为 [高, 宽, 通道])，不定宽时宽为None"""
+        width = None if self.model_conf.resize[0] == -1 else self.model_conf.resize[0]
+        if self.model_conf.input_dtype == InputDType.UInt8:
+            return [self.model_conf.resize[1], width, self.model_conf.image_channel]
+        return [width, self.model_conf.resize[1], self.model_conf.image_channel]
+
+    @property
+    def input_dtype(self):
+        return np.uint8 if self.model_conf.input_dtype == InputDType.UInt8 else np.float32
+
+    @property
+    def native_decode(self):
+        """当前配置是否仅包含计算图可表达的确定性操作，否则使用 numpy_function 回退到 Encoder.image"""
+        if self.model_conf.dataset_format != DatasetFormat.Tensor:
+            # 张量格式的预处理已在打包时完成
+            if self.model_conf.pre_exec_map or self.model_conf.pre_horizontal_stitching:
+                return False
+            if self.model_conf.pre_concat_frames != -1 or self.model_conf.pre_blend_frames != -1:
+                return False
+            if self.model_conf.pre_binaryzation not in (-1, None):
+                return False
+        if self.mode != RunMode.Trains:
+            return True
+        augmentation = [
+            self.model_conf.da_binaryzation != -1,
+            self.model_conf.da_median_blur != -1,
+            self.model_conf.da_gaussian_blur != -1,
+            self.model_conf.da_equalize_hist,
+            self.model_conf.da_laplace,
+            self.model_conf.da_warp_perspective,
+            self.model_conf.da_rotate != -1,
+            self.model_conf.da_sp_noise != -1,
+            self.model_conf.da_brightness,
+            self.model_conf.da_saturation,
+            self.model_conf.da_hue,
+            self.model_conf.da_gamma,
+            self.model_conf.da_channel_swap,
+            self.model_conf.da_random_blank != -1,
+            self.model_conf.da_random_transition != -1,
+        ]
+        return not any(augmentation)
+
+    def decode_image(self, _input):
+        """
+        在计算图中完成解码/压缩增广/灰度化/缩放/归一化，与 Encoder.image 的确定性部分一致
+        :return: (image, valid)，与 Encoder.open_image 一致，单通道图片用于三通道模型时 valid 为 False
+        """
+        image = tf.io.decode_image(_input, channels=0, expand_animations=False)
+        channels = tf.shape(image)[2]
+        valid = tf.logical_not(tf.logical_and(tf.equal(channels, 1), self.model_conf.image_channel == 3))
+        # 与 PIL convert('RGB') 一致：灰度 (含透明通道) 复制为三通道，RGBA 丢弃透明通道
+        image = tf.cond(
+            channels < 3,
+            lambda: tf.image.grayscale_to_rgb(image[:, :, :1]),
+            lambda: image[:, :, :3]
+        )
+        if self.mode == RunMode.Trains:
+            image = tf.image.random_jpeg_quality(image, 75, 100)
+        if self.model_conf.image_channel == 1:
+            image = tf.image.rgb_to_grayscale(image)
+        if self.model_conf.resize[0] == -1:
+            shape = tf.cast(tf.shape(image), tf.float32)
+            ratio = self.model_conf.resize[1] / shape[0]
+            size = [self.model_conf.resize[1], tf.cast(ratio * shape[1], tf.int32)]
+        else:
+            size = [self.model_conf.resize[1], self.model_conf.resize[0]]
+        image = tf.image.resize(tf.cast(image, tf.float32), size)
+        if self.model_conf.input_dtype == InputDType.UInt8:
+            return tf.cast(tf.clip_by_value(tf.round(image), 0, 255), tf.uint8), valid
+        return tf.transpose(image / 255., perm=[1, 0, 2]), valid
+
+    def decode_tensor(self, _input):
+        """解析张量格式的 input：读取形状头并将其后的 uint8 数据还原为 [高, 宽, 通道]"""
+        header = tf.strings.substr(_input, len(TENSOR_MAGIC), TENSOR_HEADER_SIZE - len(TENSOR_MAGIC))
+        shape = tf.io.decode_raw(header, tf.int32, little_endian=True)
+        data = tf.io.decode_raw(tf.strings.substr(_input, TENSOR_HEADER_SIZE, -1), tf.uint8)
+        image = tf.reshape(data, shape)
+        if self.model_conf.input_dtype == InputDType.UInt8:
+            return image
+        return tf.transpose(tf.cast(image, tf.float32) / 255., perm=[1, 0, 2])
+
+    def encode_label(self, _label):
+        """标签编码 (numpy_function)，无效标签长度为0"""
+        label_array = self.encoder.text(_label)
+        if not self.valid_label(_label, label_array):
+            return np.zeros([0], dtype=np.int32), np.int32(0)
+        return np.asarray(label_array, dtype=np.int32), np.int32(len(label_array))
+
+    def encode_input(self, _input, _label):
+        """样本编码 (numpy_function)，无效样本长度为0"""
+        sample = self.encode_sample(_input, _label)
+        if not sample:
+            blank = np.zeros([1 if i is None else i for i in self.input_shape], dtype=self.input_dtype)
+            return blank, np.zeros([0], dtype=np.int32), np.int32(0)
+        input_array, label_array = sample
+        return (
+            input_array.astype(self.input_dtype),
+            np.asarray(label_array, dtype=np.int32),
+            np.int32(len(label_array))
+        )
+
+    def graph_map(self, _input, _label):
+        if self.native_decode:
+            if self.model_conf.dataset_format == DatasetFormat.Tensor:
+                image, valid = self.decode_tensor(_input), True
+            else:
+                image, valid = self.decode_image(_input)
+            label, length = tf.numpy_function(self.encode_label, [_label], [tf.int32, tf.int32])
+            # 无效样本与 encode_input 一致以长度0标记，在批次前被过滤
+            length = tf.where(valid, length, 0)
+        else:
+            image, label, length = tf.numpy_function(
+                self.encode_input, [_input, _label], [tf.as_dtype(self.input_dtype), tf.int32, tf.int32]
+            )
+        image.set_shape(self.input_shape)
+        label.set_shape([None])
+        length.set_shape([])
+        return image, label, length, tf.shape(image)[self.model_conf.input_width_axis]
+
+    def graph_pipeline(self, dataset, batch):
+        """
+        并行计算图数据管道：解码、预处理与增广在 tf.data map 中并行执行，并在训练步前预取批次
+        :param dataset: 解析后的 (input, label) 数据集
+        :param batch: 批次大小
+        :return: (input, label_padded, label_length, width) 批次
+        """
+        dataset = dataset.repeat().map(
+            self.graph_map,
+            num_parallel_calls=tf.data.experimental.AUTOTUNE
+        ).filter(lambda image, label, length, width: length > 0)
+        padded_shapes = (self.input_shape, [None], [], [])
+        padding_values = (tf.constant(0, dtype=tf.as_dtype(self.input_dtype)), -1, 0, 0)
+        if self.buckets:
+            dataset = self.bucket_batch(
+                dataset, batch,
+                element_length_func=lambda image, label, length, width: width,
+                padded_shapes=padded_shapes,
+                padding_values=padding_values
+            )
+        else:
+            dataset = dataset.padded_batch(
+                batch,
+                padded_shapes=padded_shapes,
+                padding_values=padding_values,
+                drop_remainder=True
+            )
+        return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
     @property
     def size(self):
         """样本数"""
@@ -98,105 +398,167 @@ class DataIterator:
 
     @property
     def labels(self):
-        """标签"""
+        """标签，拼接形式 (values, lengths) 的标签在首次访问时才拆分为列表"""
+        if isinstance(self.label_list, tuple):
+            values, lengths = self.label_list
+            self.label_list = [label.tolist() for label in np.split(values, np.cumsum(lengths)[:-1])]
         return self.label_list
 
     @staticmethod
     def to_sparse(input_batch, label_batch):
-        """密集输入转稀疏"""
+        """密集输入转稀疏，label_batch 可以是标签列表或拼接形式 (values, lengths)"""
         batch_inputs = input_batch
-        batch_labels = utils.sparse.sparse_tuple_from_sequences(label_batch)
+        if isinstance(label_batch, tuple):
+            batch_labels = utils.sparse.sparse_tuple_from_packed(*label_batch)
+        else:
+            batch_labels = utils.sparse.sparse_tuple_from_sequences(label_batch)
         return batch_inputs, batch_labels
 
-    def generate_captcha(self, num) -> (list, list):
-        _images = []
-        _labels = []
-        for i in range(num):
-            try:
-                image, labels, font_type = self.ran_captcha.create()
-                _images.append(image)
-                _labels.append(''.join(labels).encode())
-            except Exception as e:
-                print(e)
-                pass
-        return _images, _labels
+    def generate_captcha(self, num) -> list:
+        """
+        生成随机验证码样本
+        :param num: 样本数
+        :return: 编码后的样本 [(input_array, label_array)]，无效样本已被过滤
+        """
+        if num <= 0:
+            return []
+        if isinstance(self.ran_captcha, CaptchaPool):
+            samples = self.ran_captcha.get(num)
+            if self.ran_captcha.encode:
+                return samples
+        else:
+            samples = []
+            for i in range(num):
+                try:
+                    image, labels, font_type = self.ran_captcha.create(mode="numpy")
+                    samples.append((image, ''.join(labels).encode()))
+                except Exception as e:
+                    print(e)
+                    pass
+        samples = [self.encode_sample(i1, i2) for i1, i2 in samples]
+        return [sample for sample in samples if sample]
+
+    def valid_label(self, content, label_array):
+        """标签合法性检查，与当前损失函数的标签约束一致"""
+        if isinstance(label_array, dict):
+            # tf.logging.warn("The sample label {} contains invalid charset: {}.".format(
+            #     label_array['label'], label_array['char']
+            # ))
+            return False
+
+        label_len_correct = len(label_array) != self.model_conf.max_label_num
+        using_cross_entropy = self.model_conf.loss_func == LossFunction.CrossEntropy
+        if label_len_correct and using_cross_entropy and not self.model_conf.auto_padding:
+            tf.compat.v1.logging.warn("The number of labels must be fixed when using cross entropy, label: {}, "
+                                      "the number of tags is incorrect, ignored.".format(content))
+            return False
+
+        if len(label_array) > self.model_conf.max_label_num and using_cross_entropy:
+            tf.compat.v1.logging.warn(
+                "The number of label[{}] exceeds the maximum number of labels, ignored.{}".format(content,
+                                                                                                  label_array))
+            return False
+        return True
+
+    def encode_sample(self, i1, i2):
+        """
+        编码单个样本
+        :param i1: 输入(图片bytes/文本)
+        :param i2: 标签
+        :return: (input_array, label_array)，样本无效时返回 None
+        """
+        try:
+            label_array = self.encoder.text(i2)
+            if self.model_conf.model_field == ModelField.Image:
+                input_array = self.encoder.image(i1)
+            else:
+                input_array = self.encoder.text(i1)
+
+            if input_array is None:
+                tf.compat.v1.logging.warn(
+                    "{}, Cannot identify image file labeled: {}, ignored.".format(input_array, label_array))
+                return None
+
+            if isinstance(input_array, str):
+                tf.compat.v1.logging.warn("{}, \nInput errors labeled: {} [{}], ignored.".format(input_array, i1, label_array))
+                return None
+
+            if not self.valid_label(i2, label_array):
+                return None
+
+            if input_array.shape[-1] != self.model_conf.image_channel:
+                # pass
+                tf.compat.v1.logging.warn("{}, \nInput shape: {}, ignored.".format(
+                    self.model_conf.image_channel, input_array.shape[-1])
+                )
+                return None
+
+            return input_array, label_array
+        except OSError:
+            random_suffix = hashlib.md5(i1).hexdigest()
+            file_format = EXCEPT_FORMAT_MAP[self.model_conf.model_field]
+            with open(file="oserror_{}.{}".format(random_suffix, file_format), mode="wb") as f:
+                f.write(i1)
+            tf.compat.v1.logging.warn("OSError [{}]".format(i2))
+            return None
+
+    def pad_inputs(self, input_batch):
+        """如果图片尺寸不固定则padding当前批次，使用最大的宽度作为序列最大长度"""
+        if self.model_conf.model_field == ModelField.Image and self.model_conf.resize[0] == -1:
+            input_batch = pad_batch(input_batch, axis=self.model_conf.input_width_axis, dtype=self.input_dtype)
+        return input_batch
+
+    def generate_batch_by_graph(self, session):
+        """计算图/多进程管道已完成编码，仅需取出批次并按需补充随机验证码"""
+        if self.cache:
+            input_batch, label_batch = self.cache.next_batch(self.batch_map[self.mode])
+        elif self.pipeline == DataPipeline.Process:
+            input_batch, label_batch = self.producer.get()
+        else:
+            input_batch, label_padded, label_length, widths = session.run(self.next_element)
+            label_batch = utils.sparse.pack_padded(label_padded, label_length)
+            if self.model_conf.resize[0] == -1:
+                self.padding.update(widths, input_batch.shape[self.model_conf.input_width_axis + 1])
+
+        if self.ran_captcha:
+            extra_samples = self.generate_captcha(self.batch_map[self.mode] - len(label_batch[1]))
+            if extra_samples:
+                input_batch = self.pad_inputs(list(input_batch) + [sample[0] for sample in extra_samples])
+                extra_values, extra_lengths = utils.sparse.pack_sequences([sample[1] for sample in extra_samples])
+                label_batch = (
+                    np.concatenate((label_batch[0], np.asarray(extra_values, dtype=label_batch[0].dtype))),
+                    np.concatenate((label_batch[1], extra_lengths))
+                )
+
+        self.label_list = label_batch
+        return self.to_sparse(input_batch, self.label_list)
 
     def generate_batch_by_tfrecords(self, session):
         """根据TFRecords生成当前批次，输入为当前TensorFlow会话，输出为稀疏型X和Y"""
         # print(session.graph)
+        if self.cache or self.pipeline in [DataPipeline.Graph, DataPipeline.Process]:
+            return self.generate_batch_by_graph(session)
+
         batch = self.batch_map[self.mode]
 
         _input, _label = session.run(self.next_element)
-        if self.model_conf.da_random_captcha['Enable']:
-            remain_batch = batch - len(_label)
-            extra_input, extra_label = self.generate_captcha(remain_batch)
-            _input = np.concatenate((_input, extra_input), axis=0)
-            _label = np.concatenate((_label, extra_label), axis=0)
+        samples = [self.encode_sample(i1, i2) for i1, i2 in zip(_input, _label)]
+        if self.ran_captcha:
+            samples += self.generate_captcha(batch - len(_label))
 
         input_batch = []
         label_batch = []
-        for index, (i1, i2) in enumerate(zip(_input, _label)):
-            try:
-                label_array = self.encoder.text(i2)
-                if self.model_conf.model_field == ModelField.Image:
-                    input_array = self.encoder.image(i1)
-                else:
-                    input_array = self.encoder.text(i1)
-
-                if input_array is None:
-                    tf.compat.v1.logging.warn(
-                        "{}, Cannot identify image file labeled: {}, ignored.".format(input_array, label_array))
-                    continue
-
-                if isinstance(input_array, str):
-                    tf.compat.v1.logging.warn("{}, \nInput errors labeled: {} [{}], ignored.".format(input_array, i1, label_array))
-                    continue
-                if isinstance(label_array, dict):
-                    # tf.logging.warn("The sample label {} contains invalid charset: {}.".format(
-                    #     label_array['label'], label_array['char']
-                    # ))
-                    continue
-
-                if input_array.shape[-1] != self.model_conf.image_channel:
-                    # pass
-                    tf.compat.v1.logging.warn("{}, \nInput shape: {}, ignored.".format(
-                        self.model_conf.image_channel, input_array.shape[-1])
-                    )
-                    continue
-
-                label_len_correct = len(label_array) != self.model_conf.max_label_num
-                using_cross_entropy = self.model_conf.loss_func == LossFunction.CrossEntropy
-                if label_len_correct and using_cross_entropy and not self.model_conf.auto_padding:
-                    tf.compat.v1.logging.warn("The number of labels must be fixed when using cross entropy, label: {}, "
-                                    "the number of tags is incorrect, ignored.".format(i2))
-                    continue
-
-                if len(label_array) > self.model_conf.max_label_num and using_cross_entropy:
-                    tf.compat.v1.logging.warn(
-                        "The number of label[{}] exceeds the maximum number of labels, ignored.{}".format(i2,
-                                                                                                          label_array))
-                    continue
-
-                input_batch.append(input_array)
-                label_batch.append(label_array)
-            except OSError:
-                random_suffix = hashlib.md5(i1).hexdigest()
-                file_format = EXCEPT_FORMAT_MAP[self.model_conf.model_field]
-                with open(file="oserror_{}.{}".format(random_suffix, file_format), mode="wb") as f:
-                    f.write(i1)
-                tf.compat.v1.logging.warn("OSError [{}]".format(i2))
+        for sample in samples:
+            if not sample:
                 continue
+            input_array, label_array = sample
+            input_batch.append(input_array)
+            label_batch.append(label_array)
 
-        # 如果图片尺寸不固定则padding当前批次，使用最大的宽度作为序列最大长度
-        if self.model_conf.model_field == ModelField.Image and self.model_conf.resize[0] == -1:
-            input_batch = tf.keras.preprocessing.sequence.pad_sequences(
-                sequences=input_batch,
-                maxlen=None,
-                dtype='float32',
-                padding='post',
-                truncating='post',
-                value=0
-            )
+        if self.model_conf.resize[0] == -1 and input_batch:
+            widths = [input_array.shape[self.model_conf.input_width_axis] for input_array in input_batch]
+            self.padding.update(widths, max(widths))
+        input_batch = self.pad_inputs(input_batch)
 
         self.label_list = label_batch
         return self.to_sparse(input_batch, self.label_list)
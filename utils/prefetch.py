@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import time
+import queue
+import threading
+import tensorflow as tf
+
+
+class BatchPrefetcher(object):
+    """
+    批次预取：后台线程提前生成K个批次 (含稀疏标签及对应的标签列表)，
+    使批次准备与当前训练步的计算重叠
+    """
+
+    def __init__(self, feeder, session, depth, name="Prefetcher"):
+        """
+        :param feeder: DataIterator 数据集迭代器，只在后台线程中调用
+        :param session: 当前 TensorFlow 会话
+        :param depth: 预取批次数
+        :param name: 线程名
+        """
+        self.feeder = feeder
+        self.session = session
+        self.queue = queue.Queue(maxsize=depth)
+        self.stop_event = threading.Event()
+        self.wait_time = 0.
+        self.depth_sum = 0
+        self.count = 0
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                batch = self.feeder.generate_batch_by_tfrecords(self.session)
+                item = (batch, self.feeder.labels)
+            except Exception as e:
+                item = e
+            while not self.stop_event.is_set():
+                try:
+                    self.queue.put(item, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+            if isinstance(item, Exception):
+                break
+
+    def get(self):
+        """
+        取出下一个批次
+        :return: ((inputs, sparse_labels), labels)
+        """
+        self.depth_sum += self.queue.qsize()
+        start_time = time.time()
+        item = self.queue.get()
+        self.wait_time += time.time() - start_time
+        self.count += 1
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def reset_stats(self):
+        self.wait_time, self.depth_sum, self.count = 0., 0, 0
+
+    def __str__(self):
+        if not self.count:
+            return "Prefetch: -"
+        return "Prefetch Depth: {:.1f}/{}, Wait: {:.1f} ms/batch".format(
+            self.depth_sum / self.count, self.queue.maxsize, self.wait_time / self.count * 1000
+        )
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join(timeout=5)
+        if self.thread.is_alive():
+            tf.compat.v1.logging.warn("{} did not exit in time.".format(self.thread.name))
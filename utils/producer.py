@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import os
+import time
+import queue
+import atexit
+import random
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+from multiprocessing import shared_memory
+from constants import RunMode
+from config import ModelConfig
+from exception import exception
+from utils.sparse import pack_padded
+from utils.tfrecord import read_records, record_count, shuffle_records, parse_example, RandomAccessReader
+
+# MaxLabelNum 未定义 (-1) 时单个样本标签的最大容量
+DEFAULT_LABEL_CAPACITY = 64
+
+
+class SlotLayout(object):
+    """共享内存环形缓冲区中单个批次槽位的内存布局"""
+
+    def __init__(self, batch, input_shape, label_capacity, input_dtype=np.float32):
+        self.batch = batch
+        self.input_shape = [batch] + list(input_shape)
+        self.input_dtype = np.dtype(input_dtype)
+        self.label_shape = [batch, label_capacity]
+        # 按8字节对齐，保证其后的 int32 视图对齐
+        self.input_bytes = -(-int(np.prod(self.input_shape)) * self.input_dtype.itemsize // 8) * 8
+        self.label_bytes = int(np.prod(self.label_shape)) * 4
+        self.length_bytes = batch * 4
+        self.slot_bytes = self.input_bytes + self.label_bytes + self.length_bytes + 4
+
+    def views(self, buffer, slot):
+        """返回槽位的 (inputs, labels, lengths, count) numpy 视图，不产生拷贝"""
+        offset = slot * self.slot_bytes
+        inputs = np.ndarray(self.input_shape, dtype=self.input_dtype, buffer=buffer, offset=offset)
+        offset += self.input_bytes
+        labels = np.ndarray(self.label_shape, dtype=np.int32, buffer=buffer, offset=offset)
+        offset += self.label_bytes
+        lengths = np.ndarray([self.batch], dtype=np.int32, buffer=buffer, offset=offset)
+        offset += self.length_bytes
+        count = np.ndarray([1], dtype=np.int32, buffer=buffer, offset=offset)
+        return inputs, labels, lengths, count
+
+
+def produce(worker_index, worker_num, model_conf: ModelConfig, mode: RunMode, path, shm_name, layout: SlotLayout,
+            free_queue, ready_queue, buffer_size, shuffle_seed=None):
+    """
+    生产者进程：读取属于本进程的TFRecords分片，编码样本并写入空闲槽位；
+    传入 shuffle_seed 时各进程按同一个全局随机排列交错读取每一轮的记录
+    """
+    from utils.data import DataIterator
+    random.seed(os.getpid() ^ int(time.time() * 1000))
+    np.random.seed(random.randint(0, 2 ** 31 - 1))
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    feeder = DataIterator(model_conf=model_conf, mode=mode)
+    paths = path if isinstance(path, list) else [path]
+
+    def samples():
+        """逐条产出属于本进程的记录，每读完一轮产出 None 作为轮次结束标记"""
+        if shuffle_seed is not None:
+            reader = RandomAccessReader(paths)
+            epoch = 0
+            while True:
+                for record in reader.epoch(shuffle_seed + epoch, shard_index=worker_index, shard_num=worker_num):
+                    yield record
+                yield None
+                epoch += 1
+        while True:
+            # 按所有文件的全局记录序号分片，与随机读取的分片方式一致
+            start = 0
+            for p in paths:
+                records = read_records(p, shard_index=(worker_index - start) % worker_num, shard_num=worker_num)
+                for record in shuffle_records(records, buffer_size):
+                    yield record
+                start += record_count(p)
+            yield None
+
+    sample_iter = samples()
+    valid_num = 0
+    try:
+        while True:
+            slot = free_queue.get()
+            inputs, labels, lengths, count = layout.views(shm.buf, slot)
+            index = 0
+            while index < layout.batch:
+                record = next(sample_iter)
+                if record is None:
+                    # 完整一轮没有任何有效样本时继续读取只会空转，训练任务将永远等待就绪批次
+                    if not valid_num:
+                        exception(
+                            "No valid sample in shard {} of {} of the dataset {}.".format(
+                                worker_index, worker_num, paths
+                            )
+                        )
+                    valid_num = 0
+                    continue
+                sample = feeder.encode_sample(*parse_example(record))
+                if not sample:
+                    continue
+                input_array, label_array = sample
+                if len(label_array) > layout.label_shape[1]:
+                    continue
+                inputs[index] = input_array
+                labels[index, :len(label_array)] = label_array
+                lengths[index] = len(label_array)
+                index += 1
+                valid_num += 1
+            count[0] = index
+            del inputs, labels, lengths, count
+            ready_queue.put(slot)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shm.close()
+
+
+class BatchProducer(object):
+    """
+    多进程批次生产者：N个进程各自读取TFRecords的一个分片并完成 Encoder.image/Encoder.text 编码，
+    成品批次写入共享内存环形缓冲区，训练循环直接从中取批次而无需序列化
+    """
+
+    def __init__(self, model_conf: ModelConfig, mode: RunMode, path, batch, workers, input_shape,
+                 input_dtype=np.float32):
+        """
+        :param model_conf: 工程配置
+        :param mode: 运行模式（区分：训练/验证）
+        :param path: TFRecords文件路径
+        :param batch: 批次大小
+        :param workers: 生产者进程数，不应超过记录数，否则部分进程分不到记录
+        :param input_shape: 单个样本的输入形状，必须固定
+        :param input_dtype: 输入数据类型
+        """
+        self.workers = workers
+        self.layout = SlotLayout(
+            batch=batch,
+            input_shape=input_shape,
+            input_dtype=input_dtype,
+            label_capacity=model_conf.max_label_num * 2 if model_conf.max_label_num > 0 else DEFAULT_LABEL_CAPACITY
+        )
+        self.slots = workers * 2
+        self.shm = shared_memory.SharedMemory(create=True, size=self.layout.slot_bytes * self.slots)
+        context = multiprocessing.get_context()
+        self.free_queue = context.Queue()
+        self.ready_queue = context.Queue()
+        for slot in range(self.slots):
+            self.free_queue.put(slot)
+        buffer_size = max(int(1000 / workers), 1)
+        shuffle_seed = random.randint(0, 2 ** 31 - 1) if mode == RunMode.Trains and model_conf.global_shuffle else None
+        self.processes = [
+            context.Process(
+                target=produce,
+                args=(
+                    index, workers, model_conf.freeze(), mode, path, self.shm.name, self.layout,
+                    self.free_queue, self.ready_queue, buffer_size, shuffle_seed
+                ),
+                daemon=True
+            ) for index in range(workers)
+        ]
+        for process in self.processes:
+            process.start()
+        atexit.register(self.close)
+        tf.compat.v1.logging.info("Started {} batch producer processes.".format(workers))
+
+    def get(self):
+        """
+        取出一个就绪批次，拷贝后立即归还槽位
+        :return: (input_batch, (label_values, label_lengths))
+        """
+        while True:
+            try:
+                slot = self.ready_queue.get(timeout=1)
+                break
+            except queue.Empty:
+                if not any(process.is_alive() for process in self.processes):
+                    exception("All batch producer processes have exited.")
+        inputs, labels, lengths, count = self.layout.views(self.shm.buf, slot)
+        count = int(count[0])
+        input_batch = np.array(inputs[:count])
+        label_batch = pack_padded(labels[:count], lengths[:count])
+        del inputs, labels, lengths
+        self.free_queue.put(slot)
+        return input_batch, label_batch
+
+    def close(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            process.join()
+        self.processes = []
+        if self.shm:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
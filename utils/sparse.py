@@ -1,21 +1,43 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
 # Author: kerlomz <kerlomz@gmail.com>
+import itertools
 import numpy as np
 
 
+def pack_sequences(sequences):
+    """密集序列拼接为 (values, lengths)"""
+    lengths = np.fromiter((len(seq) for seq in sequences), dtype=np.int64, count=len(sequences))
+    values = list(itertools.chain.from_iterable(sequences))
+    return values, lengths
+
+
+def pack_padded(padded, lengths):
+    """补齐的二维标签数组按长度掩码拼接为 (values, lengths)"""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    mask = np.arange(padded.shape[1]) < lengths[:, np.newaxis]
+    return padded[mask], lengths
+
+
+def sparse_tuple_from_packed(values, lengths, dtype=np.int32):
+    """
+    由拼接后的标签值与各标签长度构建稀疏序列
+    :param values: 所有标签首尾拼接的值
+    :param lengths: 各标签长度
+    :param dtype: values 类型
+    :return: indices, values, shape
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    values = np.asarray(values, dtype=dtype)
+    rows = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    columns = np.arange(len(values), dtype=np.int64) - starts
+    indices = np.stack([rows, columns], axis=1)
+    shape = np.asarray([len(lengths), lengths.max() if len(lengths) else 0], dtype=np.int64)
+    return indices, values, shape
+
+
 def sparse_tuple_from_sequences(sequences, dtype=np.int32):
     """密集序列转稀疏序列"""
-    indices = []
-    values = []
-    for n, seq in enumerate(sequences):
-        indices.extend(zip([n] * len(seq), range(0, len(seq), 1)))
-        values.extend(seq)
-
-    indices = np.asarray(indices, dtype=np.int64)
-    try:
-        values = np.asarray(values, dtype=dtype)
-    except Exception as e:
-        print(e, values)
-    shape = np.asarray([len(sequences), np.asarray(indices).max(0)[1] + 1], dtype=np.int64)
-    return indices, values, shape
+    values, lengths = pack_sequences(sequences)
+    return sparse_tuple_from_packed(values, lengths, dtype=dtype)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import queue
+import threading
+import tensorflow as tf
+
+
+class SummaryScheduler(object):
+    """
+    摘要调度：标量摘要按固定间隔计算，直方图及图片摘要以更低频率采样，
+    其余训练步仅运行 cost 及 train_op；摘要由后台线程解析并写入事件文件
+    """
+
+    def __init__(self, writer, global_step, scalar=None, scalar_steps=100,
+                 histogram=None, histogram_steps=0, image=None, image_steps=0):
+        """
+        :param writer: tf.compat.v1.summary.FileWriter
+        :param global_step: 当前的全局步数
+        :param scalar: 标量摘要张量
+        :param scalar_steps: 标量摘要的间隔步数
+        :param histogram: 直方图摘要张量
+        :param histogram_steps: 直方图摘要的间隔步数，0为不启用
+        :param image: 图片摘要张量
+        :param image_steps: 图片摘要的间隔步数，0为不启用
+        """
+        self.writer = writer
+        self.step = global_step
+        self.schedule = [
+            (summary, steps) for summary, steps in [
+                (scalar, scalar_steps), (histogram, histogram_steps), (image, image_steps)
+            ] if summary is not None and steps
+        ]
+        self.queue = queue.Queue(maxsize=100)
+        self.thread = threading.Thread(target=self.run, name="SummaryWriter", daemon=True)
+        self.thread.start()
+
+    def fetches(self):
+        """
+        :return: 下一训练步需要计算的摘要张量列表，多数训练步为空
+        """
+        self.step += 1
+        return [summary for summary, steps in self.schedule if self.step % steps == 0]
+
+    def add(self, summaries, step):
+        """
+        将摘要交由后台线程写入
+        :param summaries: 序列化的摘要或 Summary 对象
+        :param step: 对应的全局步数
+        """
+        for summary in summaries:
+            self.queue.put((summary, step))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            self.writer.add_summary(*item)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.writer.flush()
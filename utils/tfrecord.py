@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import os
+import json
+import mmap
+import random
+import struct
+import numpy as np
+import tensorflow as tf
+
+# TFRecord 单条记录格式: uint64 length | uint32 masked_crc32_of_length | byte data[length] | uint32 masked_crc32_of_data
+RECORD_HEADER_SIZE = 12
+RECORD_FOOTER_SIZE = 4
+# 分片数据集: {数据集路径}-{分片序号}-of-{分片总数}，完成情况记录于 {数据集路径}.manifest.json
+SHARD_NAME_FORMAT = "{}-{:05d}-of-{:05d}"
+MANIFEST_SUFFIX = ".manifest.json"
+# 索引文件 {TFRecords文件路径}.index: int64 数组保存每条记录的起始偏移，最后一项为文件大小
+INDEX_SUFFIX = ".index"
+# 张量格式的 input: 4字节标识 | int32 高, 宽, 通道 (小端) | uint8 数据
+TENSOR_MAGIC = b'TNSR'
+TENSOR_HEADER = struct.Struct('<3i')
+TENSOR_HEADER_SIZE = len(TENSOR_MAGIC) + TENSOR_HEADER.size
+
+
+def shard_path(path, shard_index, shard_num):
+    return SHARD_NAME_FORMAT.format(path, shard_index, shard_num)
+
+
+def manifest_path(path):
+    return path + MANIFEST_SUFFIX
+
+
+def read_manifest(path):
+    """读取分片清单，不存在时返回 None"""
+    if not os.path.exists(manifest_path(path)):
+        return None
+    with open(manifest_path(path), "r", encoding="utf8") as f:
+        return json.load(f)
+
+
+def write_manifest(path, manifest):
+    """先写临时文件再替换，中断时不会留下不完整的清单"""
+    temp_path = manifest_path(path) + ".tmp"
+    with open(temp_path, "w", encoding="utf8") as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, manifest_path(path))
+
+
+def dataset_exists(path):
+    """单文件数据集存在，或分片数据集的所有分片均已完成"""
+    if os.path.isfile(path):
+        return True
+    manifest = read_manifest(path)
+    return bool(manifest) and len(manifest['completed']) == manifest['shards']
+
+
+def expand_shards(path):
+    """
+    展开数据集路径，分片数据集替换为已完成的分片文件路径
+    :param path: TFRecords文件路径或路径列表
+    :return: 文件路径列表
+    """
+    paths = path if isinstance(path, list) else [path]
+    files = []
+    for p in paths:
+        manifest = None if os.path.isfile(p) else read_manifest(p)
+        if not manifest:
+            files.append(p)
+            continue
+        files += [
+            shard_path(p, int(index), manifest['shards']) for index in sorted(manifest['completed'], key=int)
+        ]
+    return files
+
+
+def index_path(path):
+    return path + INDEX_SUFFIX
+
+
+def record_size(length):
+    """单条记录在文件中占用的字节数"""
+    return RECORD_HEADER_SIZE + length + RECORD_FOOTER_SIZE
+
+
+def write_index(path, offsets):
+    """
+    写入索引文件
+    :param path: TFRecords文件路径
+    :param offsets: 每条记录的起始偏移及文件大小，共 N+1 项
+    """
+    temp_path = index_path(path) + ".tmp"
+    with open(temp_path, "wb") as f:
+        np.save(f, np.asarray(offsets, dtype=np.int64))
+    os.replace(temp_path, index_path(path))
+
+
+def read_index(path):
+    """
+    以内存映射读取索引文件，只在访问时加载用到的部分，
+    不存在或与TFRecords文件不一致 (文件大小不同或索引较旧) 时返回 None
+    """
+    if not os.path.exists(index_path(path)):
+        return None
+    if os.path.getmtime(index_path(path)) < os.path.getmtime(path):
+        return None
+    try:
+        offsets = np.load(index_path(path), mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    if len(offsets) < 1 or offsets[-1] != os.path.getsize(path):
+        return None
+    return offsets
+
+
+def scan_offsets(path):
+    """只读取记录头部计算每条记录的起始偏移"""
+    offsets = [0]
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(RECORD_HEADER_SIZE)
+            if len(header) < RECORD_HEADER_SIZE:
+                break
+            length, = struct.unpack('<Q', header[:8])
+            f.seek(length + RECORD_FOOTER_SIZE, 1)
+            offsets.append(offsets[-1] + record_size(length))
+    return np.asarray(offsets, dtype=np.int64)
+
+
+def record_offsets(path):
+    """
+    记录偏移索引，索引文件缺失或过期时扫描文件并尝试重新生成索引
+    :param path: TFRecords文件路径
+    :return: int64 数组，共 N+1 项
+    """
+    offsets = read_index(path)
+    if offsets is not None:
+        return offsets
+    tf.compat.v1.logging.info('Index of {} is missing or stale, scanning records...'.format(path))
+    offsets = scan_offsets(path)
+    try:
+        write_index(path, offsets)
+    except OSError:
+        pass
+    return offsets
+
+
+def record_count(path):
+    """TFRecords文件的记录数，索引有效时只读取数组头部及最后一项"""
+    return record_offsets(path).shape[0] - 1
+
+
+def read_records(path, shard_index=0, shard_num=1):
+    """
+    顺序读取TFRecords文件中的记录 (不校验CRC)，不属于当前分片的记录只跳过不读取
+    :param path: TFRecords文件路径
+    :param shard_index: 分片序号
+    :param shard_num: 分片总数
+    :return: 记录bytes生成器
+    """
+    with open(path, "rb") as f:
+        index = 0
+        while True:
+            header = f.read(RECORD_HEADER_SIZE)
+            if len(header) < RECORD_HEADER_SIZE:
+                break
+            length, = struct.unpack('<Q', header[:8])
+            if index % shard_num == shard_index:
+                data = f.read(length)
+                f.seek(RECORD_FOOTER_SIZE, 1)
+                yield data
+            else:
+                f.seek(length + RECORD_FOOTER_SIZE, 1)
+            index += 1
+
+
+def shuffle_records(records, buffer_size):
+    """与 tf.data.Dataset.shuffle 相同的缓冲区随机打乱"""
+    buffer = []
+    for record in records:
+        if len(buffer) < buffer_size:
+            buffer.append(record)
+            continue
+        index = random.randrange(buffer_size)
+        yield buffer[index]
+        buffer[index] = record
+    random.shuffle(buffer)
+    for record in buffer:
+        yield record
+
+
+def pack_tensor(array: np.ndarray):
+    """[高, 宽, 通道] 的 uint8 数组序列化为带形状头的bytes"""
+    return TENSOR_MAGIC + TENSOR_HEADER.pack(*array.shape) + np.ascontiguousarray(array, dtype=np.uint8).tobytes()
+
+
+def is_tensor(data):
+    return isinstance(data, bytes) and data[:len(TENSOR_MAGIC)] == TENSOR_MAGIC
+
+
+def unpack_tensor(data: bytes):
+    """pack_tensor 的逆操作，返回只读的 [高, 宽, 通道] uint8 数组 (不复制)"""
+    shape = TENSOR_HEADER.unpack_from(data, len(TENSOR_MAGIC))
+    return np.frombuffer(data, dtype=np.uint8, offset=TENSOR_HEADER_SIZE).reshape(shape)
+
+
+def parse_example(record):
+    """解析 tf.train.Example 序列化记录为 (input, label)"""
+    feature = tf.train.Example.FromString(record).features.feature
+    return feature['input'].bytes_list.value[0], feature['label'].bytes_list.value[0]
+
+
+class RandomAccessReader(object):
+    """
+    基于内存映射及记录偏移索引的随机读取，每轮按全部记录的一个完整随机排列读取，
+    内存占用只与索引大小相关
+    """
+
+    def __init__(self, path):
+        """
+        :param path: TFRecords文件路径或路径列表
+        """
+        self.paths = path if isinstance(path, list) else [path]
+        self.files = []
+        self.maps = []
+        file_index, starts, ends = [], [], []
+        for i, p in enumerate(self.paths):
+            offsets = record_offsets(p)
+            file_index.append(np.full(len(offsets) - 1, i, dtype=np.int32))
+            starts.append(offsets[:-1] + RECORD_HEADER_SIZE)
+            ends.append(offsets[1:] - RECORD_FOOTER_SIZE)
+            f = open(p, "rb")
+            self.files.append(f)
+            self.maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if offsets[-1] > 0 else b'')
+        self.file_index = np.concatenate(file_index) if file_index else np.zeros([0], dtype=np.int32)
+        self.starts = np.concatenate(starts) if starts else np.zeros([0], dtype=np.int64)
+        self.ends = np.concatenate(ends) if ends else np.zeros([0], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def record(self, index):
+        return self.maps[self.file_index[index]][self.starts[index]: self.ends[index]]
+
+    def epoch(self, seed=None, shard_index=0, shard_num=1):
+        """
+        按随机排列读取一轮记录
+        :param seed: 随机种子，多个分片读取同一轮时必须相同
+        :param shard_index: 分片序号，取排列中的第 shard_index::shard_num 项
+        :param shard_num: 分片总数
+        :return: 记录bytes生成器
+        """
+        permutation = np.random.RandomState(seed).permutation(len(self))
+        for index in permutation[shard_index::shard_num]:
+            yield self.record(index)
+
+    def close(self):
+        for m in self.maps:
+            if isinstance(m, mmap.mmap):
+                m.close()
+        for f in self.files:
+            f.close()
+        self.maps, self.files = [], []
@@ -2,13 +2,14 @@
 # -*- coding:utf-8 -*-
 # Author: kerlomz <kerlomz@gmail.com>
 import json
+import itertools
 import numpy as np
 import tensorflow as tf
 from config import ModelConfig
 
 
 class Validation(object):
-    """验证类，用于准确率计算"""
+    """验证类，用于准确率、字符错误率及混淆矩阵计算，结果跨批次累计"""
     def __init__(self, model: ModelConfig):
         """
         :param model: 读取配置文件获取当前工程的重要参数：category_num, category
@@ -16,61 +17,133 @@ class Validation(object):
         self.model = model
         self.category_num = self.model.category_num
         self.category = self.model.category
+        self.ignore_value = np.asarray([-1, self.category_num, 0])
+        # 字符表末尾追加空白符 '-'，越界的值同样映射为 '-'
+        self.charset = np.asarray(self.category + ['-'], dtype=object)
+        self.correct = 0
+        self.total = 0
+        self.distance = 0
+        self.label_length = 0
+        self.confusion = np.zeros([self.category_num, self.category_num], dtype=np.int64)
 
-    def accuracy_calculation(self, original_seq, decoded_seq):
+    def reset(self):
+        """清空累计的统计量"""
+        self.correct, self.total, self.distance, self.label_length = 0, 0, 0, 0
+        self.confusion[:] = 0
+
+    @staticmethod
+    def to_dense(seq):
+        """标签列表或解码结果转为以 -1 补齐的二维数组"""
+        if isinstance(seq, np.ndarray):
+            return seq.reshape(len(seq), -1).astype(np.int64)
+        seq = [item if isinstance(item, (list, tuple, np.ndarray)) else [item] for item in seq]
+        lengths = np.fromiter((len(item) for item in seq), dtype=np.int64, count=len(seq))
+        dense = np.full([len(seq), max(lengths.max(), 1) if len(seq) else 1], -1, dtype=np.int64)
+        dense[np.arange(dense.shape[1]) < lengths[:, np.newaxis]] = np.fromiter(
+            itertools.chain.from_iterable(seq), dtype=np.int64, count=int(lengths.sum())
+        )
+        return dense
+
+    def compact(self, dense):
+        """
+        掩码压缩：移除忽略值并将有效值左移，其余位置补 -1
+        :param dense: 二维数组
+        :return: (压缩后的数组, 各序列有效长度)
+        """
+        mask = ~np.isin(dense, self.ignore_value)
+        lengths = mask.sum(axis=1)
+        compacted = np.full(dense.shape, -1, dtype=np.int64)
+        compacted[np.arange(dense.shape[1]) < lengths[:, np.newaxis]] = dense[mask]
+        return compacted, lengths
+
+    @staticmethod
+    def levenshtein(source, source_lengths, target, target_lengths):
+        """
+        批量编辑距离，在批次维度上向量化的动态规划
+        :return: 各样本的编辑距离
+        """
+        batch, source_len, target_len = len(source), source.shape[1], target.shape[1]
+        table = np.zeros([batch, source_len + 1, target_len + 1], dtype=np.int64)
+        table[:, :, 0] = np.arange(source_len + 1)
+        table[:, 0, :] = np.arange(target_len + 1)
+        for i in range(1, source_len + 1):
+            substitution = source[:, i - 1, np.newaxis] != target
+            for j in range(1, target_len + 1):
+                table[:, i, j] = np.minimum(
+                    np.minimum(table[:, i - 1, j], table[:, i, j - 1]) + 1,
+                    table[:, i - 1, j - 1] + substitution[:, j - 1]
+                )
+        rows = np.arange(batch)
+        return table[rows, source_lengths, target_lengths]
+
+    def to_text(self, dense):
+        """二维数组转字符串，-1 为补齐值"""
+        return ["".join(self.charset[np.clip(row[row != -1], 0, self.category_num)]) for row in dense]
+
+    def accuracy_calculation(self, original_seq, decoded_seq, verbose=True):
         """
-        准确率计算函数
+        准确率计算函数，同时累计字符错误率及混淆矩阵
         :param original_seq: 密集数组-Y标签
         :param decoded_seq: 密集数组-预测标签
-        :return:
+        :param verbose: 是否输出错误样本
+        :return: 当前批次的准确率
         """
-        if isinstance(decoded_seq, np.ndarray):
-            decoded_seq = decoded_seq.tolist()
-
-        ignore_value = [-1, self.category_num, 0]
         original_seq_len = len(original_seq)
         decoded_seq_len = len(decoded_seq)
 
         if original_seq_len != decoded_seq_len:
-            tf.compat.v1.logging.error(original_seq)
-            tf.compat.v1.logging.error(decoded_seq)
             tf.compat.v1.logging.error('original lengths {} is different from the decoded_seq {}, please check again'.format(
                 original_seq_len,
                 decoded_seq_len
             ))
             return 0
-        count = 0
+
+        original, original_lengths = self.compact(self.to_dense(original_seq))
+        decoded, decoded_lengths = self.compact(self.to_dense(decoded_seq))
+        width = max(original.shape[1], decoded.shape[1])
+        original = np.pad(original, [(0, 0), (0, width - original.shape[1])], constant_values=-1)
+        decoded = np.pad(decoded, [(0, 0), (0, width - decoded.shape[1])], constant_values=-1)
+
+        matched = (original == decoded).all(axis=1)
+        count = int(matched.sum())
+        self.correct += count
+        self.total += original_seq_len
+        self.distance += int(self.levenshtein(original, original_lengths, decoded, decoded_lengths).sum())
+        self.label_length += int(original_lengths.sum())
+
+        # 长度一致的样本逐位对齐累计混淆矩阵
+        aligned = (original_lengths == decoded_lengths)[:, np.newaxis] & (original != -1)
+        np.add.at(self.confusion, (original[aligned], decoded[aligned]), 1)
 
         # Here is for debugging, positioning error source use
-        error_sample = []
-        for i, origin_label in enumerate(original_seq):
-
-            decoded_label = decoded_seq[i]
-            if isinstance(decoded_label, int):
-                decoded_label = [decoded_label]
-            processed_decoded_label = [j for j in decoded_label if j not in ignore_value]
-            processed_origin_label = [j for j in origin_label if j not in ignore_value]
-
-            if i < 5:
-                tf.compat.v1.logging.info(
-                    "{} {} {} {} {} --> {} {}".format(
-                        i,
-                        len(processed_origin_label),
-                        len(processed_decoded_label),
-                        origin_label,
-                        decoded_label,
-                        [self.category[_] if _ != self.category_num else '-' for _ in origin_label if _ != -1],
-                        [self.category[_] if _ != self.category_num else '-' for _ in decoded_label if _ != -1]
-                    )
-                )
-            if processed_origin_label == processed_decoded_label:
-                count += 1
-            # Training is not useful for decoding
-            # Here is for debugging, positioning error source use
-            if processed_origin_label != processed_decoded_label and len(error_sample) < 5:
-                error_sample.append({
-                    "origin": "".join([self.category[_] if _ != self.category_num else '-' for _ in origin_label if _ != -1]),
-                    "decode": "".join([self.category[_] if _ != self.category_num else '-' for _ in decoded_label if _ != -1])
-                })
-        tf.compat.v1.logging.error(json.dumps(error_sample, ensure_ascii=False))
-        return count * 1.0 / len(original_seq)
\ No newline at end of file
+        if verbose and count < original_seq_len:
+            error_index = np.flatnonzero(~matched)[:5]
+            error_sample = [
+                {"origin": origin, "decode": decode}
+                for origin, decode in zip(self.to_text(original[error_index]), self.to_text(decoded[error_index]))
+            ]
+            tf.compat.v1.logging.error(json.dumps(error_sample, ensure_ascii=False))
+        return count * 1.0 / original_seq_len
+
+    @property
+    def accuracy(self):
+        """累计的序列准确率"""
+        return self.correct / self.total if self.total else 0.
+
+    @property
+    def cer(self):
+        """累计的字符错误率 (编辑距离之和 / 标签长度之和)"""
+        return self.distance / self.label_length if self.label_length else 0.
+
+    def top_confusions(self, num=10):
+        """
+        混淆矩阵中出现次数最多的错误
+        :return: [(标签字符, 预测字符, 次数)]
+        """
+        errors = self.confusion.copy()
+        np.fill_diagonal(errors, 0)
+        index = np.argsort(errors, axis=None)[::-1][:num]
+        return [
+            (self.category[i], self.category[j], int(errors[i, j]))
+            for i, j in zip(*np.unravel_index(index, errors.shape)) if errors[i, j]
+        ]